@@ -1,21 +1,49 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, redirect, url_for
+from flask import Flask, Response, g, render_template, request, jsonify, send_from_directory, redirect, url_for
+from flask.json.provider import DefaultJSONProvider
+import atexit
+import base64
 import json
+import logging
 import os
+import threading
+import time
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime
 import urllib.parse
-from telegram_service import TelegramService  
+from telegram_service import REQUESTS_HISTORY_FILE, TelegramService, load_config, verify_webhook_secret
+from archive_store import ARCHIVE_DIR, ArchiveStore
+from calendar_view import CalendarView
+from contact_directory import ContactDirectory
+from event_bus import EventBus
+from journal_store import JournalStore
+from leader import LEADER_LOCK_FILE, LeaderElection
+from recurrence import RecurrenceEngine
+from search_index import TaskSearch
+from sqlite_store import STORAGE_BACKEND, SqliteStore
+from store_sync import StoreFollower
+from task_record import TaskRecord
+from task_stats import BREAKDOWNS, TaskStats
+from task_store import TaskStore
+import metrics
+
+# Уровень логирования задаётся переменной окружения LOG_LEVEL (DEBUG, INFO, WARNING...)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
+
+class TaskJSONProvider(DefaultJSONProvider):
+    # Записи задач из TaskStore отдаются в ответах обычными словарями
+    @staticmethod
+    def default(o):
+        if isinstance(o, TaskRecord):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
 
 app = Flask(__name__)
+app.json = TaskJSONProvider(app)
 
-# Инициализация TelegramService
-telegram_service = None
-if not app.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
-    try:
-        telegram_service = TelegramService()
-        telegram_service.start_reminder_thread()
-    except Exception as e:
-        print(f"Ошибка инициализации TelegramService: {e}")
+request_latency = metrics.histogram('http_request_duration_seconds', 'Длительность обработки HTTP-запроса',
+                                    ['method', 'route', 'status'])
 
 # Пути к файлам
 TASKS_FILE = 'tasks.json'
@@ -24,49 +52,193 @@ CATEGORIES_FILE = 'categories.json'
 USERS_FILE = 'users.json'
 UPLOAD_FOLDER = 'task_files'
 
+# Поле-ключ элементов каждой коллекции для журнала; категории журналируются без ключа.
+# Архив хранится отдельно (ArchiveStore), archived_tasks.json читается только для переноса
+STORE_KEYS = {
+    TASKS_FILE: 'id',
+    USERS_FILE: 'chat_id',
+    CATEGORIES_FILE: None
+}
+_stores = {}
+_sqlite_db = None
+
+def get_sqlite_db():
+    global _sqlite_db
+    if _sqlite_db is None:
+        _sqlite_db = SqliteStore()
+    return _sqlite_db
+
+def get_store(file_path):
+    store = _stores.get(file_path)
+    if store is None:
+        if STORAGE_BACKEND == 'sqlite':
+            # Таблицы базы называются так же, как JSON-файлы
+            store = get_sqlite_db().collection(os.path.splitext(file_path)[0])
+        else:
+            store = JournalStore(file_path, key=STORE_KEYS.get(file_path))
+        _stores[file_path] = store
+    return store
+
+@atexit.register
+def close_stores():
+    for store in _stores.values():
+        store.close()
+    if _sqlite_db is not None:
+        _sqlite_db.close()
+
+# Блокировка записи категорий и контактов. Списки categories и users не меняются
+# на месте: запись собирает новый список и подменяет глобальную ссылку, поэтому
+# читатели (маршруты GET, бот) обходят их без блокировки
+data_lock = threading.RLock()
+
+# Хеш-индексы для проверки ссылок из задач на контакты, группы и категории;
+# пересобираются при каждой загрузке и сохранении users и categories
+lookup = {'users': {}, 'groups': set(), 'categories': set()}
+
+def refresh_lookup(file_path, data):
+    if file_path == USERS_FILE:
+        lookup['users'] = {u['chat_id']: u for u in data}
+        lookup['groups'] = {u['group'] for u in data if u.get('group')}
+    elif file_path == CATEGORIES_FILE:
+        lookup['categories'] = {cat['name'] for cat in data}
+
 # Инициализация данных
 def load_data(file_path, default):
     try:
-        if os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                print(f"Загружено из {file_path}: {data}")  # Отладка: вывод содержимого файла
-                if file_path == TASKS_FILE:
-                    print(f"Задачи без даты в {file_path}: {[t for t in data if not t.get('datetime')]}")  # Отладка
-                return data
-        else:
-            print(f"Файл {file_path} не существует, создаём с данными по умолчанию: {default}")  # Отладка
-            save_data(file_path, default)
-            return default
+        if not os.path.exists(file_path) and not os.path.exists(get_store(file_path).journal_path):
+            logger.info("Файл %s не существует, создаём с данными по умолчанию", file_path)
+        data = get_store(file_path).load(default)
+        logger.debug("Загружено из %s: записей - %d", file_path, len(data))
+        refresh_lookup(file_path, data)
+        return data
     except Exception as e:
-        print(f"Ошибка загрузки {file_path}: {e}")
+        logger.error(f"Ошибка загрузки {file_path}: {e}")
         return default
 
 def save_data(file_path, data):
+    # В журнал попадают только изменившиеся элементы, снимок файла
+    # пересобирается фоновой компактизацией
+    started = time.monotonic()
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        get_store(file_path).sync(data)
+        metrics.save_duration.observe(file_path, value=time.monotonic() - started)
     except Exception as e:
-        print(f"Ошибка сохранения {file_path}: {e}")
+        logger.error(f"Ошибка сохранения {file_path}: {e}")
+    refresh_lookup(file_path, data)
+    if file_path in CHANGE_EVENTS:
+        event_bus.publish(CHANGE_EVENTS[file_path], data)
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
-if not os.path.exists(TASKS_FILE):
-    save_data(TASKS_FILE, [])
-if not os.path.exists(ARCHIVED_TASKS_FILE):
-    save_data(ARCHIVED_TASKS_FILE, [])
-if not os.path.exists(CATEGORIES_FILE):
-    save_data(CATEGORIES_FILE, [])
-if not os.path.exists(USERS_FILE):
-    save_data(USERS_FILE, [])
-
-tasks = load_data(TASKS_FILE, [])
-archived_tasks = load_data(ARCHIVED_TASKS_FILE, [])
+# События об изменениях для подключённых браузеров (GET /api/events)
+event_bus = EventBus()
+# Коллекции, которые рассылаются браузерам целиком при каждом сохранении
+CHANGE_EVENTS = {
+    CATEGORIES_FILE: 'categories',
+    USERS_FILE: 'users'
+}
+
+def publish_task_change(task_id, task):
+    # Изменения задач, в том числе созданных ботом, браузеры догружают через GET /api/tasks?since=
+    if task_id is None:
+        event_bus.publish('reset', {'revision': task_store.revision})
+    else:
+        event_bus.publish('task', {'revision': task_store.revision, 'id': task_id, 'deleted': task is None})
+
+# Несколько воркеров (gunicorn -w N) работают с общей базой SQLite: изменения других
+# процессов подтягиваются по журналу изменений базы начиная с этой ревизии
+sync_revision = get_sqlite_db().last_change() if STORAGE_BACKEND == 'sqlite' else None
+
+task_store = TaskStore(get_store(TASKS_FILE))
+store_follower = None
+if STORAGE_BACKEND == 'sqlite':
+    # Ревизия задач - номер в общем журнале изменений базы, одинаковый для всех воркеров,
+    # поэтому синхронизация подключается до загрузки; поток опроса запускается ниже
+    store_follower = StoreFollower(get_sqlite_db(), task_store, lambda table: reload_collection(table),
+                                   sync_revision, tick=lambda: leader_tick())
+task_store.load(load_data(TASKS_FILE, []))
+task_store.add_listener(publish_task_change)
+metrics.gauge('tasks_active', 'Активные задачи в хранилище', fn=lambda: len(task_store))
+# Индекс серий повторяющихся задач ведётся в каждом процессе, а экземпляры создаёт только ведущий
+recurrence = RecurrenceEngine(task_store)
+metrics.gauge('recurring_series_pending', 'Серии, ожидающие следующего экземпляра',
+              fn=recurrence.pending_count)
+calendar_view = CalendarView(task_store, recurrence)
+# Счётчики статистики обновляются при каждой мутации задач
+task_stats = TaskStats(task_store)
+metrics.gauge('tasks_overdue', 'Просроченные невыполненные задачи', fn=task_stats.overdue)
+# Архив загружается по сегментам только при просмотре, запросы активных задач его не читают
+if STORAGE_BACKEND == 'sqlite':
+    archive_store = get_sqlite_db().archive()
+else:
+    archive_store = ArchiveStore(ARCHIVE_DIR, legacy_file=ARCHIVED_TASKS_FILE)
+# Поисковый индекс задач обновляется при каждой мутации, индекс архива строится при первом поиске по архиву
+task_search = TaskSearch(task_store, archive_store)
 categories = load_data(CATEGORIES_FILE, [])
 users = load_data(USERS_FILE, [])
 
-# Маршруты
+def reload_collection(table):
+    """Перечитывает категории или контакты, изменённые другим процессом."""
+    global categories, users
+    file_path = f'{table}.json'
+    with data_lock:
+        data = get_store(file_path).reload()
+        refresh_lookup(file_path, data)
+        if file_path == CATEGORIES_FILE:
+            categories = data
+        elif file_path == USERS_FILE:
+            users = data
+    if file_path in CHANGE_EVENTS:
+        event_bus.publish(CHANGE_EVENTS[file_path], data)
+
+def start_leader():
+    # Повторяющиеся задачи создаются на сервере независимо от того, настроен ли бот
+    recurrence.start()
+    atexit.register(recurrence.stop)
+    start_bot()
+
+def start_bot():
+    # Инициализация TelegramService: бот работает с тем же хранилищем задач
+    global telegram_service
+    try:
+        telegram_service = TelegramService(task_store, lambda: users)
+        telegram_service.start_reminder_thread()
+        atexit.register(telegram_service.stop)
+    except Exception as e:
+        logger.error(f"Ошибка инициализации TelegramService: {e}")
+
+_leader_ticks = 0
+
+def leader_tick():
+    # Ведущий процесс обрабатывает обновления webhook, принятые другими воркерами,
+    # и раз в несколько минут обрезает журнал изменений базы
+    global _leader_ticks
+    if not leader or not leader.is_leader:
+        return
+    if telegram_service:
+        for update in get_sqlite_db().take_updates():
+            telegram_service.dispatch_update(update)
+    _leader_ticks += 1
+    if _leader_ticks % 300 == 0:
+        get_sqlite_db().prune_changes()
+
+# Бот (getUpdates), планировщик напоминаний и создание повторений работают только в одном, ведущем процессе,
+# выбранном блокировкой файла; при его завершении их подхватывает другой воркер
+telegram_service = None
+leader = None
+if not app.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    leader = LeaderElection(LEADER_LOCK_FILE, start_leader)
+    # Регистрируется раньше остановки бота, значит выполняется после неё
+    atexit.register(leader.stop)
+    leader.start()
+    if store_follower is not None:
+        store_follower.start()
+        atexit.register(store_follower.stop)
+    elif not leader.is_leader:
+        logger.warning("JSON-хранилище не синхронизируется между процессами: "
+                       "для нескольких воркеров нужен STORAGE_BACKEND=sqlite")
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -85,203 +257,372 @@ def redirect_script_js():
 
 @app.route('/api/tasks', methods=['GET'])
 def get_tasks():
-    tasks = load_data(TASKS_FILE, [])
-    archived_tasks = load_data(ARCHIVED_TASKS_FILE, [])
-    print('Все задачи:', tasks)  # Отладка: вывод всех задач
-    print('Задачи без даты:', [t for t in tasks if not t.get('datetime')])  # Отладка
-    print('Архивные задачи:', archived_tasks)  # Отладка
-    return jsonify({'tasks': tasks, 'archived_tasks': archived_tasks})
+    # ETag - ревизия хранилища: пока задачи и архив не менялись, отвечаем 304
+    revision = task_store.revision
+    if request.if_none_match.contains(str(revision)):
+        return tasks_response(Response(status=304), revision)
+
+    if any(param in request.args for param in TASK_QUERY_PARAMS):
+        return query_tasks(revision)
+
+    since = request.args.get('since', type=int)
+    changes = task_store.changes_since(since) if since is not None else None
+    if changes is not None:
+        # Только задачи, созданные, изменённые или удалённые после ревизии клиента
+        revision, tasks, deleted = changes
+        result = {'revision': revision, 'full': False, 'tasks': tasks, 'deleted': deleted}
+        return tasks_response(jsonify(result), revision)
+
+    tasks = task_store.snapshot()
+    result = {'revision': revision, 'full': True, 'tasks': tasks}
+    return tasks_response(jsonify(result), revision)
+
+@app.route('/api/calendar', methods=['GET'])
+def get_calendar():
+    # Задачи по дням диапазона from..to включительно; view=counts - только количества для обзора месяца
+    try:
+        date_from = request.args.get('from')
+        date_to = request.args.get('to') or date_from
+        if not date_from:
+            return jsonify({'error': 'Параметр from обязателен'}), 400
+        counts = request.args.get('view') == 'counts'
+        revision = task_store.revision
+        if request.if_none_match.contains(str(revision)):
+            return tasks_response(Response(status=304), revision)
+        days = calendar_view.days(date_from, date_to, counts=counts)
+    except ValueError as e:
+        return jsonify({'error': f'Неверные параметры запроса: {e}'}), 400
+    return tasks_response(jsonify({'revision': revision, 'from': date_from, 'to': date_to, 'days': days}),
+                          revision)
+
+@app.route('/api/events', methods=['GET'])
+def events():
+    # Браузер при переподключении сам передаёт id последнего полученного события
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    return Response(event_bus.stream(last_event_id), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# Параметры GET /api/tasks, при которых отдаётся отфильтрованная страница задач
+TASK_QUERY_PARAMS = ('date', 'from', 'to', 'category', 'group', 'chat_id', 'completed',
+                     'parent_id', 'cursor', 'limit')
+
+def query_tasks(revision):
+    args = request.args
+    try:
+        date_from = args.get('from') or args.get('date')
+        date_to = args.get('to') or args.get('date')
+        for value in (date_from, date_to):
+            if value:
+                datetime.fromisoformat(value)
+        filters = {
+            'date_from': date_from or None,
+            # Верхняя граница включительно: '2024-05-31' захватывает весь день
+            'date_to': date_to + '\uffff' if date_to else None,
+            'category': args.get('category'),
+            'group': args.get('group'),
+            'chat_id': int(args['chat_id']) if args.get('chat_id') else None,
+            'limit': int(args['limit']) if args.get('limit') else None
+        }
+        if 'completed' in args:
+            filters['completed'] = args['completed'].lower() in ('true', '1')
+        if 'parent_id' in args:
+            filters['parent_id'] = int(args['parent_id']) if args['parent_id'] not in ('', 'null') else None
+        if args.get('cursor'):
+            filters['after'] = json.loads(base64.urlsafe_b64decode(args['cursor']))
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'Неверные параметры запроса: {e}'}), 400
+    if filters['limit'] is not None and filters['limit'] <= 0:
+        return jsonify({'error': 'limit должен быть положительным'}), 400
+
+    # Курсор - ключ последней задачи страницы: [datetime, id] с фильтром по датам, [id] без него.
+    # Курсор от запроса с другими фильтрами или чужой JSON отклоняется
+    if 'after' in filters and not valid_cursor(filters['after'], by_date=bool(date_from or date_to)):
+        return jsonify({'error': 'Неверный курсор'}), 400
+
+    tasks, next_key = task_store.query(**filters)
+    next_cursor = base64.urlsafe_b64encode(json.dumps(next_key).encode()).decode() if next_key else None
+    return tasks_response(jsonify({'revision': revision, 'tasks': tasks, 'next_cursor': next_cursor}), revision)
+
+def valid_cursor(after, by_date):
+    if by_date:
+        return (isinstance(after, list) and len(after) == 2 and isinstance(after[0], str)
+                and isinstance(after[1], int) and not isinstance(after[1], bool))
+    return isinstance(after, list) and len(after) == 1 and is_task_id(after[0])
+
+def tasks_response(response, revision):
+    response.set_etag(str(revision))
+    # Браузер хранит ответ, но перед использованием всегда сверяет ETag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def prepare_new_task(task):
+    """Заполняет значения по умолчанию новой задачи; возвращает ошибку проверки или None."""
+    if not task or not task.get('text'):
+        return {'error': 'Текст задачи обязателен'}
+
+    # Конвертация chat_id в chat_ids для обратной совместимости
+    if 'chat_id' in task:
+        if task['chat_id']:
+            task['chat_ids'] = [task['chat_id']]
+        del task['chat_id']
+    
+    # Установка значений по умолчанию
+    task.setdefault('chat_ids', [])
+    task.setdefault('reminder_time', None)
+    task.setdefault('group', None)
+    task.setdefault('repeat_interval', None)
+    task.setdefault('repeat_count', None)
+    task.setdefault('repeat_until', None)
+    task.setdefault('original_task_id', None)
+    
+    # Проверка chat_ids
+    for cid in task.get('chat_ids') or []:
+        if cid not in lookup['users']:
+            return {'error': f'Контакт с chat_id {cid} не найден'}
+    
+    task.setdefault('completed', False)
+    task.setdefault('description', '')
+    task.setdefault('category', categories[0]['name'] if categories else 'Без категории')
+    task.setdefault('datetime', None)
+    task.setdefault('parent_id', None)
+    task.setdefault('dependencies', [])
+    task.setdefault('files', [])
+    
+    if task.get('parent_id'):
+        if not task_store.get(task['parent_id']):
+            return {'error': f'Родительская задача с ID {task["parent_id"]} не найдена'}
+
+    for dep_id in task['dependencies']:
+        if not task_store.get(dep_id):
+            return {'error': f'Зависимость с ID {dep_id} не найдена'}
+    
+    if task.get('group') and task['group'] not in lookup['groups']:
+        return {'error': f'Группа {task["group"]} не найдена в контактах'}
+    
+    if task.get('category') and task['category'] not in lookup['categories']:
+        return {'error': f'Категория {task["category"]} не найдена'}
+    return None
+
+def prepare_task_update(task, task_data):
+    """Копия задачи с изменениями из task_data: (копия, ошибка проверки или None).
+
+    ValueError - если chat_id не приводится к числу.
+    """
+    # Создаем копию задачи для изменений
+    task_copy = task.copy()
+    
+    # Обработка chat_id/chat_ids
+    if 'chat_id' in task_data:
+        task_data['chat_ids'] = [int(task_data['chat_id'])] if task_data['chat_id'] else []
+        del task_data['chat_id']
+    elif 'chat_ids' in task_data:
+        task_data['chat_ids'] = [int(cid) for cid in task_data['chat_ids'] if cid]
+        
+    allowed_fields = ['text', 'datetime', 'reminder_time', 'description', 'category', 
+             'completed', 'parent_id', 'dependencies', 'chat_ids', 'group',
+             'repeat_interval', 'repeat_count', 'repeat_until']
+    
+    # Обновляем только разрешенные поля
+    for field in allowed_fields:
+        if field in task_data:
+            if field == 'chat_ids':
+                # Проверяем каждый chat_id в списке
+                for cid in task_data['chat_ids']:
+                    if cid not in lookup['users']:
+                        return task_copy, {
+                            'error': f'Контакт с chat_id {cid} не найден',
+                            'available_users': [u['chat_id'] for u in users]
+                        }
+            elif field == 'group' and task_data['group']:
+                if task_data['group'] not in lookup['groups']:
+                    return task_copy, {
+                        'error': f'Группа {task_data["group"]} не найдена',
+                        'available_groups': list(lookup['groups'])
+                    }
+            elif field == 'category' and task_data['category']:
+                if task_data['category'] not in lookup['categories']:
+                    return task_copy, {
+                        'error': f'Категория {task_data["category"]} не найдена',
+                        'available_categories': [cat['name'] for cat in categories]
+                    }
+            elif field == 'dependencies':
+                for dep_id in task_data['dependencies']:
+                    if not task_store.get(dep_id):
+                        return task_copy, {
+                            'error': f'Зависимость с ID {dep_id} не найдена',
+                            'available_tasks': list(task_store.by_id)
+                        }
+            
+            task_copy[field] = task_data[field]
+    return task_copy, None
 
 @app.route('/api/tasks', methods=['POST'])
 def add_task():
     try:
         task = request.json
+        error = prepare_new_task(task)
+        if error:
+            return jsonify(error), 400
         
-        # Конвертация chat_id в chat_ids для обратной совместимости
-        if 'chat_id' in task:
-            if task['chat_id']:
-                task['chat_ids'] = [task['chat_id']]
-            del task['chat_id']
-        
-        # Установка значений по умолчанию
-        task.setdefault('chat_ids', [])
-        task.setdefault('reminder_time', None)
-        task.setdefault('group', None)
-        task.setdefault('repeat_interval', None)
-        task.setdefault('repeat_count', None)
-        task.setdefault('repeat_until', None)
-        task.setdefault('original_task_id', None)
-        
-        if not task or not task.get('text'):
-            return jsonify({'error': 'Текст задачи обязателен'}), 400
-        
-        # Проверка chat_ids
-        if task.get('chat_ids'):
-            for cid in task['chat_ids']:
-                if not any(u['chat_id'] == cid for u in users):
-                    return jsonify({'error': f'Контакт с chat_id {cid} не найден'}), 400
-        
-        task['id'] = max([t['id'] for t in tasks], default=0) + 1
-        task.setdefault('completed', False)
-        task.setdefault('description', '')
-        task.setdefault('category', categories[0]['name'] if categories else 'Без категории')
-        task.setdefault('datetime', None)
-        task.setdefault('parent_id', None)
-        task.setdefault('dependencies', [])
-        task.setdefault('files', [])
-        
-        if task.get('parent_id'):
-            parent_exists = any(t['id'] == task['parent_id'] for t in tasks)
-            if not parent_exists:
-                return jsonify({'error': f'Родительская задача с ID {task["parent_id"]} не найдена'}), 400
-
-        for dep_id in task['dependencies']:
-            if not any(t['id'] == dep_id for t in tasks):
-                return jsonify({'error': f'Зависимость с ID {dep_id} не найдена'}), 400
-        
-        if task.get('group') and not any(u['group'] == task['group'] for u in users):
-            return jsonify({'error': f'Группа {task["group"]} не найдена в контактах'}), 400
-        
-        if task.get('category') and not any(cat['name'] == task['category'] for cat in categories):
-            return jsonify({'error': f'Категория {task["category"]} не найдена'}), 400
-        
-        tasks.append(task)
-        save_data(TASKS_FILE, tasks)
+        task_store.create(task)
         return jsonify(task), 201
     except Exception as e:
-        print(f"Ошибка при добавлении задачи: {e}")
+        logger.error(f"Ошибка при добавлении задачи: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/tasks/<int:task_id>', methods=['PUT'])
 def update_task(task_id):
     try:
         task_data = request.json
-        tasks_list = list(tasks) if isinstance(tasks, tuple) else tasks
-        
-        task = next((t for t in tasks_list if t['id'] == task_id), None)
+        task = task_store.get(task_id)
         if not task:
             return jsonify({'error': 'Задача не найдена'}), 404
 
-        # Создаем копию задачи для изменений
-        task_copy = dict(task)
+        task_copy, error = prepare_task_update(task, task_data)
+        if error:
+            return jsonify(error), 400
         
-        # Обработка chat_id/chat_ids
-        if 'chat_id' in task_data:
-            task_data['chat_ids'] = [int(task_data['chat_id'])] if task_data['chat_id'] else []
-            del task_data['chat_id']
-        elif 'chat_ids' in task_data:
-            task_data['chat_ids'] = [int(cid) for cid in task_data['chat_ids'] if cid]
-            
-        allowed_fields = ['text', 'datetime', 'reminder_time', 'description', 'category', 
-                 'completed', 'parent_id', 'dependencies', 'chat_ids', 'group',
-                 'repeat_interval', 'repeat_count', 'repeat_until']
-        
-        # Обновляем только разрешенные поля
-        for field in allowed_fields:
-            if field in task_data:
-                if field == 'chat_ids':
-                    # Проверяем каждый chat_id в списке
-                    for cid in task_data['chat_ids']:
-                        if not any(u['chat_id'] == cid for u in users):
-                            return jsonify({
-                                'error': f'Контакт с chat_id {cid} не найден',
-                                'available_users': [u['chat_id'] for u in users]
-                            }), 400
-                elif field == 'group' and task_data['group']:
-                    if not any(u['group'] == task_data['group'] for u in users):
-                        return jsonify({
-                            'error': f'Группа {task_data["group"]} не найдена',
-                            'available_groups': list(set(u['group'] for u in users if u['group']))
-                        }), 400
-                elif field == 'category' and task_data['category']:
-                    if not any(cat['name'] == task_data['category'] for cat in categories):
-                        return jsonify({
-                            'error': f'Категория {task_data["category"]} не найдена',
-                            'available_categories': [cat['name'] for cat in categories]
-                        }), 400
-                elif field == 'dependencies':
-                    for dep_id in task_data['dependencies']:
-                        if not any(t['id'] == dep_id for t in tasks_list):
-                            return jsonify({
-                                'error': f'Зависимость с ID {dep_id} не найдена',
-                                'available_tasks': [t['id'] for t in tasks_list]
-                            }), 400
-                
-                task_copy[field] = task_data[field]
-        
-        # Обновляем оригинальную задачу в списке
-        for i, t in enumerate(tasks_list):
-            if t['id'] == task_id:
-                tasks_list[i] = task_copy
-                break
-                
-        save_data(TASKS_FILE, tasks_list)
+        # Заменяем оригинальную задачу в хранилище
+        task_store.replace(task_copy)
         return jsonify(task_copy)
     except ValueError as e:
-        print(f"Ошибка преобразования типов: {e}")
+        logger.error(f"Ошибка преобразования типов: {e}")
         return jsonify({
             'error': 'Некорректный формат данных',
             'details': str(e)
         }), 400
     except Exception as e:
-        print(f"Ошибка при обновлении задачи: {e}")
+        logger.error(f"Ошибка при обновлении задачи: {e}")
         return jsonify({
             'error': 'Внутренняя ошибка сервера',
             'details': str(e)
         }), 500
 
+def is_task_id(value):
+    # bool - подкласс int, но id задачи им не бывает
+    return isinstance(value, int) and not isinstance(value, bool)
+
+@app.route('/api/tasks/batch', methods=['POST'])
+def batch_tasks():
+    """Пакет изменений задач: {"create": [...], "update": [{"id": ..., поля}], "delete": [id]}.
+
+    Все элементы проверяются до применения; если хотя бы один не прошёл
+    проверку, ничего не меняется и ответ 400 содержит ошибки по элементам.
+    Иначе пакет применяется атомарно и сохраняется одной записью.
+    """
+    try:
+        data = request.json or {}
+        creates = data.get('create') or []
+        updates = data.get('update') or []
+        deletes = data.get('delete') or []
+        results = {'create': [], 'update': [], 'delete': []}
+        failed = False
+
+        # Проверка и применение идут под блокировкой записи: параллельное
+        # удаление не попадёт между ними
+        with task_store.write_lock():
+            for task in creates:
+                error = prepare_new_task(task) if isinstance(task, dict) else {'error': 'Ожидается объект задачи'}
+                results['create'].append(error or {'success': True})
+                failed = failed or bool(error)
+
+            updated = {}
+            for task_data in updates:
+                task_id = task_data.get('id') if isinstance(task_data, dict) else None
+                if not is_task_id(task_id):
+                    results['update'].append({'error': 'ID задачи должен быть целым числом'})
+                    failed = True
+                    continue
+                # Несколько изменений одной задачи применяются по очереди
+                task = updated.get(task_id) or task_store.get(task_id)
+                if not task:
+                    error = {'error': f'Задача с ID {task_id} не найдена'}
+                else:
+                    try:
+                        task, error = prepare_task_update(task, task_data)
+                    except (TypeError, ValueError) as e:
+                        error = {'error': 'Некорректный формат данных', 'details': str(e)}
+                    if not error:
+                        updated[task_id] = task
+                results['update'].append(error or {'success': True})
+                failed = failed or bool(error)
+
+            for task_id in deletes:
+                if not is_task_id(task_id):
+                    error = {'error': 'ID задачи должен быть целым числом'}
+                else:
+                    error = None if task_store.get(task_id) else {'error': f'Задача с ID {task_id} не найдена'}
+                results['delete'].append(error or {'success': True})
+                failed = failed or bool(error)
+
+            if failed:
+                return jsonify({'success': False, 'results': results}), 400
+
+            removed = task_store.apply_batch(creates, list(updated.values()), deletes)
+        removed_ids = {task['id'] for task in removed}
+        for result, task in zip(results['create'], creates):
+            result['task'] = task
+        for result, task_data in zip(results['update'], updates):
+            task = updated[task_data['id']]
+            if task['id'] in removed_ids:
+                result['deleted'] = True
+            else:
+                result['task'] = task
+        return jsonify({'success': True, 'results': results, 'deleted_ids': sorted(removed_ids)})
+    except Exception as e:
+        logger.error(f"Ошибка при пакетном изменении задач: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/tasks/<int:task_id>', methods=['DELETE'])
 def delete_task(task_id):
     try:
-        global tasks
-        def remove_subtasks(task_id_to_remove):
-            global tasks
-            tasks[:] = [t for t in tasks if t['id'] != task_id_to_remove]
-            for task in tasks[:]:
-                if task.get('parent_id') == task_id_to_remove:
-                    remove_subtasks(task['id'])
-        remove_subtasks(task_id)
-        save_data(TASKS_FILE, tasks)
+        # Удаляем задачу вместе со всеми подзадачами
+        task_store.remove_subtree(task_id)
         return jsonify({'success': True})
     except Exception as e:
-        print(f"Ошибка при удалении задачи: {e}")
+        logger.error(f"Ошибка при удалении задачи: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/archive', methods=['GET'])
+def get_archive():
+    try:
+        limit = request.args.get('limit', 50, type=int)
+        if limit <= 0:
+            return jsonify({'error': 'limit должен быть положительным'}), 400
+        tasks, next_cursor = archive_store.page(request.args.get('cursor'), limit)
+        return jsonify({'tasks': tasks, 'next_cursor': next_cursor, 'total': len(archive_store)})
+    except ValueError:
+        return jsonify({'error': 'Неверный курсор'}), 400
+    except Exception as e:
+        logger.error(f"Ошибка при получении архива: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/archive/<int:task_id>', methods=['DELETE'])
 def delete_archived_task(task_id):
     try:
-        global archived_tasks
-        archived_tasks[:] = [t for t in archived_tasks if t['id'] != task_id]
-        save_data(ARCHIVED_TASKS_FILE, archived_tasks)
+        archive_store.delete(task_id)
+        event_bus.publish('archive', {'total': len(archive_store)})
         return jsonify({'success': True})
     except Exception as e:
-        print(f"Ошибка при удалении архивной задачи: {e}")
+        logger.error(f"Ошибка при удалении архивной задачи: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/archive', methods=['POST'])
 def archive_completed():
     try:
-        global tasks, archived_tasks
-        def get_all_subtasks(task_id):
-            subtasks = [t for t in tasks if t.get('parent_id') == task_id]
-            result = []
-            for subtask in subtasks:
-                result.append(subtask)
-                result.extend(get_all_subtasks(subtask['id']))
-            return result
-
+        # Выполненные задачи переносим в архив вместе со всеми подзадачами
         completed_tasks = []
-        for task in tasks[:]:
-            if task['completed']:
-                completed_tasks.append(task)
-                completed_tasks.extend(get_all_subtasks(task['id']))
-        tasks[:] = [t for t in tasks if not t['completed'] and t.get('parent_id') not in [ct['id'] for ct in completed_tasks]]
-        archived_tasks.extend(completed_tasks)
-        save_data(TASKS_FILE, tasks)
-        save_data(ARCHIVED_TASKS_FILE, archived_tasks)
+        # Последний выполненный экземпляр повторяющейся задачи остаётся до создания следующего
+        for task in task_store.completed():
+            if task_store.get(task['id']) and not recurrence.holds_series(task['id']):
+                completed_tasks.extend(task_store.remove_subtree(task['id']))
+        archive_store.append(completed_tasks)
+        event_bus.publish('archive', {'total': len(archive_store)})
         return jsonify({'success': True})
     except Exception as e:
-        print(f"Ошибка при архивировании задач: {e}")
+        logger.error(f"Ошибка при архивировании задач: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/categories', methods=['GET'])
@@ -293,59 +634,62 @@ def add_category():
     try:
         global categories
         category = request.json
-        print(f"Получен запрос на добавление категории: {category}")
+        logger.debug("Получен запрос на добавление категории: %s", category)
         if not category.get('name'):
             return jsonify({'error': 'Название категории обязательно'}), 400
         color = category.get('color') if category.get('color') else None
         if color and (not color.startswith('#') or len(color) not in [4, 7]):
             return jsonify({'error': 'Неверный формат цвета (должен быть HEX, например #FFF или #FFFFFF)'}), 400
-        if any(cat['name'] == category['name'] for cat in categories):
-            return jsonify({'error': f'Категория "{category["name"]}" уже существует'}), 400
-        new_category = {'name': category['name'], 'color': color}
-        categories.append(new_category)
-        try:
-            save_data(CATEGORIES_FILE, categories)
-            print(f"Категория {new_category['name']} успешно сохранена")
-        except Exception as e:
-            print(f"Ошибка при сохранении categories.json: {e}")
-            return jsonify({'error': 'Ошибка сохранения категории на сервере'}), 500
+        with data_lock:
+            if category['name'] in lookup['categories']:
+                return jsonify({'error': f'Категория "{category["name"]}" уже существует'}), 400
+            new_category = {'name': category['name'], 'color': color}
+            categories = categories + [new_category]
+            try:
+                save_data(CATEGORIES_FILE, categories)
+                logger.info(f"Категория {new_category['name']} успешно сохранена")
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении categories.json: {e}")
+                return jsonify({'error': 'Ошибка сохранения категории на сервере'}), 500
         return jsonify({'success': True, 'category': new_category}), 201
     except Exception as e:
-        print(f"Ошибка при добавлении категории: {e}")
+        logger.error(f"Ошибка при добавлении категории: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/categories/<category>', methods=['PUT'])
 def update_category(category):
     try:
-        global categories, tasks
+        global categories
         category = urllib.parse.unquote(category)
         category_data = request.json
-        print(f"Получен запрос на обновление категории: {category_data}")
+        logger.debug("Получен запрос на обновление категории: %s", category_data)
         if not category_data.get('name'):
             return jsonify({'error': 'Название категории обязательно'}), 400
         color = category_data.get('color') if category_data.get('color') else None
         if color and (not color.startswith('#') or len(color) not in [4, 7]):
             return jsonify({'error': 'Неверный формат цвета (должен быть HEX, например #FFF или #FFFFFF)'}), 400
-        if any(cat['name'] == category_data['name'] and cat['name'] != category for cat in categories):
-            return jsonify({'error': f'Категория "{category_data["name"]}" уже существует'}), 400
-        
-        category_obj = next((cat for cat in categories if cat['name'] == category), None)
-        if not category_obj:
-            return jsonify({'error': 'Категория не найдена'}), 404
-        
-        old_name = category_obj['name']
-        category_obj['name'] = category_data['name']
-        category_obj['color'] = color
-        
-        for task in tasks:
-            if task['category'] == old_name:
-                task['category'] = category_data['name']
-        
-        save_data(CATEGORIES_FILE, categories)
-        save_data(TASKS_FILE, tasks)
+        with data_lock:
+            if category_data['name'] != category and category_data['name'] in lookup['categories']:
+                return jsonify({'error': f'Категория "{category_data["name"]}" уже существует'}), 400
+            
+            if category not in lookup['categories']:
+                return jsonify({'error': 'Категория не найдена'}), 404
+            
+            category_obj = {'name': category_data['name'], 'color': color}
+            categories = [category_obj if cat['name'] == category else cat for cat in categories]
+            
+            # Переименованные задачи сохраняются одним пакетом; выборка и запись
+            # под блокировкой записи, чтобы параллельное удаление не попало между ними
+            with task_store.write_lock():
+                renamed = [dict(task.copy(), category=category_data['name'])
+                           for task in task_store.snapshot() if task.category == category]
+                if renamed:
+                    task_store.apply_batch(updated=renamed)
+            
+            save_data(CATEGORIES_FILE, categories)
         return jsonify({'success': True, 'category': category_obj})
     except Exception as e:
-        print(f"Ошибка при обновлении категории: {e}")
+        logger.error(f"Ошибка при обновлении категории: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/categories/<category>', methods=['DELETE'])
@@ -353,16 +697,16 @@ def delete_category(category):
     try:
         global categories
         category = urllib.parse.unquote(category)
-        if any(task['category'] == category for task in tasks):
-            return jsonify({'error': 'Нельзя удалить категорию, связанную с задачами'}), 400
-        category_obj = next((cat for cat in categories if cat['name'] == category), None)
-        if not category_obj:
-            return jsonify({'error': 'Категория не найдена'}), 404
-        categories[:] = [cat for cat in categories if cat['name'] != category]
-        save_data(CATEGORIES_FILE, categories)
+        with data_lock:
+            if any(task.category == category for task in task_store.snapshot()):
+                return jsonify({'error': 'Нельзя удалить категорию, связанную с задачами'}), 400
+            if category not in lookup['categories']:
+                return jsonify({'error': 'Категория не найдена'}), 404
+            categories = [cat for cat in categories if cat['name'] != category]
+            save_data(CATEGORIES_FILE, categories)
         return jsonify({'success': True})
     except Exception as e:
-        print(f"Ошибка при удалении категории: {e}")
+        logger.error(f"Ошибка при удалении категории: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/categories/reorder', methods=['POST'])
@@ -372,24 +716,30 @@ def reorder_categories():
         new_order = request.json.get('categories')
         if not new_order or not isinstance(new_order, list):
             return jsonify({'error': 'Неверный формат данных'}), 400
-        categories[:] = new_order
-        save_data(CATEGORIES_FILE, categories)
+        with data_lock:
+            categories = list(new_order)
+            save_data(CATEGORIES_FILE, categories)
         return jsonify({'success': True})
     except Exception as e:
-        print(f"Ошибка при переупорядочивании категорий: {e}")
+        logger.error(f"Ошибка при переупорядочивании категорий: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/users', methods=['GET'])
 def get_users():
     try:
-        global users
-        users = load_data(USERS_FILE, [])
-        print(f"Returning users: {users}")
+        logger.debug("Returning users: %s", users)
         return jsonify(users)
     except Exception as e:
-        print(f"Error in /api/users: {e}")
+        logger.error(f"Error in /api/users: {e}")
         return jsonify({'error': str(e)}), 500
 
+def find_contact(username):
+    if telegram_service:
+        return telegram_service.get_chat_id_by_username(username)
+    # Бот работает в другом воркере - читаем сохранённый им справочник собеседников
+    entry = ContactDirectory(REQUESTS_HISTORY_FILE).find_by_username(username)
+    return {'chat_id': entry['chat_id'], 'name': entry.get('name', username)} if entry else None
+
 @app.route('/api/users', methods=['POST'])
 def add_user():
     try:
@@ -399,25 +749,27 @@ def add_user():
             return jsonify({'error': 'Username должен начинаться с @'}), 400
         
         global users
-        users = load_data(USERS_FILE, [])
-        if any(u['username'] == username for u in users):
-            return jsonify({'error': 'Пользователь с таким username уже существует'}), 400
-        
-        user_info = telegram_service.get_chat_id_by_username(username) if telegram_service else None
-        if not user_info or not user_info.get('chat_id'):
-            return jsonify({'error': 'Пользователь не найден в Telegram или не взаимодействовал с ботом'}), 404
-        
-        user = {
-            'chat_id': user_info['chat_id'],
-            'name': user_info.get('name', username),
-            'username': username,
-            'group': user_data.get('group', '')
-        }
-        users.append(user)
-        save_data(USERS_FILE, users)
+        with data_lock:
+            current = load_data(USERS_FILE, [])
+            if any(u['username'] == username for u in current):
+                return jsonify({'error': 'Пользователь с таким username уже существует'}), 400
+            
+            user_info = find_contact(username)
+            if not user_info or not user_info.get('chat_id'):
+                return jsonify({'error': 'Пользователь не найден в Telegram или не взаимодействовал с ботом'}), 404
+            
+            user = {
+                'chat_id': user_info['chat_id'],
+                'name': user_info.get('name', username),
+                'username': username,
+                'group': user_data.get('group', '')
+            }
+            current.append(user)
+            save_data(USERS_FILE, current)
+            users = current
         return jsonify(user), 201
     except Exception as e:
-        print(f"Ошибка при добавлении пользователя: {e}")
+        logger.error(f"Ошибка при добавлении пользователя: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/users/<int:chat_id>', methods=['PUT'])
@@ -425,52 +777,70 @@ def update_user(chat_id):
     try:
         user_data = request.json
         global users
-        users = load_data(USERS_FILE, [])
-        user = next((u for u in users if u['chat_id'] == chat_id), None)
-        if not user:
-            return jsonify({'error': 'Пользователь не найден'}), 404
-        
-        allowed_fields = ['name', 'group']
-        for field in allowed_fields:
-            if field in user_data:
-                user[field] = user_data[field]
-        
-        save_data(USERS_FILE, users)
+        with data_lock:
+            current = load_data(USERS_FILE, [])
+            user = next((u for u in current if u['chat_id'] == chat_id), None)
+            if not user:
+                return jsonify({'error': 'Пользователь не найден'}), 404
+            
+            allowed_fields = ['name', 'group']
+            for field in allowed_fields:
+                if field in user_data:
+                    user[field] = user_data[field]
+            
+            save_data(USERS_FILE, current)
+            users = current
         return jsonify(user)
     except Exception as e:
-        print(f"Ошибка при обновлении пользователя: {e}")
+        logger.error(f"Ошибка при обновлении пользователя: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/users/<int:chat_id>', methods=['DELETE'])
 def delete_user(chat_id):
     try:
         global users
-        users = load_data(USERS_FILE, [])
-        user = next((u for u in users if u['chat_id'] == chat_id), None)
-        if not user:
-            return jsonify({'error': 'Пользователь не найден'}), 404
-        
-        users[:] = [u for u in users if u['chat_id'] != chat_id]
-        save_data(USERS_FILE, users)
+        with data_lock:
+            if chat_id not in lookup['users']:
+                return jsonify({'error': 'Пользователь не найден'}), 404
+            
+            current = [u for u in load_data(USERS_FILE, []) if u['chat_id'] != chat_id]
+            save_data(USERS_FILE, current)
+            users = current
         return jsonify({'success': True})
     except Exception as e:
-        print(f"Ошибка при удалении пользователя: {e}")
+        logger.error(f"Ошибка при удалении пользователя: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/tasks/stats')
 def tasks_stats():
-    now = datetime.now()
-    total = len(tasks)
-    completed = len([t for t in tasks if t.get('completed')])
-    overdue = len([t for t in tasks if t.get('datetime') and 
-                  datetime.fromisoformat(t['datetime']) < now and 
-                  not t.get('completed')])
-    
-    return jsonify({
-        "total": total,
-        "completed": completed,
-        "overdue": overdue
-    })
+    # by=category,group,assignee - дополнительно счётчики по значениям разрезов
+    by = [name for name in request.args.get('by', '').split(',') if name]
+    unknown = [name for name in by if name not in BREAKDOWNS]
+    if unknown:
+        return jsonify({'error': f"Неизвестный разрез статистики: {', '.join(unknown)}"}), 400
+    return jsonify(task_stats.summary(by=by))
+
+# Наибольшее число результатов одного поискового запроса
+MAX_SEARCH_RESULTS = 1000
+
+@app.route('/api/tasks/search')
+def search_tasks():
+    # q - слова запроса (последнее можно не дописывать), archive=1 - искать и в архиве
+    query = request.args.get('q', '').strip()
+    limit = request.args.get('limit', 50, type=int)
+    if not query:
+        return jsonify({'error': 'Параметр q обязателен'}), 400
+    if limit <= 0:
+        return jsonify({'error': 'limit должен быть положительным'}), 400
+    limit = min(limit, MAX_SEARCH_RESULTS)
+    try:
+        result = {'query': query, 'tasks': task_search.search(query, limit)}
+        if request.args.get('archive', '').lower() in ('true', '1'):
+            result['archived'] = task_search.search_archive(query, limit)
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"Ошибка при поиске задач: {e}")
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/api/tags')
 def get_tags():
@@ -478,8 +848,7 @@ def get_tags():
 
 @app.route('/api/tasks/<int:task_id>/subtasks')
 def get_subtasks(task_id):
-    subtasks = [t for t in tasks if t.get('parent_id') == task_id]
-    return jsonify(subtasks)
+    return jsonify(task_store.subtasks(task_id))
 
 @app.route('/api/tasks/upload', methods=['POST'])
 def upload_tasks():
@@ -490,12 +859,17 @@ def upload_tasks():
         uploaded_tasks = json.load(file)
         if not isinstance(uploaded_tasks, list):
             return jsonify({'error': 'Неверный формат файла'}), 400
-        global tasks
-        tasks[:] = [
+        # Задачам без id выдаём новые последовательные id
+        next_id = task_store.next_id()
+        for t in uploaded_tasks:
+            if 'id' not in t:
+                t['id'] = next_id
+                next_id += 1
+        new_tasks = [
             {
-                'id': t.get('id', max([task['id'] for task in tasks], default=0) + 1),
+                'id': t['id'],
                 'text': t.get('text', ''),
-                'category': t.get('category', categories[0]['name']) if categories and any(cat['name'] == t.get('category') for cat in categories) else categories[0]['name'] if categories else 'Без категории',
+                'category': t['category'] if t.get('category') in lookup['categories'] else categories[0]['name'] if categories else 'Без категории',
                 'datetime': t.get('datetime', None),
                 'reminder_time': t.get('reminder_time', None),
                 'description': t.get('description', ''),
@@ -504,25 +878,25 @@ def upload_tasks():
                 'dependencies': t.get('dependencies', []),
                 'files': t.get('files', []),
                 'chat_ids': t.get('chat_ids', []),
-                'group': t.get('group', None) if any(u['group'] == t.get('group') for u in users) else None
+                'group': t['group'] if t.get('group') in lookup['groups'] else None
             } for t in uploaded_tasks
         ]
-        save_data(TASKS_FILE, tasks)
+        task_store.replace_all(new_tasks)
         return jsonify({'success': True})
     except Exception as e:
-        print(f"Ошибка при загрузке задач: {e}")
+        logger.error(f"Ошибка при загрузке задач: {e}")
         return jsonify({'error': str(e)}), 400
 
 @app.route('/api/tasks/<int:task_id>/files', methods=['GET'])
 def get_task_files(task_id):
-    task = next((t for t in tasks if t['id'] == task_id), None)
+    task = task_store.get(task_id)
     if not task:
         return jsonify({'error': 'Задача не найдена'}), 404
     return jsonify(task.get('files', []))
 
 @app.route('/api/tasks/<int:task_id>/files', methods=['POST'])
 def upload_task_file(task_id):
-    task = next((t for t in tasks if t['id'] == task_id), None)
+    task = task_store.get(task_id)
     if not task:
         return jsonify({'error': 'Задача не найдена'}), 404
     
@@ -533,9 +907,6 @@ def upload_task_file(task_id):
     if not uploaded_files or not any(f.filename for f in uploaded_files):
         return jsonify({'error': 'Файл не предоставлен'}), 400
     
-    if 'files' not in task:
-        task['files'] = []
-    
     new_files = []
     for file in uploaded_files:
         if not file.filename:
@@ -555,15 +926,14 @@ def upload_task_file(task_id):
             'uploaded_at': datetime.now().isoformat()
         }
         
-        task['files'].append(file_info)
         new_files.append(file_info)
     
-    save_data(TASKS_FILE, tasks)
+    task_store.modify(task_id, lambda t: t.update(files=t.get('files', []) + new_files))
     return jsonify(new_files), 201
 
 @app.route('/api/tasks/<int:task_id>/files/<file_id>', methods=['GET'])
 def download_task_file(task_id, file_id):
-    task = next((t for t in tasks if t['id'] == task_id), None)
+    task = task_store.get(task_id)
     if not task:
         return jsonify({'error': 'Задача не найдена'}), 404
     
@@ -582,12 +952,12 @@ def download_task_file(task_id, file_id):
             download_name=file_info['name']
         )
     except Exception as e:
-        print(f"Ошибка при скачивании файла: {e}")
+        logger.error(f"Ошибка при скачивании файла: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/tasks/<int:task_id>/files/<file_id>', methods=['DELETE'])
 def delete_task_file(task_id, file_id):
-    task = next((t for t in tasks if t['id'] == task_id), None)
+    task = task_store.get(task_id)
     if not task:
         return jsonify({'error': 'Задача не найдена'}), 404
     
@@ -600,58 +970,50 @@ def delete_task_file(task_id, file_id):
         if os.path.exists(file_path):
             os.remove(file_path)
     except OSError as e:
-        print(f"Ошибка при удалении файла: {e}")
+        logger.error(f"Ошибка при удалении файла: {e}")
     
-    task['files'] = [f for f in task['files'] if f['id'] != file_id]
-    save_data(TASKS_FILE, tasks)
+    task_store.modify(task_id, lambda t: t.update(files=[f for f in t.get('files', []) if f['id'] != file_id]))
     
     return jsonify({'success': True})
 
 @app.route('/api/tasks/<int:task_id>/can_complete', methods=['GET'])
 def can_complete_task(task_id):
     try:
-        task = next((t for t in tasks if t['id'] == task_id), None)
+        task = task_store.get(task_id)
         if not task:
             return jsonify({'error': 'Задача не найдена'}), 404
-        can_complete = all(t['completed'] for t in tasks if t['id'] in task.get('dependencies', []))
-        subtasks = [t for t in tasks if t.get('parent_id') == task_id]
-        can_complete = can_complete and all(t['completed'] for t in subtasks)
+        dependencies = [task_store.get(dep_id) for dep_id in task.get('dependencies', [])]
+        can_complete = all(t['completed'] for t in dependencies if t)
+        can_complete = can_complete and all(t['completed'] for t in task_store.subtasks(task_id))
         return jsonify({'can_complete': can_complete})
     except Exception as e:
-        print(f"Ошибка при проверке возможности завершения задачи: {e}")
+        logger.error(f"Ошибка при проверке возможности завершения задачи: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/users/<int:chat_id>/tasks', methods=['GET'])
 def get_user_tasks(chat_id):
     try:
-        now = datetime.now()
-        week_later = now + timedelta(days=7)
+        now = time.time()
+        week_later = now + 7 * 24 * 3600
+        user_group = (lookup['users'].get(chat_id) or {}).get('group')
         
         user_tasks = []
-        for task in tasks:
+        for task in task_store.snapshot():
             # Пропускаем только завершенные задачи
-            if task.get('completed'):
+            if task.completed:
                 continue
                 
             # Проверяем принадлежность задачи пользователю
-            is_user_task = (chat_id in task.get('chat_ids', []) or 
-                          (task.get('group') and 
-                           any(u['chat_id'] == chat_id and u.get('group') == task['group'] for u in users)))
+            is_user_task = (chat_id in task.chat_ids or 
+                          (task.group and user_group == task.group))
             
             if not is_user_task:
                 continue
                 
-            # Для задач с датой проверяем период
-            if task.get('datetime'):
-                try:
-                    task_time = datetime.fromisoformat(task['datetime'])
-                    if now <= task_time <= week_later:
-                        user_tasks.append(task)
-                except ValueError:
-                    # Если дата в неправильном формате, добавляем без проверки
-                    user_tasks.append(task)
-            else:
-                # Задачи без даты добавляем всегда
+            # Для задач с датой проверяем период; задачи без даты (или с датой
+            # в неправильном формате) добавляем всегда
+            due = task.due_ts
+            if due is None or now <= due <= week_later:
                 user_tasks.append(task)
         
         # Сортируем задачи: сначала с ближайшими датами, потом без дат
@@ -659,77 +1021,80 @@ def get_user_tasks(chat_id):
         
         return jsonify(user_tasks)
     except Exception as e:
-        print(f"Ошибка при получении задач пользователя: {e}")
+        logger.error(f"Ошибка при получении задач пользователя: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/telegram/webhook', methods=['POST'])
+def telegram_webhook():
+    if telegram_service:
+        if telegram_service.mode != 'webhook':
+            return jsonify({'error': 'Webhook Telegram не включён'}), 404
+        if not telegram_service.verify_webhook_secret(request.headers.get('X-Telegram-Bot-Api-Secret-Token')):
+            return jsonify({'error': 'Неверный секретный токен'}), 403
+    else:
+        # Бот запущен в другом воркере: обновление передаётся ему через общую базу
+        config = bot_config()
+        if STORAGE_BACKEND != 'sqlite' or config.get('TELEGRAM_MODE') != 'webhook':
+            return jsonify({'error': 'Webhook Telegram не включён'}), 404
+        if not verify_webhook_secret(config.get('TELEGRAM_WEBHOOK_SECRET'),
+                                     request.headers.get('X-Telegram-Bot-Api-Secret-Token')):
+            return jsonify({'error': 'Неверный секретный токен'}), 403
+    update = request.get_json(silent=True)
+    if not isinstance(update, dict):
+        return jsonify({'error': 'Неверный формат обновления'}), 400
+    # Обновление обрабатывается в фоне, Telegram сразу получает 200
+    if telegram_service:
+        telegram_service.dispatch_update(update)
+    else:
+        get_sqlite_db().enqueue_update(update)
+    return jsonify({'ok': True})
+
+_bot_config = None
+
+def bot_config():
+    global _bot_config
+    if _bot_config is None:
+        try:
+            _bot_config = load_config()
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось прочитать конфигурацию бота: {e}")
+            _bot_config = {}
+    return _bot_config
+
+@app.route('/api/telegram/stats', methods=['GET'])
+def telegram_stats():
+    if not telegram_service:
+        return jsonify({'error': 'Telegram бот не запущен'}), 404
+    return jsonify(telegram_service.get_stats())
+
+@app.before_request
+def start_timer():
+    g.request_started = time.monotonic()
+
 @app.after_request
 def add_header(response):
     if request.path.startswith('/static/js/'):
         response.headers['Content-Type'] = 'application/javascript'
+    if 'request_started' in g:
+        # Метка route - шаблон маршрута, а не конкретный URL, чтобы не плодить ряды
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_latency.observe(request.method, route, response.status_code,
+                                value=time.monotonic() - g.request_started)
     return response
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/tasks/process_repeating', methods=['POST'])
 def process_repeating_tasks():
+    # Экземпляры создаёт движок повторений ведущего процесса по расписанию;
+    # запрос лишь досоздаёт те, время которых уже наступило
     try:
-        global tasks
-        now = datetime.now()
-        new_tasks = []
-        
-        for task in tasks[:]:
-            if task.get('completed') and task.get('repeat_interval'):
-                last_occurrence = datetime.fromisoformat(task['datetime']) if task['datetime'] else None
-                if not last_occurrence:
-                    continue
-                    
-                should_repeat = False
-                next_date = None
-                if task['repeat_interval'] == 'day':
-                    next_date = last_occurrence + timedelta(days=1)
-                    should_repeat = next_date <= now
-                elif task['repeat_interval'] == 'week':
-                    next_date = last_occurrence + timedelta(weeks=1)
-                    should_repeat = next_date <= now
-                elif task['repeat_interval'] == 'month':
-                    next_date = last_occurrence.replace(month=last_occurrence.month % 12 + 1, year=last_occurrence.year + (last_occurrence.month // 12))
-                    should_repeat = next_date <= now
-                elif task['repeat_interval'] == 'quarter':
-                    next_date = last_occurrence.replace(month=last_occurrence.month % 12 + 3, year=last_occurrence.year + ((last_occurrence.month + 2) // 12))
-                    should_repeat = next_date <= now
-                elif task['repeat_interval'] == 'year':
-                    next_date = last_occurrence.replace(year=last_occurrence.year + 1)
-                    should_repeat = next_date <= now
-                
-                if should_repeat:
-                    if task.get('repeat_until'):
-                        repeat_until = datetime.fromisoformat(task['repeat_until'])
-                        should_repeat = next_date <= repeat_until
-                    
-                    if should_repeat and task.get('repeat_count'):
-                        original_task_id = task.get('original_task_id', task['id'])
-                        completed_repeats = len([t for t in tasks if t.get('original_task_id') == original_task_id])
-                        should_repeat = completed_repeats < task['repeat_count']
-                
-                if should_repeat:
-                    new_task = task.copy()
-                    new_task['id'] = max([t['id'] for t in tasks], default=0) + 1
-                    new_task['completed'] = False
-                    new_task['datetime'] = next_date.isoformat()
-                    new_task['original_task_id'] = task.get('original_task_id', task['id'])
-                    
-                    if 'repeat_count' in new_task:
-                        del new_task['repeat_count']
-                    if 'repeat_until' in new_task:
-                        del new_task['repeat_until']
-                    
-                    new_tasks.append(new_task)
-        
-        if new_tasks:
-            tasks.extend(new_tasks)
-            save_data(TASKS_FILE, tasks)
-        
-        return jsonify({'success': True, 'created': len(new_tasks)})
+        created = recurrence.run_due() if leader is None or leader.is_leader else 0
+        return jsonify({'success': True, 'created': created})
     except Exception as e:
-        print(f"Ошибка при обработке повторяющихся задач: {e}")
+        logger.error(f"Ошибка при обработке повторяющихся задач: {e}")
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
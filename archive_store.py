@@ -0,0 +1,294 @@
+import gzip
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from journal_store import read_journaled
+from metrics import storage_bytes_read, storage_bytes_written
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = 'archive'
+# Сколько прочитанных сегментов держать в памяти для постраничного просмотра
+SEGMENT_CACHE_SIZE = 4
+
+
+class ArchiveStore:
+    """Архив выполненных задач, разбитый на сегменты по месяцу архивирования.
+
+    Каждый месяц - отдельный файл JSONL в каталоге архива: текущий месяц
+    дописывается в конец archive/ГГГГ-ММ.jsonl, а сегменты прошлых месяцев
+    при первой записи в новом месяце сжимаются в ГГГГ-ММ.jsonl.gz и дальше
+    только читаются. Список id задач каждого сегмента держится в памяти,
+    поэтому подсчёт, удаление и постраничный просмотр открывают только
+    нужные сегменты, а весь архив в память не загружается.
+
+    Id задач сжатого сегмента лежат рядом в ГГГГ-ММ.ids.json вместе с
+    размером сегмента и пишутся только при сжатии или перезаписи
+    сегмента; id несжатого сегмента текущего месяца при запуске читаются
+    из него самого. Дописывание в архив меняет только файл текущего
+    сегмента, а после сбоя между записью сегмента и его списка id
+    несовпадение размера видно при запуске, и список строится заново.
+
+    При первом запуске содержимое старого archived_tasks.json переносится
+    в сегменты по дате задачи; сам файл не удаляется. manifest.json
+    отмечает, что перенос уже выполнен.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR, legacy_file=None):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()  # месяц -> список задач сегмента
+        self._listeners = []
+        self.segments = {}  # месяц -> {'file': имя файла, 'ids': [id задач по порядку]}
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            self._scan()
+        else:
+            if legacy_file:
+                self._import_legacy(legacy_file)
+            self._write_manifest()
+
+    def _scan(self):
+        files = {}
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith('.jsonl.gz'):
+                files.setdefault(name[:-len('.jsonl.gz')], []).append(name)
+            elif name.endswith('.jsonl'):
+                files.setdefault(name[:-len('.jsonl')], []).append(name)
+        for month, names in files.items():
+            file_name = f'{month}.jsonl.gz'
+            if file_name in names:
+                if len(names) > 1:
+                    # Сбой после сжатия сегмента, но до удаления несжатого: сжатый полный
+                    os.remove(os.path.join(self.directory, f'{month}.jsonl'))
+            else:
+                file_name = f'{month}.jsonl'
+            ids = self._read_ids(month, file_name)
+            if ids is None:
+                ids = [task.get('id') for task in self._read_segment(file_name)]
+                if file_name.endswith('.gz'):
+                    logger.warning(f"Список id сегмента архива {file_name} не совпал с сегментом, построен заново")
+                    self._write_ids(month, file_name, ids)
+            self.segments[month] = {'file': file_name, 'ids': ids}
+        # Прежний manifest.json держал id всех сегментов - оставляем от него только отметку
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            if 'segments' in json.load(f):
+                self._write_manifest()
+
+    def _import_legacy(self, legacy_file):
+        by_month = {}
+        for task in read_journaled(legacy_file, None):
+            month = (task.get('archived_at') or task.get('datetime') or task.get('created_at') or '')[:7]
+            by_month.setdefault(month or datetime.now().strftime('%Y-%m'), []).append(task)
+        for month, tasks in by_month.items():
+            self._write_segment(month, tasks, compressed=False)
+        self._seal_old_segments(datetime.now().strftime('%Y-%m'))
+        logger.info(f"Архив из {legacy_file} перенесён в {self.directory}: задач - "
+                    f"{sum(len(tasks) for tasks in by_month.values())}")
+
+    def add_listener(self, listener):
+        """listener(добавленные [(позиция, задача)], id удалённой задачи или None) - после каждого изменения архива.
+
+        Позиция - (месяц, номер в сегменте); удаление сдвигает позиции
+        задач, записанных в тот же сегмент позже.
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, added=(), deleted_id=None):
+        # Вызывается вне блокировки архива: подписчик может сам читать архив
+        for listener in self._listeners:
+            try:
+                listener(added, deleted_id)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика изменений архива: {e}")
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(segment['ids']) for segment in self.segments.values())
+
+    def append(self, tasks):
+        """Дописывает задачи в сегмент текущего месяца, отмечая время архивирования."""
+        if not tasks:
+            return
+        now = datetime.now()
+        month = now.strftime('%Y-%m')
+        with self._lock:
+            self._seal_old_segments(month)
+            segment = self.segments.setdefault(month, {'file': f'{month}.jsonl', 'ids': []})
+            start = len(segment['ids'])
+            # Задачи могут ещё читаться из снимков хранилища задач - отметку ставим на копиях
+            tasks = [dict(task.copy(), archived_at=now.isoformat()) for task in tasks]
+            data = ''.join(json.dumps(task, ensure_ascii=False) + '\n' for task in tasks)
+            with open(os.path.join(self.directory, segment['file']), 'a', encoding='utf-8') as f:
+                f.write(data)
+            storage_bytes_written.inc(segment['file'], amount=len(data.encode('utf-8')))
+            segment['ids'].extend(task.get('id') for task in tasks)
+            if month in self._cache:
+                self._cache[month].extend(tasks)
+        self._notify(added=[((month, start + i), task) for i, task in enumerate(tasks)])
+
+    def delete(self, task_id):
+        """Удаляет из архива все задачи с этим id; переписываются только их сегменты."""
+        removed = 0
+        with self._lock:
+            for month, segment in list(self.segments.items()):
+                if task_id not in segment['ids']:
+                    continue
+                tasks = self._load(month)
+                kept = [task for task in tasks if task.get('id') != task_id]
+                removed += len(tasks) - len(kept)
+                if kept:
+                    self._write_segment(month, kept, compressed=segment['file'].endswith('.gz'))
+                else:
+                    os.remove(os.path.join(self.directory, segment['file']))
+                    self._remove_ids(month)
+                    del self.segments[month]
+                    self._cache.pop(month, None)
+        if removed:
+            self._notify(deleted_id=task_id)
+        return removed
+
+    def page(self, cursor=None, limit=50):
+        """Страница архива от новых задач к старым: (задачи, курсор следующей страницы или None).
+
+        Курсор 'ГГГГ-ММ:N' означает «задачи сегмента месяца с позициями
+        меньше N и все более старые сегменты».
+        """
+        with self._lock:
+            months = sorted(self.segments, reverse=True)
+            start_month, end = None, None
+            if cursor:
+                start_month, _, end = cursor.partition(':')
+                end = int(end) if end else None
+            result = []
+            for month in months:
+                if start_month and month > start_month:
+                    continue
+                tasks = self._load(month)
+                position = end if month == start_month and end is not None else len(tasks)
+                while position > 0:
+                    if len(result) == limit:
+                        return result, f'{month}:{position}'
+                    position -= 1
+                    result.append(tasks[position])
+            return result, None
+
+    def entries(self):
+        """Пары (позиция, задача) всего архива от старых к новым.
+
+        Позиция - (месяц, номер в сегменте): в отличие от id она различает
+        и повторяющиеся id, и задачи без id.
+        """
+        with self._lock:
+            result = []
+            for month in sorted(self.segments):
+                result.extend(((month, i), task) for i, task in enumerate(self._load(month)))
+            return result
+
+    def at(self, positions):
+        """{позиция: задача} для позиций из entries(); читаются только их сегменты."""
+        found = {}
+        with self._lock:
+            for month, i in positions:
+                if month not in self.segments:
+                    continue
+                tasks = self._load(month)
+                if i < len(tasks):
+                    found[(month, i)] = tasks[i]
+        return found
+
+    def all(self):
+        """Все задачи архива от старых к новым (для переноса в другое хранилище)."""
+        with self._lock:
+            result = []
+            for month in sorted(self.segments):
+                result.extend(self._load(month))
+            return result
+
+    def _load(self, month):
+        if month in self._cache:
+            self._cache.move_to_end(month)
+            return self._cache[month]
+        tasks = self._read_segment(self.segments[month]['file'])
+        self._cache[month] = tasks
+        if len(self._cache) > SEGMENT_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return tasks
+
+    def _read_segment(self, file_name):
+        path = os.path.join(self.directory, file_name)
+        opener = gzip.open if file_name.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            tasks = [json.loads(line) for line in f if line.strip()]
+        storage_bytes_read.inc(file_name, amount=os.path.getsize(path))
+        return tasks
+
+    def _seal_old_segments(self, current_month):
+        # Сегменты прошлых месяцев больше не дописываются - сжимаем их
+        for month, segment in list(self.segments.items()):
+            if month < current_month and not segment['file'].endswith('.gz'):
+                plain_path = os.path.join(self.directory, segment['file'])
+                self._write_segment(month, self._load(month), compressed=True)
+                os.remove(plain_path)
+
+    def _write_segment(self, month, tasks, compressed):
+        file_name = f'{month}.jsonl.gz' if compressed else f'{month}.jsonl'
+        path = os.path.join(self.directory, file_name)
+        tmp_path = path + '.tmp'
+        opener = gzip.open if compressed else open
+        with opener(tmp_path, 'wt', encoding='utf-8') as f:
+            for task in tasks:
+                f.write(json.dumps(task, ensure_ascii=False) + '\n')
+        storage_bytes_written.inc(file_name, amount=os.path.getsize(tmp_path))
+        os.replace(tmp_path, path)
+        ids = [task.get('id') for task in tasks]
+        if compressed:
+            self._write_ids(month, file_name, ids)
+        else:
+            self._remove_ids(month)
+        self.segments[month] = {'file': file_name, 'ids': ids}
+        self._cache.pop(month, None)
+
+    def _ids_path(self, month):
+        return os.path.join(self.directory, f'{month}.ids.json')
+
+    def _read_ids(self, month, file_name):
+        # Список id годится, только если записан для этого же файла того же размера
+        if not file_name.endswith('.gz'):
+            return None
+        try:
+            with open(self._ids_path(month), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('file') != file_name or meta.get('size') != os.path.getsize(os.path.join(self.directory, file_name)):
+            return None
+        return meta['ids']
+
+    def _write_ids(self, month, file_name, ids):
+        path = self._ids_path(month)
+        tmp_path = path + '.tmp'
+        size = os.path.getsize(os.path.join(self.directory, file_name))
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'file': file_name, 'size': size, 'ids': ids}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _remove_ids(self, month):
+        try:
+            os.remove(self._ids_path(month))
+        except FileNotFoundError:
+            pass
+
+    def _write_manifest(self):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': 2}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def close(self):
+        pass
@@ -0,0 +1,6 @@
+"""Нагрузочные замеры приложения на синтетических данных.
+
+Запуск:
+    python -m benchmarks.run --tasks 1000,10000 --out benchmarks/results/latest.json
+    python -m benchmarks.compare старый.json новый.json
+"""
@@ -0,0 +1,75 @@
+"""Сравнение двух файлов результатов benchmarks.run.
+
+    python -m benchmarks.compare old.json new.json [--metric p95_ms] [--threshold 10]
+
+Для каждого размера набора и каждого сценария печатает значение до, после
+и изменение в процентах; изменения больше порога помечаются.
+"""
+import argparse
+import json
+
+
+def load_runs(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    runs = {}
+    for run in report['runs']:
+        scenarios = dict(run['routes'])
+        scenarios.update(run['bot'])
+        runs[run['tasks']] = {'scenarios': scenarios, 'load': run['load'], 'max_rss_kb': run['max_rss_kb']}
+    return report.get('meta', {}), runs
+
+
+def change(before, after):
+    if not before:
+        return None
+    return (after - before) / before * 100
+
+
+def format_row(name, before, after, threshold, unit='', higher_is_better=False):
+    delta = change(before, after)
+    if delta is None:
+        return f'  {name:45} {before!s:>10} -> {after!s:>10}'
+    worse = -delta if higher_is_better else delta
+    mark = ''
+    if worse > threshold:
+        mark = '  хуже'
+    elif worse < -threshold:
+        mark = '  лучше'
+    return f'  {name:45} {before:10.2f} -> {after:10.2f} {unit}  {delta:+7.1f}%{mark}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение результатов замеров')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--metric', default='p95_ms', help='p50_ms, p95_ms, p99_ms, mean_ms, throughput_per_s')
+    parser.add_argument('--threshold', type=float, default=10.0, help='порог изменения в процентах')
+    args = parser.parse_args()
+
+    old_meta, old_runs = load_runs(args.old)
+    new_meta, new_runs = load_runs(args.new)
+    print(f"{old_meta.get('commit') or args.old} -> {new_meta.get('commit') or args.new}, метрика {args.metric}")
+    # Для пропускной способности рост - это улучшение
+    higher_is_better = args.metric == 'throughput_per_s'
+
+    for size in sorted(set(old_runs) & set(new_runs)):
+        old, new = old_runs[size], new_runs[size]
+        print(f'\n{size} задач')
+        print(format_row('загрузка данных, с', old['load']['seconds'], new['load']['seconds'], args.threshold, 'с '))
+        print(format_row('пиковая память, МБ', old['max_rss_kb'] / 1024, new['max_rss_kb'] / 1024,
+                         args.threshold, 'МБ'))
+        for name in old['scenarios']:
+            if name not in new['scenarios']:
+                print(f'  {name:45} нет в новом замере')
+                continue
+            before = old['scenarios'][name][args.metric]
+            after = new['scenarios'][name][args.metric]
+            print(format_row(name, before, after, args.threshold, higher_is_better=higher_is_better))
+        for name in new['scenarios']:
+            if name not in old['scenarios']:
+                print(f'  {name:45} новый сценарий')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+CATEGORIES = ['Работа', 'Личное', 'Учеба', 'Дни рождения', 'Инвестиции']
+REPEAT_INTERVALS = ['day', 'week', 'month', 'quarter', 'year']
+WORDS = ['отчёт', 'встреча', 'звонок', 'оплатить', 'купить', 'проверить', 'подготовить',
+         'презентация', 'договор', 'счёт', 'клиент', 'проект', 'релиз', 'ревью', 'план']
+
+
+def _text(rnd):
+    return ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 5))).capitalize()
+
+
+def generate(directory, tasks=1000, users=50, groups=5, archive=1000, contacts=50, tree_depth=6,
+             tree_share=0.3, dependency_share=0.1, recurring_share=0.1, seed=42):
+    """Создаёт в directory файлы данных приложения и возвращает описание набора.
+
+    Часть задач собрана в деревья подзадач глубиной tree_depth, часть
+    зависит от предыдущих задач (цепочки dependencies), часть повторяется.
+    Даты задач разбросаны на год вокруг текущего момента, архив - на два
+    года назад, чтобы он разложился по многим месячным сегментам.
+    Справочник собеседников бота содержит всех пользователей и ещё
+    contacts собеседников, которых можно добавить через POST /api/users.
+    """
+    rnd = random.Random(seed)
+    now = datetime.now().replace(second=0, microsecond=0)
+    os.makedirs(directory, exist_ok=True)
+
+    group_names = [f'Группа {i + 1}' for i in range(groups)]
+    user_list = [{
+        'chat_id': 100000 + i,
+        'name': f'Пользователь {i + 1}',
+        'username': f'@user{i + 1}',
+        'group': rnd.choice(group_names) if group_names else ''
+    } for i in range(users)]
+
+    def make_task(task_id, when, completed=False):
+        task = {
+            'id': task_id,
+            'text': _text(rnd),
+            'description': _text(rnd) if rnd.random() < 0.5 else '',
+            'category': rnd.choice(CATEGORIES),
+            'datetime': when.isoformat(timespec='minutes') if when else None,
+            'reminder_time': rnd.choice([None, 5, 15, 60]) if when else None,
+            'completed': completed,
+            'chat_ids': [rnd.choice(user_list)['chat_id']] if user_list and rnd.random() < 0.6 else [],
+            'group': rnd.choice(group_names) if group_names and rnd.random() < 0.2 else None,
+            'parent_id': None,
+            'dependencies': [],
+            'files': [],
+            'repeat_interval': None,
+            'repeat_count': None,
+            'repeat_until': None,
+            'original_task_id': None,
+            'created_at': (now - timedelta(days=rnd.randint(0, 365))).isoformat()
+        }
+        return task
+
+    task_list = []
+    chains = 0
+    task_id = 1
+    while task_id <= tasks:
+        when = now + timedelta(minutes=rnd.randint(-180 * 24 * 60, 180 * 24 * 60)) if rnd.random() < 0.85 else None
+        task = make_task(task_id, when, completed=rnd.random() < 0.25)
+        if rnd.random() < recurring_share and when:
+            task['repeat_interval'] = rnd.choice(REPEAT_INTERVALS)
+            task['repeat_count'] = rnd.choice([None, 3, 12])
+        if task_list and rnd.random() < dependency_share:
+            task['dependencies'] = [task_list[-1]['id']]
+        task_list.append(task)
+        task_id += 1
+
+        # Дерево подзадач: цепочка вложенных задач под только что созданной
+        if rnd.random() < tree_share:
+            chains += 1
+            parent = task
+            for _ in range(rnd.randint(1, tree_depth)):
+                if task_id > tasks:
+                    break
+                child = make_task(task_id, when, completed=rnd.random() < 0.25)
+                child['parent_id'] = parent['id']
+                task_list.append(child)
+                parent = child
+                task_id += 1
+
+    archived = []
+    for i in range(archive):
+        when = now - timedelta(minutes=rnd.randint(0, 2 * 365 * 24 * 60))
+        archived.append(make_task(tasks + i + 1, when, completed=True))
+
+    history = [{
+        'chat_id': user['chat_id'],
+        'text': '/start',
+        'username': user['username'],
+        'name': user['name'],
+        'timestamp': now.isoformat()
+    } for user in user_list]
+    history.extend({
+        'chat_id': 200000 + i,
+        'text': '/start',
+        'username': f'@contact{i + 1}',
+        'name': f'Собеседник {i + 1}',
+        'timestamp': now.isoformat()
+    } for i in range(contacts))
+
+    categories = [{'name': name, 'color': '#%06x' % rnd.randint(0, 0xffffff)} for name in CATEGORIES]
+    files = {
+        'tasks.json': task_list,
+        'users.json': user_list,
+        'categories.json': categories,
+        'archived_tasks.json': archived,
+        'requests_history.json': history
+    }
+    for name, items in files.items():
+        with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+            json.dump(items, f, ensure_ascii=False)
+
+    return {
+        'tasks': len(task_list),
+        'subtask_chains': chains,
+        'with_dependencies': sum(1 for t in task_list if t['dependencies']),
+        'recurring': sum(1 for t in task_list if t['repeat_interval']),
+        'users': len(user_list),
+        'groups': len(group_names),
+        'archived': len(archived),
+        'contacts': contacts,
+        'seed': seed
+    }
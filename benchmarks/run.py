@@ -0,0 +1,366 @@
+"""Замер маршрутов /api, запросов бота и планировщика напоминаний.
+
+Каждый размер набора данных замеряется в отдельном процессе в своём
+временном каталоге: app.py читает файлы данных из текущего каталога при
+импорте, а отдельный процесс даёт честный пиковый расход памяти.
+
+    python -m benchmarks.run --tasks 1000,10000,100000 --out results.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from benchmarks.datagen import WORDS, generate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def summarize(latencies, statuses, elapsed):
+    ordered = sorted(latencies)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        'count': len(ordered),
+        'throughput_per_s': len(ordered) / elapsed if elapsed else None,
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p50_ms': percentile(50) * 1000,
+        'p95_ms': percentile(95) * 1000,
+        'p99_ms': percentile(99) * 1000,
+        'max_ms': ordered[-1] * 1000,
+        'statuses': {str(code): statuses.count(code) for code in sorted(set(statuses))}
+    }
+
+
+def measure(fn, iterations):
+    latencies = []
+    statuses = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        call_started = time.perf_counter()
+        status = fn(i)
+        latencies.append(time.perf_counter() - call_started)
+        if status is not None:
+            statuses.append(status)
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+def route_scenarios(app_module, rnd):
+    """Сценарии (имя, функция(i) -> HTTP-статус, изменяет ли данные) по всем маршрутам /api."""
+    client = app_module.app.test_client()
+    store = app_module.task_store
+    ids = list(store.by_id)
+    today = datetime.now().date()
+    users = app_module.users
+    chat_ids = [u['chat_id'] for u in users] or [0]
+    categories = [c['name'] for c in app_module.categories]
+    known = set(chat_ids)
+    with open(app_module.REQUESTS_HISTORY_FILE, 'r', encoding='utf-8') as f:
+        contacts = [entry['username'] for entry in json.load(f) if entry['chat_id'] not in known]
+    created = []
+    added_users = []
+
+    def random_id():
+        return rnd.choice(ids) if ids else 0
+
+    def get(url):
+        return lambda i: client.get(url(i) if callable(url) else url).status_code
+
+    def create_task(i):
+        response = client.post('/api/tasks', json={
+            'text': f'Задача замера {i}',
+            'datetime': (datetime.now() + timedelta(hours=rnd.randint(1, 500))).isoformat(timespec='minutes'),
+            'category': rnd.choice(categories) if categories else None,
+            'chat_ids': [rnd.choice(chat_ids)] if users else []
+        })
+        if response.status_code == 201:
+            created.append(response.get_json()['id'])
+        return response.status_code
+
+    def update_task(i):
+        task_id = random_id()
+        return client.put(f'/api/tasks/{task_id}', json={'description': f'изменено {i}'}).status_code
+
+    def complete_task(i):
+        task_id = random_id()
+        return client.put(f'/api/tasks/{task_id}', json={'completed': True}).status_code
+
+    def delete_task(i):
+        task_id = created.pop() if created else random_id()
+        return client.delete(f'/api/tasks/{task_id}').status_code
+
+    file_state = {}
+
+    def upload_file(i):
+        task_id = random_id()
+        data = {'files': (io.BytesIO(b'x' * 1024), f'file{i}.txt')}
+        response = client.post(f'/api/tasks/{task_id}/files', data=data, content_type='multipart/form-data')
+        if response.status_code == 201:
+            file_state[i] = (task_id, response.get_json()[0]['id'])
+        return response.status_code
+
+    def download_file(i):
+        if not file_state:
+            return 0
+        task_id, file_id = file_state[rnd.choice(list(file_state))]
+        return client.get(f'/api/tasks/{task_id}/files/{file_id}').status_code
+
+    def delete_file(i):
+        if not file_state:
+            return 0
+        task_id, file_id = file_state.pop(next(iter(file_state)))
+        return client.delete(f'/api/tasks/{task_id}/files/{file_id}').status_code
+
+    def archive_page(i):
+        state = archive_page.__dict__
+        response = client.get('/api/archive?limit=50' + (f"&cursor={state['cursor']}" if state.get('cursor') else ''))
+        state['cursor'] = response.get_json().get('next_cursor')
+        return response.status_code
+
+    def tasks_since(i):
+        return client.get(f'/api/tasks?since={store.revision - 10}').status_code
+
+    def etag_hit(i):
+        return client.get('/api/tasks', headers={'If-None-Match': f'"{store.revision}"'}).status_code
+
+    def add_user(i):
+        username = contacts.pop() if contacts else '@benchmark_missing'
+        response = client.post('/api/users', json={'username': username})
+        if response.status_code == 201:
+            added_users.append(response.get_json()['chat_id'])
+        return response.status_code
+
+    def delete_user(i):
+        chat_id = added_users.pop() if added_users else 0
+        return client.delete(f'/api/users/{chat_id}').status_code
+
+    def batch(i):
+        response = client.post('/api/tasks/batch', json={
+            'create': [{'text': f'Пакет замера {i}', 'datetime': (today + timedelta(days=i % 30)).isoformat()}],
+            'update': [{'id': random_id(), 'description': f'пакет {i}'}],
+            'delete': [created.pop()] if created else []
+        })
+        if response.status_code == 200:
+            created.extend(result['task']['id'] for result in response.get_json()['results']['create'])
+        return response.status_code
+
+    def open_events(i):
+        # Подключение к потоку событий до получения первого сообщения
+        response = client.get('/api/events', buffered=False)
+        next(iter(response.response))
+        response.close()
+        return response.status_code
+
+    def update_user(i):
+        chat_id = rnd.choice(chat_ids)
+        return client.put(f'/api/users/{chat_id}', json={'name': f'Имя {i}'}).status_code
+
+    def category_put(i):
+        name = rnd.choice(categories)
+        return client.put(f'/api/categories/{name}', json={'name': name, 'color': '#123456'}).status_code
+
+    def reorder_categories(i):
+        return client.post('/api/categories/reorder', json={'categories': app_module.categories[::-1]}).status_code
+
+    def add_category(i):
+        return client.post('/api/categories', json={'name': f'Категория {i}', 'color': '#abcdef'}).status_code
+
+    def delete_category(i):
+        return client.delete(f'/api/categories/Категория {i}').status_code
+
+    def upload_all(i):
+        payload = json.dumps([task.to_dict() for task in store.snapshot()], ensure_ascii=False).encode('utf-8')
+        data = {'file': (io.BytesIO(payload), 'tasks.json')}
+        return client.post('/api/tasks/upload', data=data, content_type='multipart/form-data').status_code
+
+    return [
+        # Чтение
+        ('GET /api/tasks', get('/api/tasks'), False),
+        ('GET /api/tasks (If-None-Match)', etag_hit, False),
+        ('GET /api/tasks?since=', tasks_since, False),
+        ('GET /api/tasks?date=', get(lambda i: f'/api/tasks?date={today + timedelta(days=i % 30)}'), False),
+        ('GET /api/tasks?from=&to= (неделя)', get(lambda i: f'/api/tasks?from={today}&to={today + timedelta(days=7)}'), False),
+        ('GET /api/tasks?category=&limit=', get(lambda i: f'/api/tasks?category={rnd.choice(categories)}&limit=100'), False),
+        ('GET /api/tasks/stats', get('/api/tasks/stats'), False),
+        ('GET /api/tasks/stats?by=', get('/api/tasks/stats?by=category,group,assignee'), False),
+        ('GET /api/calendar (неделя)', get(lambda i: f'/api/calendar?from={today}&to={today + timedelta(days=6)}'), False),
+        ('GET /api/calendar?view=counts (месяц)',
+         get(lambda i: f'/api/calendar?from={today}&to={today + timedelta(days=41)}&view=counts'), False),
+        ('GET /api/events', open_events, False),
+        ('GET /api/tasks/search?q=', get(lambda i: f'/api/tasks/search?q={rnd.choice(WORDS)[:4]}'), False),
+        ('GET /api/tasks/<id>/subtasks', get(lambda i: f'/api/tasks/{random_id()}/subtasks'), False),
+        ('GET /api/tasks/<id>/can_complete', get(lambda i: f'/api/tasks/{random_id()}/can_complete'), False),
+        ('GET /api/tasks/<id>/files', get(lambda i: f'/api/tasks/{random_id()}/files'), False),
+        ('GET /api/users', get('/api/users'), False),
+        ('GET /api/users/<chat_id>/tasks', get(lambda i: f'/api/users/{rnd.choice(chat_ids)}/tasks'), False),
+        ('GET /api/categories', get('/api/categories'), False),
+        ('GET /api/tags', get('/api/tags'), False),
+        ('GET /api/archive', archive_page, False),
+        ('GET /api/telegram/stats', get('/api/telegram/stats'), False),
+        ('GET /metrics', get('/metrics'), False),
+        # Запись
+        ('POST /api/tasks', create_task, True),
+        ('PUT /api/tasks/<id>', update_task, True),
+        ('POST /api/tasks/batch', batch, True),
+        ('PUT /api/categories/<name>', category_put, True),
+        ('POST /api/categories', add_category, True),
+        ('DELETE /api/categories/<name>', delete_category, True),
+        ('POST /api/categories/reorder', reorder_categories, True),
+        ('PUT /api/users/<chat_id>', update_user, True),
+        ('POST /api/users', add_user, True),
+        ('DELETE /api/users/<chat_id>', delete_user, True),
+        ('POST /api/tasks/<id>/files', upload_file, True),
+        ('GET /api/tasks/<id>/files/<file_id>', download_file, False),
+        ('DELETE /api/tasks/<id>/files/<file_id>', delete_file, True),
+        ('DELETE /api/tasks/<id>', delete_task, True),
+        ('POST /api/tasks/process_repeating', lambda i: client.post('/api/tasks/process_repeating').status_code, True),
+        ('PUT /api/tasks/<id> (completed)', complete_task, True),
+        ('POST /api/archive', lambda i: client.post('/api/archive').status_code, True),
+        ('DELETE /api/archive/<id>', lambda i: client.delete(f'/api/archive/{random_id()}').status_code, True),
+        ('POST /api/tasks/upload', upload_all, True),
+    ]
+
+
+def bot_benchmarks(app_module, iterations, rnd):
+    """Запросы бота и планировщика напоминаний без обращений к Telegram."""
+    from telegram_service import TelegramService
+
+    config_path = os.path.abspath('bench_config.json')
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump({'TELEGRAM_BOT_TOKEN': 'benchmark'}, f)
+    os.environ['CONFIG_PATH'] = config_path
+    service = TelegramService(app_module.task_store, lambda: app_module.users)
+    try:
+        chat_ids = [u['chat_id'] for u in app_module.users] or [0]
+
+        def week_tasks(i):
+            service.get_user_tasks_for_week(rnd.choice(chat_ids))
+
+        def next_due(i):
+            service.scheduler.next_due()
+
+        def reschedule_all(i):
+            service.scheduler.reschedule_all()
+
+        return {
+            'get_user_tasks_for_week': measure(week_tasks, iterations),
+            'reminder_reschedule_all': measure(reschedule_all, max(1, iterations // 10)),
+            'reminder_next_due': measure(next_due, iterations)
+        }
+    finally:
+        service.stop()
+
+
+def run_single(tasks, iterations, workdir, seed):
+    rnd = random.Random(seed)
+    dataset = generate(workdir, tasks=tasks, users=max(10, tasks // 100), groups=max(3, tasks // 2000),
+                       archive=tasks, contacts=iterations, seed=seed)
+    os.chdir(workdir)
+    # Бот при импорте app не запускается: без конфигурации TelegramService не создаётся
+    os.environ['CONFIG_PATH'] = os.path.join(workdir, 'missing_config.json')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    sys.path.insert(0, ROOT)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    import app as app_module
+    load_seconds = time.perf_counter() - started
+    _, load_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # send_from_directory ищет относительный путь от каталога приложения, а не от рабочего
+    app_module.UPLOAD_FOLDER = os.path.abspath(app_module.UPLOAD_FOLDER)
+
+    routes = {}
+    for name, fn, mutating in route_scenarios(app_module, rnd):
+        count = iterations if not mutating else max(1, iterations // 5)
+        if name == 'POST /api/tasks/upload':
+            count = min(count, 3)
+        routes[name] = measure(fn, count)
+
+    result = {
+        'tasks': tasks,
+        'dataset': dataset,
+        'load': {'seconds': load_seconds, 'peak_traced_bytes': load_peak},
+        'routes': routes,
+        'bot': bot_benchmarks(app_module, iterations, rnd),
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+    app_module.close_stores()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замер производительности маршрутов приложения')
+    parser.add_argument('--tasks', default='1000,10000', help='размеры наборов через запятую (1000..1000000)')
+    parser.add_argument('--iterations', type=int, default=200, help='повторов каждого читающего сценария')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', help='файл результатов JSON (по умолчанию benchmarks/results/<время>.json)')
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        result = run_single(args.single, args.iterations, args.workdir, args.seed)
+        sys.stdout.write('\n' + json.dumps(result) + '\n')
+        return
+
+    runs = []
+    for size in (int(s) for s in args.tasks.split(',')):
+        with tempfile.TemporaryDirectory(prefix='bench_') as workdir:
+            print(f'Набор из {size} задач...', file=sys.stderr)
+            completed = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.run', '--single', str(size), '--workdir', workdir,
+                 '--iterations', str(args.iterations), '--seed', str(args.seed)],
+                cwd=ROOT, capture_output=True, text=True)
+            if completed.returncode != 0:
+                sys.stderr.write(completed.stderr)
+                raise SystemExit(f'Замер набора из {size} задач завершился с ошибкой')
+            runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    report = {
+        'meta': {
+            'started_at': datetime.now().isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'storage_backend': os.getenv('STORAGE_BACKEND', 'json'),
+            'iterations': args.iterations,
+            'seed': args.seed
+        },
+        'runs': runs
+    }
+    out = args.out or os.path.join(ROOT, 'benchmarks', 'results', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    for run in runs:
+        print(f"\n{run['tasks']} задач: загрузка {run['load']['seconds']:.2f} с, RSS {run['max_rss_kb'] // 1024} МБ")
+        for name, stats in run['routes'].items():
+            print(f"  {name:45} p50 {stats['p50_ms']:8.2f} мс  p95 {stats['p95_ms']:8.2f} мс")
+        for name, stats in run['bot'].items():
+            print(f"  {name:45} p50 {stats['p50_ms']:8.2f} мс  p95 {stats['p95_ms']:8.2f} мс")
+    print(f'\nРезультаты: {out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+
+# Самый длинный диапазон одного запроса календаря
+MAX_CALENDAR_DAYS = 366
+
+
+class CalendarView:
+    """Задачи по дням для календаря: реальные из TaskStore и будущие повторения.
+
+    Реальные задачи диапазона берутся двоичным поиском из индекса
+    by_datetime, экземпляры повторяющихся задач, ещё не созданные движком
+    повторений, разворачиваются виртуально и в хранилище не пишутся.
+    Ответы кэшируются по (диапазон, режим) и действительны, пока не
+    изменилась ревизия хранилища задач; в кэше - не больше cache_size
+    последних диапазонов.
+    """
+
+    def __init__(self, task_store, recurrence, cache_size=64):
+        self.task_store = task_store
+        self.recurrence = recurrence
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # (from, to, counts) -> (ревизия, ответ)
+        self._lock = threading.Lock()
+
+    def days(self, date_from, date_to, counts=False):
+        """{'YYYY-MM-DD': [задачи]} (или количества задач при counts) для дней с date_from по date_to включительно."""
+        key = (date_from, date_to, counts)
+        revision = self.task_store.revision
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] == revision:
+                self._cache.move_to_end(key)
+                return cached[1]
+
+        start = datetime.combine(date.fromisoformat(date_from), time.min)
+        end = datetime.combine(date.fromisoformat(date_to), time.min) + timedelta(days=1)
+        if end <= start:
+            raise ValueError('Дата окончания раньше даты начала')
+        if (end - start).days > MAX_CALENDAR_DAYS:
+            raise ValueError(f'Диапазон больше {MAX_CALENDAR_DAYS} дней')
+
+        # Границы - даты без времени: '2024-05-01' < '2024-05-01T09:00' < '2024-05-02'
+        tasks, _ = self.task_store.query(date_from=start.date().isoformat(), date_to=end.date().isoformat())
+        tasks.extend(self.recurrence.expand(start, end))
+        tasks.sort(key=lambda task: (task['datetime'], task['id']))
+        result = {}
+        for task in tasks:
+            day = task['datetime'][:10]
+            if counts:
+                result[day] = result.get(day, 0) + 1
+            else:
+                result.setdefault(day, []).append(task)
+
+        with self._lock:
+            self._cache[key] = (revision, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+from metrics import storage_bytes_written
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_username(username):
+    """Username без @ в нижнем регистре (Telegram не различает регистр)."""
+    return (username or '').lstrip('@').lower()
+
+
+class ContactDirectory:
+    """Справочник собеседников бота (requests_history.json) в памяти.
+
+    Записи индексируются по chat_id и по нормализованному username, поэтому
+    запись входящего сообщения и поиск пользователя не читают файл. На диск
+    справочник сбрасывается целиком не чаще раза в flush_delay секунд:
+    пачка сообщений подряд даёт одну запись файла вместо записи на каждое.
+    """
+
+    def __init__(self, file_path, flush_delay=2.0):
+        self.file_path = file_path
+        self.flush_delay = flush_delay
+        self.by_chat_id = {}    # chat_id -> запись, в порядке первого обращения
+        self.by_username = {}   # нормализованный username -> chat_id
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._timer = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            history = []
+        for entry in history:
+            self.by_chat_id[entry.get('chat_id')] = entry
+            self._index_username(entry)
+
+    def _index_username(self, entry):
+        username = normalize_username(entry.get('username'))
+        if username:
+            self.by_username[username] = entry.get('chat_id')
+
+    def record(self, chat_id, text, username=None, name=None):
+        """Запоминает последнее сообщение собеседника, обновляя имя и username."""
+        with self._lock:
+            entry = self.by_chat_id.get(chat_id)
+            if entry:
+                old_username = normalize_username(entry.get('username'))
+                entry.update({
+                    'text': text,
+                    'username': username or entry.get('username', ''),
+                    'name': name or entry.get('name', str(chat_id)),
+                    'timestamp': datetime.now().isoformat()
+                })
+                if old_username and old_username != normalize_username(entry['username']):
+                    if self.by_username.get(old_username) == chat_id:
+                        del self.by_username[old_username]
+            else:
+                entry = {
+                    'chat_id': chat_id,
+                    'text': text,
+                    'username': username,
+                    'name': name or str(chat_id),
+                    'timestamp': datetime.now().isoformat()
+                }
+                self.by_chat_id[chat_id] = entry
+            self._index_username(entry)
+            self._schedule_flush()
+
+    def find_by_username(self, username):
+        """Запись собеседника по username (с @ или без) или None."""
+        with self._lock:
+            chat_id = self.by_username.get(normalize_username(username))
+            entry = self.by_chat_id.get(chat_id) if chat_id is not None else None
+            return dict(entry) if entry else None
+
+    def _schedule_flush(self):
+        self._dirty = True
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            self._timer = None
+            if not self._dirty:
+                return
+            history = list(self.by_chat_id.values())
+            self._dirty = False
+            tmp_path = self.file_path + '.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(history, f, indent=2)
+                storage_bytes_written.inc(self.file_path, amount=os.path.getsize(tmp_path))
+                os.replace(tmp_path, self.file_path)
+            except OSError as e:
+                self._dirty = True
+                logger.error(f"Ошибка сохранения {self.file_path}: {e}")
+
+    def close(self):
+        with self._lock:
+            timer = self._timer
+        if timer:
+            timer.cancel()
+        self.flush()
@@ -0,0 +1,82 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class EventBus:
+    """Рассылка событий об изменениях подключённым браузерам (Server-Sent Events).
+
+    Последние события хранятся в кольцевом буфере, поэтому переподключившийся
+    клиент по Last-Event-ID получает всё пропущенное. Если пропущенных событий
+    в буфере уже нет (или id из прошлого запуска), клиент получает событие
+    reset и загружает данные заново. Ожидающие подписчики спят на общем
+    условии и просыпаются только при публикации или для keep-alive.
+
+    id события - '<эпоха>-<номер>', где эпоха своя у каждого процесса и
+    каждого запуска: браузер, переподключившийся к другому воркеру, не
+    получит чужие события под своим номером, а получит reset и догрузит
+    задачи по общей ревизии (GET /api/tasks?since=).
+    """
+
+    def __init__(self, history=1000, keepalive=15):
+        self.keepalive = keepalive
+        self._events = deque(maxlen=history)  # (id, тип события, данные в JSON)
+        self.epoch = f'{os.getpid()}.{int(time.time() * 1000)}'
+        self._last_id = 0
+        self._first_id = 1
+        self._cond = threading.Condition()
+
+    def publish(self, event, data):
+        payload = json.dumps(data, ensure_ascii=False)
+        with self._cond:
+            self._last_id += 1
+            self._events.append((self._last_id, event, payload))
+            self._first_id = self._events[0][0]
+            self._cond.notify_all()
+
+    def _position(self, last_event_id):
+        # Номер события этой эпохи или None для id другого процесса или запуска
+        epoch, _, number = (last_event_id or '').rpartition('-')
+        if epoch != self.epoch or not number.isdigit():
+            return None
+        return int(number)
+
+    def stream(self, last_event_id=None):
+        """Генератор SSE-сообщений для одного подключения.
+
+        Позиция в потоке фиксируется при вызове, а не при первой итерации,
+        чтобы не потерять события, опубликованные до начала отправки ответа.
+        """
+        with self._cond:
+            if not last_event_id:
+                return self._follow(self._last_id, reset=False)
+            last_event_id = self._position(last_event_id)
+            if last_event_id is None:
+                return self._follow(self._last_id, reset=True)
+            if last_event_id < self._first_id - 1 or last_event_id > self._last_id:
+                # Пропущенные события не сохранились - клиент перезагружает всё
+                return self._follow(self._last_id, reset=True)
+            return self._follow(last_event_id, reset=False)
+
+    def _follow(self, position, reset):
+        yield 'retry: 3000\n\n'
+        if reset:
+            yield f'id: {self.epoch}-{position}\nevent: reset\ndata: {{}}\n\n'
+        while True:
+            with self._cond:
+                if self._last_id <= position:
+                    self._cond.wait(self.keepalive)
+                if position < self._first_id - 1:
+                    # Подписчик отстал больше, чем на размер буфера
+                    position = self._last_id
+                    pending = [(position, 'reset', '{}')]
+                else:
+                    pending = [e for e in self._events if e[0] > position]
+            if not pending:
+                yield ': keep-alive\n\n'
+                continue
+            for event_id, event, payload in pending:
+                position = event_id
+                yield f'id: {self.epoch}-{event_id}\nevent: {event}\ndata: {payload}\n\n'
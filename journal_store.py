@@ -0,0 +1,287 @@
+import json
+import logging
+import os
+import threading
+
+from metrics import storage_bytes_read, storage_bytes_written
+
+logger = logging.getLogger(__name__)
+
+
+class JournalStore:
+    """Журналируемое хранилище одной коллекции (задачи, архив, контакты, категории).
+
+    Снимок коллекции хранится в исходном JSON-файле, а каждая мутация
+    дописывается в журнал `<файл>.journal` короткой строкой JSON. При запуске
+    журнал проигрывается поверх снимка, а когда записей становится много,
+    фоновый поток сворачивает их в новый снимок.
+
+    Записи журнала:
+        {"op": "put", "item": {...}}      - добавить или заменить элемент по ключу
+        {"op": "delete", "key": ...}      - удалить элемент по ключу
+        {"op": "append", "at": N, "items": [...]} - записать элементы с позиции N
+                                            (коллекции без ключа)
+        {"op": "replace", "items": [...]} - заменить коллекцию целиком
+
+    Каждая запись задаёт значения по ключам (позициям), а не приращение,
+    поэтому повторное проигрывание журнала поверх снимка, который его уже
+    учитывает, даёт то же состояние. Так бывает, если компактизация
+    прервалась после записи снимка, но до удаления свёрнутого журнала.
+    """
+
+    def __init__(self, file_path, key=None, compact_threshold=1000):
+        self.file_path = file_path
+        self.journal_path = file_path + '.journal'
+        self.rotated_path = file_path + '.journal.old'
+        # Поле-ключ элемента; коллекции без ключа (архив, категории) журналируются
+        # дописыванием в конец или заменой целиком
+        self.key = key
+        self.compact_threshold = compact_threshold
+        self._lock = threading.RLock()
+        self._items = {}  # ключ -> элемент, сериализованный в JSON
+        self._loaded = False
+        self._journal = None
+        self._journal_records = 0
+        self._compacting = False
+
+    def _encode(self, item):
+        return json.dumps(item, ensure_ascii=False)
+
+    def _item_key(self, index, item):
+        return item[self.key] if self.key else index
+
+    def load(self, default=None):
+        """Возвращает коллекцию: при первом вызове - снимок с проигранным журналом."""
+        with self._lock:
+            if self._loaded:
+                return [json.loads(s) for s in self._items.values()]
+
+            if not self._exists():
+                items = {self._item_key(i, item): item for i, item in enumerate(default or [])}
+                self._write_snapshot([self._encode(item) for item in items.values()])
+            items, replayed = self._read()
+
+            self._items = {k: self._encode(v) for k, v in items.items()}
+            self._loaded = True
+
+        # Журнал, оставшийся после сбоя компактизации, или слишком длинный
+        # журнал сразу сворачиваем в снимок
+        self._journal_records = replayed
+        if os.path.exists(self.rotated_path) or replayed >= self.compact_threshold:
+            self.compact()
+        return list(items.values())
+
+    def _exists(self):
+        return os.path.exists(self.file_path) or os.path.exists(self.journal_path) \
+            or os.path.exists(self.rotated_path)
+
+    def _read(self):
+        """Читает снимок и проигрывает поверх него журналы."""
+        items = {}
+        if os.path.exists(self.file_path):
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            storage_bytes_read.inc(self.file_path, amount=os.path.getsize(self.file_path))
+            # Пустой файл считаем пустой коллекцией
+            for index, item in enumerate(json.loads(content) if content.strip() else []):
+                items[self._item_key(index, item)] = item
+        replayed = 0
+        for path in (self.rotated_path, self.journal_path):
+            replayed += self._replay(path, items)
+        return items, replayed
+
+    def _replay(self, path, items):
+        if not os.path.exists(path):
+            return 0
+        count = 0
+        storage_bytes_read.inc(self.file_path, amount=os.path.getsize(path))
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Недописанная строка в конце журнала после аварийной остановки
+                    logger.warning(f"Пропущена повреждённая запись журнала {path}")
+                    continue
+                self._apply(record, items)
+                count += 1
+        return count
+
+    def _apply(self, record, items):
+        op = record.get('op')
+        if op == 'put':
+            items[record['item'][self.key]] = record['item']
+        elif op == 'delete':
+            items.pop(record['key'], None)
+        elif op == 'append':
+            # Записи старого формата без позиции дописываются в конец
+            start = record.get('at', len(items))
+            for index, item in enumerate(record['items']):
+                items[start + index] = item
+        elif op == 'replace':
+            items.clear()
+            for index, item in enumerate(record['items']):
+                items[self._item_key(index, item)] = item
+
+    def put(self, item):
+        """Добавляет или заменяет один элемент."""
+        with self._lock:
+            self._ensure_loaded()
+            encoded = self._encode(item)
+            if self._items.get(item[self.key]) == encoded:
+                return
+            self._items[item[self.key]] = encoded
+            self._append([{'op': 'put', 'item': item}])
+
+    def delete(self, key):
+        """Удаляет элемент по ключу."""
+        with self._lock:
+            self._ensure_loaded()
+            if self._items.pop(key, None) is None:
+                return
+            self._append([{'op': 'delete', 'key': key}])
+
+    def write_batch(self, items=(), deleted_keys=()):
+        """Добавляет или заменяет элементы и удаляет ключи одной записью в журнал."""
+        with self._lock:
+            self._ensure_loaded()
+            records = []
+            for item in items:
+                encoded = self._encode(item)
+                if self._items.get(item[self.key]) != encoded:
+                    self._items[item[self.key]] = encoded
+                    records.append({'op': 'put', 'item': item})
+            for key in deleted_keys:
+                if self._items.pop(key, None) is not None:
+                    records.append({'op': 'delete', 'key': key})
+            if records:
+                self._append(records)
+
+    def note_external(self, items=(), deleted_keys=()):
+        """Учитывает элементы, уже записанные в хранилище другим процессом, ничего не записывая."""
+        with self._lock:
+            self._ensure_loaded()
+            for item in items:
+                self._items[item[self.key]] = self._encode(item)
+            for key in deleted_keys:
+                self._items.pop(key, None)
+
+    def replace(self, items):
+        """Заменяет коллекцию целиком."""
+        with self._lock:
+            self._ensure_loaded()
+            self._items = {self._item_key(i, item): self._encode(item) for i, item in enumerate(items)}
+            self._append([{'op': 'replace', 'items': items}])
+
+    def sync(self, items):
+        """Сохраняет коллекцию, записывая в журнал только отличия от прошлого состояния."""
+        with self._lock:
+            self._ensure_loaded()
+            if not self.key:
+                encoded = [self._encode(item) for item in items]
+                previous = list(self._items.values())
+                if encoded == previous:
+                    return
+                self._items = dict(enumerate(encoded))
+                if encoded[:len(previous)] == previous:
+                    self._append([{'op': 'append', 'at': len(previous), 'items': items[len(previous):]}])
+                else:
+                    self._append([{'op': 'replace', 'items': items}])
+                return
+
+            records = []
+            current = {}
+            for item in items:
+                key = item[self.key]
+                encoded = self._encode(item)
+                current[key] = encoded
+                if self._items.get(key) != encoded:
+                    records.append({'op': 'put', 'item': item})
+            for key in self._items:
+                if key not in current:
+                    records.append({'op': 'delete', 'key': key})
+            if records:
+                self._items = current
+                self._append(records)
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def _append(self, records):
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        data = ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records)
+        self._journal.write(data)
+        self._journal.flush()
+        storage_bytes_written.inc(self.file_path, amount=len(data.encode('utf-8')))
+        self._journal_records += len(records)
+        if self._journal_records >= self.compact_threshold and not self._compacting:
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def compact(self):
+        """Сворачивает журнал в новый снимок; записи, пришедшие во время
+        компактизации, попадают уже в новый журнал."""
+        with self._lock:
+            if self._compacting:
+                return
+            if not self._journal_records and not os.path.exists(self.rotated_path):
+                return
+            self._compacting = True
+            self._close_journal()
+            if os.path.exists(self.journal_path):
+                if os.path.exists(self.rotated_path):
+                    # Незавершённая прошлая компактизация: оба журнала уже проиграны
+                    # и учтены в текущем состоянии, которое сейчас попадёт в снимок
+                    with open(self.journal_path, 'r', encoding='utf-8') as src, \
+                            open(self.rotated_path, 'a', encoding='utf-8') as dst:
+                        dst.write(src.read())
+                    os.remove(self.journal_path)
+                else:
+                    os.replace(self.journal_path, self.rotated_path)
+            self._journal_records = 0
+            snapshot = list(self._items.values())
+        try:
+            self._write_snapshot(snapshot)
+            if os.path.exists(self.rotated_path):
+                os.remove(self.rotated_path)
+        except Exception as e:
+            logger.error(f"Ошибка компактизации журнала {self.journal_path}: {e}")
+        finally:
+            self._compacting = False
+
+    def _write_snapshot(self, encoded_items):
+        tmp_path = self.file_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump([json.loads(s) for s in encoded_items], f, indent=2, ensure_ascii=False)
+        storage_bytes_written.inc(self.file_path, amount=os.path.getsize(tmp_path))
+        os.replace(tmp_path, self.file_path)
+
+    def close(self):
+        """Сворачивает журнал в снимок при остановке приложения."""
+        self.compact()
+        with self._lock:
+            self._close_journal()
+
+
+def read_journaled(file_path, key=None):
+    """Читает коллекцию (снимок с журналом), ничего не записывая на диск.
+
+    Нужно сторонним читателям файлов данных, например TelegramService.
+    """
+    items, _ = JournalStore(file_path, key)._read()
+    return list(items.values())
+
+
+def append_journal(file_path, records):
+    """Дописывает записи в журнал коллекции в обход загруженного хранилища."""
+    with open(file_path + '.journal', 'a', encoding='utf-8') as f:
+        f.write(''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records))
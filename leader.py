@@ -0,0 +1,82 @@
+import logging
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки flock нет, процесс считается единственным
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LEADER_LOCK_FILE = os.getenv('LEADER_LOCK_FILE', 'bot.lock')
+
+
+class LeaderElection:
+    """Выбор единственного ведущего процесса среди воркеров на одной машине.
+
+    Ведущим становится процесс, захвативший монопольную блокировку flock
+    файла lock_path; он держит её до завершения. Остальные процессы раз в
+    retry_interval секунд пробуют захватить блокировку снова: когда ведущий
+    завершается (даже аварийно), ядро снимает блокировку и её получает
+    следующий процесс - так бот и планировщик напоминаний переезжают в
+    другой воркер. on_elected() вызывается один раз, при избрании.
+
+    Приложение нельзя загружать в мастер-процессе до fork (gunicorn
+    --preload): дочерние процессы унаследуют уже захваченную блокировку.
+    """
+
+    def __init__(self, lock_path, on_elected, retry_interval=5.0):
+        self.lock_path = lock_path
+        self.on_elected = on_elected
+        self.retry_interval = retry_interval
+        self.is_leader = False
+        self._fd = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Пробует стать ведущим сразу, при неудаче - продолжает в фоновом потоке."""
+        if self._try_acquire():
+            return
+        logger.info(f"Бот и планировщик работают в другом процессе (блокировка {self.lock_path})")
+        self._thread = threading.Thread(target=self._retry, daemon=True)
+        self._thread.start()
+
+    def _retry(self):
+        while not self._stopped.wait(self.retry_interval):
+            if self._try_acquire():
+                return
+
+    def _try_acquire(self):
+        if fcntl is None:
+            self._elect()
+            return True
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        # pid ведущего - для диагностики
+        os.ftruncate(fd, 0)
+        os.write(fd, f'{os.getpid()}\n'.encode())
+        self._elect()
+        return True
+
+    def _elect(self):
+        self.is_leader = True
+        logger.info(f"Процесс {os.getpid()} стал ведущим: запускаются бот и планировщик")
+        try:
+            self.on_elected()
+        except Exception as e:
+            logger.error(f"Ошибка запуска ведущего процесса: {e}")
+
+    def stop(self):
+        self._stopped.set()
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self.is_leader = False
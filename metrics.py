@@ -0,0 +1,153 @@
+"""Метрики приложения в текстовом формате Prometheus (GET /metrics).
+
+Счётчики, гистограммы и датчики регистрируются при импорте модулей и
+обновляются под общей блокировкой; render() собирает их в ответ для
+Prometheus. Датчики с функцией (gauge(..., fn)) вычисляются при каждом
+запросе /metrics - так отдаются, например, длины очередей бота.
+"""
+import bisect
+import threading
+
+# Границы корзин гистограмм по умолчанию, секунды
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_lock = threading.Lock()
+_metrics = {}
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with _lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in self._values.items():
+            yield self.name + _format_labels(self.labels, label_values), value
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), fn=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.fn = fn  # fn() -> значение или {значения меток: значение}
+        self._values = {}
+
+    def set(self, *label_values, value):
+        with _lock:
+            self._values[label_values] = value
+
+    def samples(self):
+        values = self._values
+        if self.fn:
+            try:
+                result = self.fn()
+            except Exception:
+                return
+            values = result if isinstance(result, dict) else {(): result}
+        for label_values, value in values.items():
+            if not isinstance(label_values, tuple):
+                label_values = (label_values,)
+            yield self.name + _format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # значения меток -> [счётчики корзин..., сумма, количество]
+
+    def observe(self, *label_values, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            data = self._values.get(label_values)
+            if data is None:
+                data = self._values[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def samples(self):
+        for label_values, data in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                labels = _format_labels(self.labels + ('le',), label_values + (bound,))
+                yield f'{self.name}_bucket{labels}', cumulative
+            labels = _format_labels(self.labels + ('le',), label_values + ('+Inf',))
+            yield f'{self.name}_bucket{labels}', data[-1]
+            yield f'{self.name}_sum{_format_labels(self.labels, label_values)}', data[-2]
+            yield f'{self.name}_count{_format_labels(self.labels, label_values)}', data[-1]
+
+
+def _register(metric):
+    with _lock:
+        # Повторная регистрация (например, второй экземпляр сервиса) возвращает ту же метрику
+        existing = _metrics.get(metric.name)
+        if existing is not None:
+            if isinstance(metric, Gauge) and metric.fn:
+                existing.fn = metric.fn
+            return existing
+        _metrics[metric.name] = metric
+        return metric
+
+
+def counter(name, help, labels=()):
+    return _register(Counter(name, help, labels))
+
+
+def gauge(name, help, labels=(), fn=None):
+    return _register(Gauge(name, help, labels, fn))
+
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, help, labels, buckets))
+
+
+def render():
+    lines = []
+    with _lock:
+        metrics = list(_metrics.values())
+    for metric in metrics:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        if isinstance(metric, Gauge) and metric.fn:
+            # Функция датчика может брать свои блокировки - вызываем её вне общей
+            samples = list(metric.samples())
+        else:
+            with _lock:
+                samples = list(metric.samples())
+        for sample, value in samples:
+            lines.append(f'{sample} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+# Метрики хранилищ, общие для нескольких модулей
+storage_bytes_read = counter('storage_bytes_read_total', 'Байт прочитано из файла данных', ['file'])
+storage_bytes_written = counter('storage_bytes_written_total', 'Байт записано в файл данных', ['file'])
+save_duration = histogram('save_data_duration_seconds', 'Длительность сохранения коллекции', ['file'])
@@ -0,0 +1,33 @@
+"""Однократный перенос данных из JSON-файлов в базу SQLite.
+
+Запуск:
+    python migrate_to_sqlite.py [путь_к_базе]
+
+После переноса приложение запускается с STORAGE_BACKEND=sqlite.
+"""
+import sys
+
+from archive_store import ARCHIVE_DIR, ArchiveStore
+from journal_store import read_journaled
+from sqlite_store import SQLITE_DB_PATH, TABLES, SqliteStore
+
+
+def migrate(db_path):
+    db = SqliteStore(db_path)
+    try:
+        for table, (key, _) in TABLES.items():
+            file_path = f'{table}.json'
+            if table == 'archived_tasks':
+                # Архив лежит в сегментах; старый файл переносится в них при первом открытии
+                file_path = ARCHIVE_DIR
+                items = ArchiveStore(ARCHIVE_DIR, legacy_file='archived_tasks.json').all()
+            else:
+                items = read_journaled(file_path, key)
+            db.collection(table).replace(items)
+            print(f"{file_path}: перенесено записей - {len(items)}")
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    migrate(sys.argv[1] if len(sys.argv) > 1 else SQLITE_DB_PATH)
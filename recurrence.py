@@ -0,0 +1,328 @@
+import calendar
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+import metrics
+from task_record import due_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Интервалы, измеряемые месяцами; day и week сдвигаются через timedelta
+MONTHS_IN_INTERVAL = {'month': 1, 'quarter': 3, 'year': 12}
+# Наибольшая длина интервала в днях - для перехода сразу к началу диапазона дат
+APPROX_DAYS = {'day': 1, 'week': 7, 'month': 31, 'quarter': 92, 'year': 366}
+
+recurring_created = metrics.counter('recurring_tasks_created_total',
+                                    'Создано экземпляров повторяющихся задач')
+
+
+def add_interval(moment, interval, count=1):
+    """Сдвигает момент на count интервалов повторения.
+
+    День месяца ограничивается длиной целевого месяца: 31 января плюс
+    месяц - 28 (29) февраля, 29 февраля плюс год - 28 февраля.
+    """
+    if interval == 'day':
+        return moment + timedelta(days=count)
+    if interval == 'week':
+        return moment + timedelta(weeks=count)
+    if interval not in MONTHS_IN_INTERVAL:
+        raise ValueError(f"Неизвестный интервал повторения: {interval}")
+    year, month = divmod(moment.year * 12 + moment.month - 1 + MONTHS_IN_INTERVAL[interval] * count, 12)
+    month += 1
+    return moment.replace(year=year, month=month, day=min(moment.day, calendar.monthrange(year, month)[1]))
+
+
+def series_key(task):
+    """Серия повторяющейся задачи - id исходной задачи."""
+    original_task_id = task.get('original_task_id')
+    return task['id'] if original_task_id is None else original_task_id
+
+
+def _parse(value):
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_until(value):
+    # Дата без времени ограничивает серию включительно, до конца этого дня
+    until = _parse(value)
+    if until is not None and isinstance(value, str) and 'T' not in value and ' ' not in value:
+        until += timedelta(days=1, microseconds=-1)
+    return until
+
+
+class RecurrenceEngine:
+    """Создание экземпляров повторяющихся задач на сервере.
+
+    Серия - исходная задача с repeat_interval и её копии (original_task_id).
+    Для каждой серии движок помнит последний по времени экземпляр и, если
+    тот выполнен, заранее вычисляет момент следующего и кладёт его в
+    min-кучу. Поток движка спит до ближайшего момента и создаёт экземпляр
+    только тогда, когда его время наступило. Номер повторения хранится в
+    самом экземпляре (repeat_index), а repeat_count и repeat_until
+    переносятся в копии, поэтому проверка ограничений серии стоит O(1) и
+    не зависит от того, сколько её экземпляров уже ушло в архив.
+
+    Индекс обновляется по уведомлениям TaskStore в каждом процессе, а
+    поток (start) запускается только в ведущем, чтобы экземпляры не
+    создавались дважды. Номер, однажды выданный серии, повторно не
+    выдаётся: удалённый экземпляр пропускается, а не создаётся заново.
+    """
+
+    def __init__(self, task_store):
+        self.task_store = task_store
+        self._members = {}    # ключ серии -> {id задачи: (момент, id)} экземпляров
+        self._series_of = {}  # id задачи -> ключ серии
+        self._heads = {}      # ключ серии -> id последнего экземпляра
+        self._issued = {}     # ключ серии -> наибольший выданный номер повторения
+        self._heap = []       # (момент следующего экземпляра, версия, ключ серии)
+        self._scheduled = {}  # ключ серии -> (момент, версия, id последнего экземпляра, дата, номер)
+        self._version = 0
+        self._cond = threading.Condition()
+        self._run_lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        task_store.add_listener(self.on_task_changed)
+        self.rebuild()
+
+    def rebuild(self):
+        with self._cond:
+            self._members = {}
+            self._series_of = {}
+            self._heads = {}
+            self._issued = {}
+            self._scheduled = {}
+            self._heap = []
+            for task in self.task_store.snapshot():
+                if self._is_member(task):
+                    self._put_member(series_key(task), task)
+            for key, members in self._members.items():
+                self._heads[key] = max(members, key=members.get)
+                self._schedule(key, push=False)
+            heapq.heapify(self._heap)
+            self._cond.notify()
+
+    def on_task_changed(self, task_id, task):
+        if task_id is None:
+            self.rebuild()
+            return
+        with self._cond:
+            old_key = self._series_of.get(task_id)
+            new_key = series_key(task) if task and self._is_member(task) else None
+            if old_key is not None and old_key != new_key:
+                self._drop_member(old_key, task_id)
+            if new_key is not None:
+                self._put_member(new_key, task)
+                self._update_head(new_key, task_id)
+            self._cond.notify()
+
+    @staticmethod
+    def _is_member(task):
+        return bool(task.get('repeat_interval')) or task.get('original_task_id') is not None
+
+    def _put_member(self, key, task):
+        due = due_timestamp(task)
+        self._members.setdefault(key, {})[task['id']] = (float('-inf') if due is None else due, task['id'])
+        self._series_of[task['id']] = key
+        if task.get('repeat_index'):
+            self._issued[key] = max(self._issued.get(key, 0), task['repeat_index'])
+
+    def _drop_member(self, key, task_id):
+        members = self._members.get(key, {})
+        members.pop(task_id, None)
+        self._series_of.pop(task_id, None)
+        if not members:
+            # Серия закончилась: все экземпляры удалены или ушли в архив
+            self._members.pop(key, None)
+            self._heads.pop(key, None)
+            self._issued.pop(key, None)
+            self._scheduled.pop(key, None)
+        elif self._heads.get(key) == task_id:
+            self._heads[key] = max(members, key=members.get)
+            self._schedule(key)
+
+    def _update_head(self, key, task_id):
+        members = self._members[key]
+        head = self._heads.get(key)
+        if head is None or (head != task_id and members[task_id] > members[head]):
+            self._heads[key] = task_id
+        elif head == task_id:
+            # Последний экземпляр перенесли на более раннее время - ищем новый последний
+            self._heads[key] = max(members, key=members.get)
+        self._schedule(key)
+
+    def _schedule(self, key, push=True):
+        self._scheduled.pop(key, None)
+        planned = self._next_instance(key)
+        if planned is None:
+            return
+        head_id, next_date, index = planned
+        self._version += 1
+        fire_at = next_date.timestamp()
+        self._scheduled[key] = (fire_at, self._version, head_id, next_date, index)
+        if push:
+            heapq.heappush(self._heap, (fire_at, self._version, key))
+        else:
+            self._heap.append((fire_at, self._version, key))
+
+    def _next_instance(self, key):
+        """(id последнего экземпляра, дата и номер следующего) или None, если серия не продолжается."""
+        head_id = self._heads.get(key)
+        head = self.task_store.get(head_id) if head_id is not None else None
+        if not head or not head.get('completed'):
+            return None
+        plan = self._plan(key, head)
+        if plan is None:
+            return None
+        head_date, head_index, first_step, max_step, repeat_until = plan
+        for step, next_date in self._steps(head, head_date, first_step, max_step, repeat_until):
+            return head_id, next_date, head_index + step
+        return None
+
+    def _plan(self, key, head):
+        """Параметры продолжения серии от последнего экземпляра head или None.
+
+        (дата и номер head, первый ещё не выданный шаг от head, наибольший
+        шаг по repeat_count или None, repeat_until или None)
+        """
+        due = due_timestamp(head)
+        head_date = datetime.fromtimestamp(due) if due is not None else None
+        if head_date is None or head.get('repeat_interval') not in ('day', 'week', *MONTHS_IN_INTERVAL):
+            return None
+        limits = head
+        if 'repeat_count' not in head and 'repeat_until' not in head:
+            # Копии, созданные до переноса ограничений в экземпляры, берут их из исходной задачи
+            limits = self.task_store.get(key) or head
+        head_index = head.get('repeat_index')
+        if head_index is None:
+            members = self._members.get(key, {})
+            head_index = 0 if head['id'] == key else len(members) - (key in members)
+        first_step = max(head_index, self._issued.get(key, 0)) - head_index + 1
+        repeat_count = int(limits['repeat_count']) - head_index if limits.get('repeat_count') else None
+        return head_date, head_index, first_step, repeat_count, _parse_until(limits.get('repeat_until'))
+
+    @staticmethod
+    def _steps(head, head_date, first_step, max_step, repeat_until, date_from=None):
+        """(шаг, дата) следующих экземпляров от последнего; с date_from - начиная с этой даты."""
+        interval = head['repeat_interval']
+        step = first_step
+        if date_from is not None and date_from > head_date:
+            # Перескакиваем к date_from с запасом: период не короче APPROX_DAYS дней
+            days = (date_from - head_date).days // APPROX_DAYS[interval]
+            step = max(step, days)
+        while max_step is None or step <= max_step:
+            next_date = add_interval(head_date, interval, step)
+            if repeat_until and next_date > repeat_until:
+                return
+            if date_from is None or next_date >= date_from:
+                yield step, next_date
+            step += 1
+
+    def expand(self, date_from, date_to):
+        """Будущие экземпляры серий с датами в [date_from, date_to), ещё не записанные в хранилище.
+
+        Возвращает копии последних экземпляров с датой повторения и
+        пометкой virtual; id у них - id последнего экземпляра серии.
+        """
+        with self._cond:
+            heads = []
+            for key, head_id in self._heads.items():
+                head = self.task_store.get(head_id)
+                plan = self._plan(key, head) if head else None
+                if plan:
+                    heads.append((key, head, plan))
+        occurrences = []
+        for key, head, (head_date, head_index, first_step, max_step, repeat_until) in heads:
+            for step, moment in self._steps(head, head_date, first_step, max_step, repeat_until, date_from):
+                if moment >= date_to:
+                    break
+                occurrence = head.copy()
+                occurrence.update(completed=False, datetime=moment.isoformat(), original_task_id=key,
+                                  repeat_index=head_index + step, virtual=True)
+                occurrences.append(occurrence)
+        return occurrences
+
+    def _drop_stale(self):
+        while self._heap:
+            fire_at, version, key = self._heap[0]
+            entry = self._scheduled.get(key)
+            if entry and entry[:2] == (fire_at, version):
+                return
+            heapq.heappop(self._heap)
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._scheduled)
+
+    def next_due(self):
+        """Момент создания ближайшего экземпляра или None."""
+        with self._cond:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def holds_series(self, task_id):
+        """Задача - выполненный последний экземпляр серии, от которого ещё будет создан следующий.
+
+        Такую задачу нельзя убирать в архив раньше времени: без неё серия прервётся.
+        """
+        with self._cond:
+            entry = self._scheduled.get(self._series_of.get(task_id))
+            return entry is not None and entry[2] == task_id
+
+    def run_due(self):
+        """Создаёт экземпляры, время которых наступило; возвращает их количество."""
+        created = 0
+        with self._run_lock:
+            while True:
+                with self._cond:
+                    self._drop_stale()
+                    if not self._heap or self._heap[0][0] > time.time():
+                        return created
+                    key = heapq.heappop(self._heap)[2]
+                    _, _, head_id, next_date, index = self._scheduled.pop(key)
+                    head = self.task_store.get(head_id)
+                if head and self._materialize(key, head, next_date, index):
+                    created += 1
+
+    def _materialize(self, key, head, next_date, index):
+        new_task = head.copy()
+        new_task['completed'] = False
+        new_task['datetime'] = next_date.isoformat()
+        new_task['original_task_id'] = key
+        new_task['repeat_index'] = index
+        try:
+            self.task_store.create(new_task)
+        except Exception as e:
+            logger.error(f"Ошибка при создании повторения задачи {key}: {e}")
+            return False
+        recurring_created.inc()
+        return True
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def run(self):
+        self._running = True
+        while self._running:
+            with self._cond:
+                self._drop_stale()
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                delay = self._heap[0][0] - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+            self.run_due()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
@@ -0,0 +1,152 @@
+import heapq
+import logging
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Напоминания, время которых прошло больше чем на столько секунд к моменту
+# планирования (запуск приложения, перенос задачи в прошлое), не отправляются
+MISSED_GRACE_SECONDS = 60
+
+reminder_lag = metrics.histogram(
+    'reminder_lag_seconds', 'Задержка отправки напоминания относительно назначенного момента',
+    buckets=(0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60))
+reminders_fired = metrics.counter('reminders_fired_total', 'Отправлено напоминаний')
+
+
+def task_recipients(task):
+    """Получатели напоминания - либо из chat_ids, либо из chat_id."""
+    if task.get('chat_ids'):
+        return list(task['chat_ids'])
+    if task.get('chat_id'):
+        return [task['chat_id']]
+    return []
+
+
+def reminder_timestamp(task):
+    """Момент отправки напоминания (epoch-секунды) или None, если оно не нужно.
+
+    task - запись TaskRecord: поля читаются атрибутами, срок уже разобран.
+    """
+    if task.completed or task.reminder_time is None or task.due_ts is None \
+            or not (task.chat_ids or task.chat_id):
+        return None
+    try:
+        return task.due_ts - int(task.reminder_time) * 60
+    except (TypeError, ValueError):
+        return None
+
+
+class ReminderScheduler:
+    """Планировщик напоминаний на min-куче моментов отправки.
+
+    Куча обновляется по уведомлениям TaskStore о создании, изменении,
+    завершении и удалении задач. Поток планировщика спит до ближайшего
+    напоминания (или до появления более раннего), поэтому напоминания
+    уходят вовремя, а каждое действие с очередью стоит O(log n).
+    Устаревшие записи кучи не удаляются сразу, а отбрасываются при
+    извлечении по несовпадению версии.
+    """
+
+    def __init__(self, task_store, fire):
+        self.task_store = task_store
+        self.fire = fire  # fire(task) вызывается в потоке планировщика
+        self._heap = []         # (момент отправки, версия, id задачи)
+        self._scheduled = {}    # id задачи -> (момент отправки, версия)
+        self._version = 0
+        self._sent = {}         # id задачи -> момент отправки уже отправленного напоминания
+        self._cond = threading.Condition()
+        self._running = False
+        task_store.add_listener(self.on_task_changed)
+        self.reschedule_all()
+
+    def reschedule_all(self):
+        with self._cond:
+            self._heap = []
+            self._scheduled = {}
+            for task in self.task_store.snapshot():
+                self._schedule(task['id'], task)
+            heapq.heapify(self._heap)
+            self._cond.notify()
+
+    def on_task_changed(self, task_id, task):
+        if task_id is None:
+            self.reschedule_all()
+            return
+        with self._cond:
+            self._schedule(task_id, task)
+            self._cond.notify()
+
+    def _schedule(self, task_id, task):
+        fire_at = reminder_timestamp(task) if task else None
+        current = self._scheduled.get(task_id)
+        if current and current[0] == fire_at:
+            return
+        self._scheduled.pop(task_id, None)
+        if task is None or (fire_at is not None and fire_at != self._sent.get(task_id, fire_at)):
+            # Задача удалена или напоминание перенесено - прежняя отметка не нужна
+            self._sent.pop(task_id, None)
+        if fire_at is None or self._sent.get(task_id) == fire_at:
+            return
+        if fire_at < time.time() - MISSED_GRACE_SECONDS:
+            return
+        self._version += 1
+        self._scheduled[task_id] = (fire_at, self._version)
+        heapq.heappush(self._heap, (fire_at, self._version, task_id))
+
+    def scheduled_count(self):
+        with self._cond:
+            return len(self._scheduled)
+
+    def next_due(self):
+        """Момент ближайшего напоминания или None."""
+        with self._cond:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def _drop_stale(self):
+        while self._heap:
+            fire_at, version, task_id = self._heap[0]
+            if self._scheduled.get(task_id) == (fire_at, version):
+                return
+            heapq.heappop(self._heap)
+
+    def _prune_sent(self):
+        # Напоминания старше MISSED_GRACE_SECONDS не планируются и без отметки
+        horizon = time.time() - MISSED_GRACE_SECONDS
+        for task_id in [task_id for task_id, fire_at in self._sent.items() if fire_at < horizon]:
+            del self._sent[task_id]
+
+    def run(self):
+        self._running = True
+        while self._running:
+            with self._cond:
+                self._drop_stale()
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                fire_at, version, task_id = self._heap[0]
+                delay = fire_at - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                del self._scheduled[task_id]
+                self._prune_sent()
+                self._sent[task_id] = fire_at
+                task = self.task_store.get(task_id)
+            if task:
+                reminder_lag.observe(value=max(0.0, time.time() - fire_at))
+                reminders_fired.inc()
+                try:
+                    self.fire(task)
+                except Exception as e:
+                    logger.error(f"Ошибка при отправке напоминания по задаче {task_id}: {e}")
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
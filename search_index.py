@@ -0,0 +1,228 @@
+import bisect
+import heapq
+import math
+import re
+import sys
+import threading
+
+# Вес вхождения слова по полю задачи: совпадение в тексте важнее, чем в описании
+FIELD_WEIGHTS = (('text', 3), ('category', 2), ('description', 1))
+# Совпадение по началу слова ранжируется ниже точного совпадения
+PREFIX_FACTOR = 0.5
+# Сколько слов индекса подставлять вместо одного префикса запроса
+MAX_PREFIX_TERMS = 500
+
+_WORD = re.compile(r'[^\W_]+')
+# Окончания русских слов, отбрасываемые у слов запроса (длинные - первыми):
+# «задачи» ищет и «задача», и «задачу»
+_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ешь', 'ишь',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ие', 'ые', 'ую', 'юю', 'ов', 'ев',
+    'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ть', 'ет', 'ит', 'ут', 'ют', 'ат', 'ят', 'ла', 'ли',
+    'а', 'я', 'о', 'е', 'и', 'ы', 'у', 'ю', 'ь'), key=len, reverse=True)
+MIN_STEM = 4
+
+
+def tokenize(text):
+    """Слова текста в нижнем регистре, ё приводится к е."""
+    if not text or not isinstance(text, str):
+        return []
+    return _WORD.findall(text.lower().replace('ё', 'е'))
+
+
+def stem(word):
+    """Основа слова запроса без окончания; короткие слова не меняются."""
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def _weights(task):
+    weights = {}
+    for field, weight in FIELD_WEIGHTS:
+        for word in tokenize(task.get(field)):
+            weights[word] = weights.get(word, 0) + weight
+    return weights
+
+
+class SearchIndex:
+    """Инвертированный индекс по тексту, описанию и категории задач.
+
+    Для каждого слова хранится словарь {ключ документа: вес}, а слова
+    лежат ещё и в отсортированном списке: слова с данным префиксом
+    находятся двоичным поиском, поэтому поиск по мере набора не
+    просматривает задачи. Документ обновляется только при изменении его
+    слов; выполнение задачи или перенос срока индекс не трогают.
+
+    Слова запроса ищутся по префиксу основы (stem), в выдачу попадают
+    документы, в которых нашлись все слова запроса. Оценка - сумма по
+    словам запроса: вес слова в документе, умноженный на его редкость
+    (idf), а совпадения только по началу слова весят меньше точных.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = {}  # слово -> {ключ документа: вес}
+        self._terms = []     # слова индекса по алфавиту
+        self._docs = {}      # ключ документа -> кортеж его слов
+
+    def __len__(self):
+        return len(self._docs)
+
+    def load(self, items, bulk=True):
+        """Заполняет индекс парами (ключ, задача); слова сортируются один раз в конце."""
+        with self._lock:
+            for key, task in items:
+                self._put(key, _weights(task), bulk=bulk)
+            if bulk:
+                self._terms = sorted(self._postings)
+
+    def put(self, key, task):
+        with self._lock:
+            self._put(key, _weights(task))
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _put(self, key, weights, bulk=False):
+        old = self._docs.get(key)
+        if old is not None:
+            if len(old) == len(weights) and all(self._postings[term].get(key) == weights.get(term) for term in old):
+                return
+            self._remove(key)
+        terms = []
+        for word, weight in weights.items():
+            # Одно и то же слово во всех документах - один объект строки
+            word = sys.intern(word)
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = {}
+                if not bulk:
+                    bisect.insort(self._terms, word)
+            postings[key] = weight
+            terms.append(word)
+        self._docs[key] = tuple(terms)
+
+    def _remove(self, key):
+        for term in self._docs.pop(key, ()):
+            postings = self._postings[term]
+            postings.pop(key, None)
+            if not postings:
+                del self._postings[term]
+                i = bisect.bisect_left(self._terms, term)
+                if i < len(self._terms) and self._terms[i] == term:
+                    del self._terms[i]
+
+    def _expand(self, word):
+        # Слова индекса, начинающиеся с основы слова запроса
+        prefix = stem(word)
+        i = bisect.bisect_left(self._terms, prefix)
+        terms = []
+        while i < len(self._terms) and self._terms[i].startswith(prefix) and len(terms) < MAX_PREFIX_TERMS:
+            terms.append(self._terms[i])
+            i += 1
+        return terms
+
+    def search(self, query, limit=None):
+        """Ключи документов по убыванию оценки: [(ключ, оценка)]."""
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words:
+            return []
+        with self._lock:
+            total = len(self._docs)
+            scores = None
+            for word in words:
+                matched = {}
+                for term in self._expand(word):
+                    postings = self._postings[term]
+                    factor = math.log(1 + total / len(postings)) * (1 if term == word else PREFIX_FACTOR)
+                    for key, weight in postings.items():
+                        if scores is not None and key not in scores:
+                            continue
+                        score = weight * factor
+                        if score > matched.get(key, 0):
+                            matched[key] = score
+                if scores is None:
+                    scores = matched
+                else:
+                    scores = {key: scores[key] + score for key, score in matched.items()}
+                if not scores:
+                    return []
+        order = lambda item: (-item[1], item[0])
+        if limit:
+            return heapq.nsmallest(limit, scores.items(), key=order)
+        return sorted(scores.items(), key=order)
+
+
+class TaskSearch:
+    """Поиск по задачам TaskStore и, по запросу, по архиву.
+
+    Индекс активных задач строится при запуске и обновляется по
+    уведомлениям TaskStore. Индекс архива строится при первом поиске
+    по архиву (чтобы не читать все сегменты архива при каждом запуске)
+    и дальше обновляется по уведомлениям архива; если число задач в
+    архиве разошлось с индексом (архив изменил другой процесс), индекс
+    строится заново. Документы архива - позиции задач в архиве, а не id:
+    в архиве бывают задачи с одинаковыми id и без id. Удаление из архива
+    сдвигает позиции, поэтому после него индекс строится заново при
+    следующем поиске.
+    """
+
+    def __init__(self, task_store, archive_store=None):
+        self.task_store = task_store
+        self.archive_store = archive_store
+        self.tasks = SearchIndex()
+        self.archive = None
+        self._archive_size = None  # задач в архиве на момент последнего обновления индекса
+        self._archive_lock = threading.Lock()
+        task_store.add_listener(self.on_task_changed)
+        if archive_store is not None:
+            archive_store.add_listener(self.on_archive_changed)
+        self.rebuild()
+
+    def rebuild(self):
+        # Новый индекс подменяет старый целиком: поиск не видит наполовину собранный
+        index = SearchIndex()
+        index.load((task['id'], task) for task in self.task_store.snapshot())
+        self.tasks = index
+
+    def on_task_changed(self, task_id, task):
+        if task_id is None:
+            self.rebuild()
+        elif task is None:
+            self.tasks.remove(task_id)
+        else:
+            self.tasks.put(task_id, task)
+
+    def on_archive_changed(self, added, deleted_id):
+        with self._archive_lock:
+            if self.archive is None:
+                return
+            if deleted_id is not None:
+                self.archive = None
+                return
+            self.archive.load(added, bulk=False)
+            self._archive_size = len(self.archive_store)
+
+    def _archive_index(self):
+        with self._archive_lock:
+            size = len(self.archive_store)
+            if self.archive is None or size != self._archive_size:
+                index = SearchIndex()
+                index.load(self.archive_store.entries())
+                self.archive = index
+                self._archive_size = size
+            return self.archive
+
+    def search(self, query, limit=None):
+        """Задачи по убыванию релевантности."""
+        tasks = (self.task_store.get(task_id) for task_id, _ in self.tasks.search(query, limit))
+        return [task for task in tasks if task is not None]
+
+    def search_archive(self, query, limit=None):
+        """Задачи архива по убыванию релевантности."""
+        ranked = [position for position, _ in self._archive_index().search(query, limit)]
+        found = self.archive_store.at(ranked)
+        return [found[position] for position in ranked if position in found]
@@ -0,0 +1,440 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from journal_store import JournalStore
+
+logger = logging.getLogger(__name__)
+
+# Бэкенд хранения выбирается переменной окружения: json (по умолчанию) или sqlite
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')
+SQLITE_DB_PATH = os.getenv('SQLITE_DB_PATH', 'tasks.db')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    parent_id INTEGER,
+    datetime TEXT,
+    remind_at TEXT,
+    category TEXT,
+    "group" TEXT,
+    completed INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_parent_id ON tasks(parent_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_datetime ON tasks(datetime);
+CREATE INDEX IF NOT EXISTS idx_tasks_remind_at ON tasks(remind_at);
+CREATE INDEX IF NOT EXISTS idx_tasks_category ON tasks(category);
+CREATE INDEX IF NOT EXISTS idx_tasks_group ON tasks("group");
+
+CREATE TABLE IF NOT EXISTS task_chats (
+    task_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    PRIMARY KEY (task_id, chat_id)
+);
+CREATE INDEX IF NOT EXISTS idx_task_chats_chat_id ON task_chats(chat_id);
+
+CREATE TABLE IF NOT EXISTS archived_tasks (
+    position INTEGER PRIMARY KEY AUTOINCREMENT,
+    id INTEGER,
+    parent_id INTEGER,
+    datetime TEXT,
+    category TEXT,
+    "group" TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_archived_tasks_id ON archived_tasks(id);
+CREATE INDEX IF NOT EXISTS idx_archived_tasks_parent_id ON archived_tasks(parent_id);
+CREATE INDEX IF NOT EXISTS idx_archived_tasks_datetime ON archived_tasks(datetime);
+CREATE INDEX IF NOT EXISTS idx_archived_tasks_category ON archived_tasks(category);
+
+CREATE TABLE IF NOT EXISTS categories (
+    position INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    position INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL UNIQUE,
+    username TEXT,
+    "group" TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_users_group ON users("group");
+
+-- Журнал изменений для других процессов: key - id задачи, NULL - коллекция целиком
+CREATE TABLE IF NOT EXISTS changes (
+    revision INTEGER PRIMARY KEY AUTOINCREMENT,
+    collection TEXT NOT NULL,
+    key INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS sequences (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO sequences (name, value) VALUES ('tasks', 0);
+
+-- Обновления webhook, принятые процессом, в котором бот не запущен
+CREATE TABLE IF NOT EXISTS bot_updates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data TEXT NOT NULL
+);
+'''
+
+# Сколько последних записей журнала изменений хранить для отставших процессов
+CHANGES_KEEP = 10000
+
+
+def _remind_at(task):
+    """Момент отправки напоминания в ISO-формате или None."""
+    if not task.get('datetime') or task.get('reminder_time') in (None, ''):
+        return None
+    try:
+        task_time = datetime.fromisoformat(task['datetime'])
+        return (task_time - timedelta(minutes=int(task['reminder_time']))).isoformat()
+    except (TypeError, ValueError):
+        return None
+
+
+def _task_row(task):
+    return {
+        'id': task['id'],
+        'parent_id': task.get('parent_id'),
+        'datetime': task.get('datetime'),
+        'remind_at': _remind_at(task),
+        'category': task.get('category'),
+        'group': task.get('group'),
+        'completed': 1 if task.get('completed') else 0
+    }
+
+
+def _archived_task_row(task):
+    return {
+        'id': task.get('id'),
+        'parent_id': task.get('parent_id'),
+        'datetime': task.get('datetime'),
+        'category': task.get('category'),
+        'group': task.get('group')
+    }
+
+
+def _user_row(user):
+    return {'chat_id': user['chat_id'], 'username': user.get('username'), 'group': user.get('group')}
+
+
+def _category_row(category):
+    return {'name': category.get('name')}
+
+
+# Таблица -> (поле-ключ, функция индексируемых колонок). Коллекции без ключа
+# хранят порядок элементов в колонке position
+TABLES = {
+    'tasks': ('id', _task_row),
+    'archived_tasks': (None, _archived_task_row),
+    'categories': (None, _category_row),
+    'users': ('chat_id', _user_row)
+}
+
+
+def _task_chat_ids(task):
+    chat_ids = set(task.get('chat_ids') or [])
+    if task.get('chat_id'):
+        chat_ids.add(task['chat_id'])
+    return chat_ids
+
+
+class SqliteCollection(JournalStore):
+    """Коллекция в таблице SQLite с тем же интерфейсом, что и у JournalStore.
+
+    Записи журнала (put/delete/append/replace) не дописываются в файл,
+    а сразу применяются к таблице в одной транзакции.
+    """
+
+    def __init__(self, db, table):
+        key, row = TABLES[table]
+        super().__init__(table, key=key)
+        self.db = db
+        self.table = table
+        self._row = row
+
+    def _exists(self):
+        return True
+
+    def _read(self):
+        order = self.key if self.table == 'tasks' else 'position'
+        rows = self.db.query(f'SELECT data FROM {self.table} ORDER BY {order}')
+        items = {}
+        for index, (data,) in enumerate(rows):
+            item = json.loads(data)
+            items[self._item_key(index, item)] = item
+        return items, 0
+
+    def _append(self, records):
+        with self.db.transaction() as conn:
+            changed = set()
+            for record in records:
+                op = record['op']
+                if op == 'put':
+                    self._insert(conn, record['item'])
+                    changed.add(record['item'][self.key] if self.table == 'tasks' else None)
+                elif op == 'delete':
+                    self._delete(conn, record['key'])
+                    changed.add(record['key'] if self.table == 'tasks' else None)
+                elif op == 'append':
+                    for item in record['items']:
+                        self._insert(conn, item)
+                    changed.add(None)
+                elif op == 'replace':
+                    conn.execute(f'DELETE FROM {self.table}')
+                    if self.table == 'tasks':
+                        conn.execute('DELETE FROM task_chats')
+                    for item in record['items']:
+                        self._insert(conn, item)
+                    changed.add(None)
+            if self.table != 'archived_tasks':
+                self.db._log_changes(conn, self.table, changed)
+
+    def allocate_id(self, known_max=0):
+        if self.table != 'tasks':
+            raise NotImplementedError(self.table)
+        return self.db.allocate_task_id(known_max)
+
+    def reload(self):
+        """Перечитывает коллекцию из базы (после изменения другим процессом)."""
+        with self._lock:
+            items, _ = self._read()
+            self._items = {k: self._encode(v) for k, v in items.items()}
+            self._loaded = True
+            return list(items.values())
+
+    def _insert(self, conn, item):
+        row = self._row(item)
+        columns = ', '.join(f'"{c}"' for c in row)
+        placeholders = ', '.join('?' for _ in row)
+        sql = f'INSERT INTO {self.table} ({columns}, data) VALUES ({placeholders}, ?)'
+        if self.key:
+            updates = ', '.join(f'"{c}" = excluded."{c}"' for c in row if c != self.key)
+            sql += f' ON CONFLICT({self.key}) DO UPDATE SET {updates}, data = excluded.data'
+        rowid = conn.execute(sql, (*row.values(), json.dumps(item, ensure_ascii=False))).lastrowid
+        if self.table == 'tasks':
+            conn.execute('DELETE FROM task_chats WHERE task_id = ?', (item['id'],))
+            conn.executemany('INSERT INTO task_chats (task_id, chat_id) VALUES (?, ?)',
+                             [(item['id'], cid) for cid in _task_chat_ids(item)])
+        return rowid
+
+    def _delete(self, conn, key):
+        conn.execute(f'DELETE FROM {self.table} WHERE {self.key} = ?', (key,))
+        if self.table == 'tasks':
+            conn.execute('DELETE FROM task_chats WHERE task_id = ?', (key,))
+
+    def compact(self):
+        # Журнала нет: за сброс WAL в основной файл отвечает сам SQLite
+        pass
+
+    def close(self):
+        pass
+
+
+class SqliteStore:
+    """База SQLite (режим WAL) с задачами, архивом, категориями и контактами."""
+
+    def __init__(self, db_path=SQLITE_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        # Базу могут одновременно писать несколько процессов-воркеров
+        self._conn.execute('PRAGMA busy_timeout=5000')
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._collections = {}
+        self._own_revisions = set()  # ревизии журнала изменений, записанные этим процессом
+
+    def collection(self, table):
+        with self._lock:
+            if table not in self._collections:
+                self._collections[table] = SqliteCollection(self, table)
+            return self._collections[table]
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def transaction(self):
+        return _Transaction(self)
+
+    def max_task_id(self):
+        return self.query('SELECT COALESCE(MAX(id), 0) FROM tasks')[0][0]
+
+    def allocate_task_id(self, known_max=0):
+        """Следующий id задачи из общей последовательности (уникален для всех процессов)."""
+        with self.transaction() as conn:
+            conn.execute("UPDATE sequences SET value = MAX(value, ?, (SELECT COALESCE(MAX(id), 0) FROM tasks)) + 1 "
+                         "WHERE name = 'tasks'", (known_max,))
+            return conn.execute("SELECT value FROM sequences WHERE name = 'tasks'").fetchone()[0]
+
+    def _log_changes(self, conn, collection, keys):
+        for key in keys:
+            cursor = conn.execute('INSERT INTO changes (collection, key) VALUES (?, ?)', (collection, key))
+            self._own_revisions.add(cursor.lastrowid)
+
+    def last_change(self):
+        """Ревизия последнего изменения в журнале (0, если журнал пуст)."""
+        return self.query('SELECT COALESCE(MAX(revision), 0) FROM changes')[0][0]
+
+    def changes_after(self, revision, limit=1000):
+        """Изменения других процессов после ревизии: [(ревизия, коллекция, ключ)] и
+        признак того, что часть изменений уже удалена из журнала."""
+        rows = self.query('SELECT revision, collection, key FROM changes WHERE revision > ? '
+                          'ORDER BY revision LIMIT ?', (revision, limit))
+        first = self.query('SELECT MIN(revision) FROM changes')[0][0]
+        truncated = first is not None and first > revision + 1 and revision > 0
+        with self._lock:
+            foreign = [row for row in rows if row[0] not in self._own_revisions]
+            self._own_revisions.difference_update(row[0] for row in rows)
+        return rows[-1][0] if rows else revision, foreign, truncated
+
+    def prune_changes(self, keep=CHANGES_KEEP):
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM changes WHERE revision <= (SELECT MAX(revision) FROM changes) - ?', (keep,))
+
+    def tasks_by_ids(self, ids):
+        ids = list(ids)
+        result = []
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows = self.query(f'SELECT data FROM tasks WHERE id IN ({", ".join("?" for _ in chunk)})', chunk)
+            result.extend(json.loads(data) for (data,) in rows)
+        return result
+
+    def enqueue_update(self, update):
+        with self.transaction() as conn:
+            conn.execute('INSERT INTO bot_updates (data) VALUES (?)', (json.dumps(update, ensure_ascii=False),))
+
+    def take_updates(self, limit=100):
+        """Забирает из очереди обновления webhook, принятые другими процессами."""
+        with self.transaction() as conn:
+            rows = conn.execute('SELECT id, data FROM bot_updates ORDER BY id LIMIT ?', (limit,)).fetchall()
+            if rows:
+                conn.execute('DELETE FROM bot_updates WHERE id <= ?', (rows[-1][0],))
+        return [json.loads(data) for _, data in rows]
+
+    def tasks_for_chat(self, chat_id, start, end):
+        """Невыполненные задачи контакта (лично или через группу) в интервале дат."""
+        rows = self.query('''
+            SELECT data FROM tasks
+            WHERE completed = 0 AND datetime BETWEEN ? AND ?
+              AND (id IN (SELECT task_id FROM task_chats WHERE chat_id = ?)
+                   OR "group" IN (SELECT "group" FROM users WHERE chat_id = ? AND "group" != ''))
+            ORDER BY datetime
+        ''', (start.isoformat(), end.isoformat(), chat_id, chat_id))
+        return [json.loads(data) for (data,) in rows]
+
+    def due_reminders(self, start, end):
+        """Невыполненные задачи с получателями, напоминание по которым приходится на интервал."""
+        rows = self.query('''
+            SELECT data FROM tasks
+            WHERE completed = 0 AND remind_at BETWEEN ? AND ?
+              AND EXISTS (SELECT 1 FROM task_chats WHERE task_id = tasks.id)
+        ''', (start.isoformat(), end.isoformat()))
+        return [json.loads(data) for (data,) in rows]
+
+    def users(self):
+        return [json.loads(data) for (data,) in self.query('SELECT data FROM users ORDER BY position')]
+
+    def archive(self):
+        return SqliteArchive(self)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SqliteArchive:
+    """Архив в таблице archived_tasks с тем же интерфейсом, что и у ArchiveStore."""
+
+    def __init__(self, db):
+        self.db = db
+        self._collection = db.collection('archived_tasks')
+        self._listeners = []
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _notify(self, added=(), deleted_id=None):
+        for listener in self._listeners:
+            try:
+                listener(added, deleted_id)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика изменений архива: {e}")
+
+    def __len__(self):
+        return self.db.query('SELECT COUNT(*) FROM archived_tasks')[0][0]
+
+    def append(self, tasks):
+        archived_at = datetime.now().isoformat()
+        tasks = [dict(task.copy(), archived_at=archived_at) for task in tasks]
+        with self.db.transaction() as conn:
+            # Позиция - ключ строки архива, она не меняется при удалении других задач
+            added = [(self._collection._insert(conn, task), task) for task in tasks]
+        self._notify(added=added)
+
+    def delete(self, task_id):
+        with self.db.transaction() as conn:
+            removed = conn.execute('DELETE FROM archived_tasks WHERE id = ?', (task_id,)).rowcount
+        if removed:
+            self._notify(deleted_id=task_id)
+        return removed
+
+    def page(self, cursor=None, limit=50):
+        """Страница от новых задач к старым; курсор - position последней выданной задачи."""
+        rows = self.db.query(
+            'SELECT position, data FROM archived_tasks WHERE position < ? ORDER BY position DESC LIMIT ?',
+            (int(cursor) if cursor else 2 ** 63 - 1, limit + 1))
+        tasks = [json.loads(data) for _, data in rows[:limit]]
+        next_cursor = str(rows[limit - 1][0]) if len(rows) > limit else None
+        return tasks, next_cursor
+
+    def entries(self):
+        return [(position, json.loads(data))
+                for position, data in self.db.query('SELECT position, data FROM archived_tasks ORDER BY position')]
+
+    def at(self, positions):
+        found = {}
+        positions = list(positions)
+        # Ограничение SQLite на число параметров запроса
+        for start in range(0, len(positions), 500):
+            chunk = positions[start:start + 500]
+            rows = self.db.query(
+                f"SELECT position, data FROM archived_tasks WHERE position IN ({', '.join('?' * len(chunk))})", chunk)
+            for position, data in rows:
+                found[position] = json.loads(data)
+        return found
+
+    def all(self):
+        return [json.loads(data) for (data,) in self.db.query('SELECT data FROM archived_tasks ORDER BY position')]
+
+    def close(self):
+        pass
+
+
+class _Transaction:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db._lock.acquire()
+        self.db._conn.execute('BEGIN')
+        return self.db._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.db._conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.db._lock.release()
+        return False
@@ -2,6 +2,7 @@ import { formatDateTime } from './utils.js';
 
 export function initializeCalendar() {
     if (document.getElementById('calendarContainer')) {
+        initCalendarGlobals();
         renderCalendar();
         setupCalendarEventListeners();
     }
@@ -10,18 +11,20 @@ export function initializeCalendar() {
 // Отрисовка календаря
 async function renderCalendar() {
     try {
-        const response = await fetch('/api/tasks');
-        if (!response.ok) throw new Error('Ошибка загрузки задач');
-        const data = await response.json();
-
         const today = new Date();
-        const currentMonth = today.getMonth();
-        const currentYear = today.getFullYear();
+        const currentMonth = window.calendarMonth ?? today.getMonth();
+        const currentYear = window.calendarYear ?? today.getFullYear();
 
         // Получаем первый день месяца и количество дней в месяце
         const firstDay = new Date(currentYear, currentMonth, 1).getDay();
         const daysInMonth = new Date(currentYear, currentMonth + 1, 0).getDate();
 
+        // Сервер раскладывает задачи месяца по дням, включая будущие повторения
+        const monthPrefix = `${currentYear}-${String(currentMonth + 1).padStart(2, '0')}`;
+        const response = await fetch(`/api/calendar?from=${monthPrefix}-01&to=${monthPrefix}-${String(daysInMonth).padStart(2, '0')}`);
+        if (!response.ok) throw new Error('Ошибка загрузки задач');
+        const { days } = await response.json();
+
         // Корректировка для отображения (понедельник - первый день)
         const startDay = firstDay === 0 ? 6 : firstDay - 1;
 
@@ -52,9 +55,7 @@ async function renderCalendar() {
         // Ячейки текущего месяца
         for (let day = 1; day <= daysInMonth; day++) {
             const dateStr = `${currentYear}-${String(currentMonth + 1).padStart(2, '0')}-${String(day).padStart(2, '0')}`;
-            const dayTasks = data.tasks.filter(task => 
-                task.datetime && task.datetime.startsWith(dateStr)
-            );
+            const dayTasks = days[dateStr] || [];
 
             const isToday = today.getDate() === day && 
                            today.getMonth() === currentMonth && 
@@ -64,7 +65,7 @@ async function renderCalendar() {
                 <div class="calendar-day ${isToday ? 'today' : ''}" data-date="${dateStr}">
                     <div class="day-number">${day}</div>
                     ${dayTasks.slice(0, 3).map(task => `
-                        <div class="calendar-task" data-taskid="${task.id}">
+                        <div class="calendar-task ${task.virtual ? 'repeating-task' : ''}" data-taskid="${task.id}">
                             <span class="task-time">${formatDateTime(task.datetime).split(',')[1]?.trim() || ''}</span>
                             <span class="task-text">${task.text}</span>
                         </div>
@@ -134,9 +135,9 @@ function setupCalendarEventListeners() {
 // Открытие модального окна дня
 async function openDayModal(dateStr) {
     try {
-        const response = await fetch(`/api/tasks?date=${dateStr}`);
+        const response = await fetch(`/api/calendar?from=${dateStr}&to=${dateStr}`);
         if (!response.ok) throw new Error('Ошибка загрузки задач');
-        const tasks = await response.json();
+        const tasks = (await response.json()).days[dateStr] || [];
 
         const date = new Date(dateStr);
         const modalTitle = `${date.getDate()} ${getMonthName(date.getMonth())} ${date.getFullYear()}`;
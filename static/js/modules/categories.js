@@ -1,10 +1,16 @@
 import { escapeRegExp } from './utils.js';
+import { onServerEvent } from './events.js';
 
 export async function initializeCategories() {
     await fetchCategories();
     renderCategories();
     setupCategoryEventListeners();
     setupDragAndDrop();
+    // Категории, изменённые в других вкладках, приходят по потоку событий
+    onServerEvent('categories', categories => {
+        window.categories = categories;
+        renderCategories();
+    });
 }
 
 // Получение категорий с сервера
@@ -1,8 +1,14 @@
 import { debounce } from './utils.js';
+import { onServerEvent } from './events.js';
 
 export async function initializeContacts() {
     await fetchUsers();
     renderContacts();
+    // Контакты, изменённые в других вкладках, приходят по потоку событий
+    onServerEvent('users', users => {
+        window.users = users;
+        renderContacts();
+    });
     setupContactEventListeners();
     await renderContactsForTask();
     await renderTaskGroups();
@@ -0,0 +1,19 @@
+// Общее для всех модулей подключение к потоку изменений сервера (Server-Sent Events).
+// EventSource сам переподключается и передаёт Last-Event-ID, поэтому
+// пропущенные за время разрыва события сервер досылает.
+let eventSource = null;
+
+export function onServerEvent(type, handler) {
+    if (!window.EventSource) return;
+    if (!eventSource) {
+        eventSource = new EventSource('/api/events');
+        eventSource.onerror = () => console.warn('Поток изменений прерван, переподключение...');
+    }
+    eventSource.addEventListener(type, event => {
+        try {
+            handler(JSON.parse(event.data));
+        } catch (error) {
+            console.error(`Ошибка обработки события ${type}:`, error);
+        }
+    });
+}
@@ -1,15 +1,33 @@
 import { formatDateTime, debounce, escapeRegExp } from './utils.js';
 import { updateTaskFilesList } from './files.js';
+import { onServerEvent } from './events.js';
 
 
 //глобальные переменные
 let users = [];
 let showArchive = false;
-
-setInterval(async () => {
-    await fetchTasks();
-    await renderTasks();
-}, 5000); 
+let tasksRevision = null; // ревизия хранилища, до которой загружены задачи
+const ARCHIVE_PAGE_SIZE = 100;
+let archiveLoaded = false;
+let archiveCursor = null; // курсор следующей страницы архива
+let searchRequest = 0; // номер последнего поискового запроса
+window.archivedTasks = [];
+
+// Изменения задач приходят по потоку событий; пачку событий отрисовываем один раз
+const refreshTasks = debounce(() => renderTasks(), 200);
+
+function subscribeToTaskChanges() {
+    onServerEvent('task', data => {
+        if (tasksRevision === null || data.revision > tasksRevision) refreshTasks();
+    });
+    onServerEvent('archive', () => {
+        archiveLoaded = false;
+        if (showArchive) refreshTasks();
+    });
+    // Пропущенные события (или переподключение к другому воркеру): ревизия общая
+    // для всех процессов, поэтому сервер сам решит, хватит ли изменений после неё
+    onServerEvent('reset', () => refreshTasks());
+}
 
 export async function initializeTasks() {
     console.log('Инициализация задач:', {
@@ -27,6 +45,7 @@ export async function initializeTasks() {
     localStorage.setItem('daysFilter', '7');
     await fetchUsers();
     await fetchTasks();
+    subscribeToTaskChanges();
     document.getElementById('addTaskBtn')?.addEventListener('click', addTask);
     document.getElementById('toggleArchiveBtn')?.addEventListener('click', toggleArchive);
     document.getElementById('archiveBtn')?.addEventListener('click', archiveCompletedTasks);
@@ -38,7 +57,6 @@ export async function initializeTasks() {
     document.getElementById('confirmQuickAddBtn')?.addEventListener('click', addMultipleTasks);
     document.getElementById('sortTasksBtn')?.addEventListener('click', toggleSortOptions);
     await updateTaskStats();
-    setInterval(checkRepeatingTasks, 3600000);
     setInterval(updateTaskStats, 60000);
     await renderTasks();
 }
@@ -71,21 +89,64 @@ export async function updateTaskCategorySelect() {
 
 async function fetchTasks() {
     try {
-        const response = await fetch('/api/tasks', { timeout: 5000 });
+        // После первой загрузки запрашиваем только изменения с известной ревизии;
+        // если ничего не менялось, сервер отвечает 304 по ETag
+        const url = tasksRevision === null ? '/api/tasks' : `/api/tasks?since=${tasksRevision}`;
+        const response = await fetch(url, { timeout: 5000, cache: 'no-cache' });
         if (!response.ok) throw new Error(`HTTP error: ${response.status}`);
         const data = await response.json();
-        window.tasks = data.tasks || [];
-        window.archivedTasks = data.archived_tasks || [];
-        console.log('Полученные задачи:', window.tasks); // Отладка
-        console.log('Задачи без даты:', window.tasks.filter(task => !task.datetime)); // Отладка
-        return data;
+        if (data.full === false) {
+            applyTaskChanges(data);
+        } else {
+            window.tasks = data.tasks || [];
+            console.log('Полученные задачи:', window.tasks); // Отладка
+            console.log('Задачи без даты:', window.tasks.filter(task => !task.datetime)); // Отладка
+        }
+        tasksRevision = data.revision ?? null;
+        return { tasks: window.tasks };
     } catch (error) {
         console.error('Ошибка загрузки задач:', error);
         alert('Не удалось загрузить задачи. Проверьте подключение к серверу.');
-        return { tasks: [], archived_tasks: [] };
+        return { tasks: [] };
     }
 }
 
+// Архив загружается постранично и только когда открыт его просмотр
+async function fetchArchive(more = false) {
+    if (archiveLoaded && !more) return window.archivedTasks;
+    try {
+        const cursor = more && archiveCursor ? `&cursor=${encodeURIComponent(archiveCursor)}` : '';
+        const response = await fetch(`/api/archive?limit=${ARCHIVE_PAGE_SIZE}${cursor}`);
+        if (!response.ok) throw new Error(`HTTP error: ${response.status}`);
+        const data = await response.json();
+        window.archivedTasks = more ? [...window.archivedTasks, ...data.tasks] : data.tasks;
+        archiveCursor = data.next_cursor;
+        archiveLoaded = true;
+    } catch (error) {
+        console.error('Ошибка загрузки архива:', error);
+        alert('Не удалось загрузить архив. Проверьте подключение к серверу.');
+    }
+    return window.archivedTasks;
+}
+
+function applyTaskChanges(data) {
+    const deleted = new Set(data.deleted || []);
+    const changed = new Map((data.tasks || []).map(task => [task.id, task]));
+    const merged = [];
+    for (const task of window.tasks || []) {
+        if (deleted.has(task.id)) continue;
+        if (changed.has(task.id)) {
+            merged.push(changed.get(task.id));
+            changed.delete(task.id);
+        } else {
+            merged.push(task);
+        }
+    }
+    // Новые задачи сервер добавляет в конец списка
+    merged.push(...changed.values());
+    window.tasks = merged;
+}
+
 async function fetchUsers() {
     try {
         const response = await fetch('/api/users', { timeout: 5000 });
@@ -142,12 +203,10 @@ async function renderTasks() {
     try {
         const taskList = document.getElementById('taskList');
         if (!taskList) return;
-        const response = await fetch('/api/tasks', { timeout: 5000 });
-        if (!response.ok) throw new Error(`HTTP error: ${response.status}`);
-        const data = await response.json();
+        const data = await fetchTasks();
 
-        tasks = data.tasks || [];
-        const archived_tasks = data.archived_tasks || [];
+        const tasks = data.tasks || [];
+        const archived_tasks = showArchive ? await fetchArchive() : [];
 
         const taskForm = document.getElementById('taskForm');
         const taskListTitle = document.getElementById('taskListTitle');
@@ -271,6 +330,16 @@ async function renderTasks() {
         };
 
         taskList.innerHTML = filteredTasks.map(task => renderTask(task)).join('');
+        if (showArchive && archiveCursor) {
+            taskList.insertAdjacentHTML('beforeend', `
+                <li class="text-center">
+                    <button id="loadMoreArchiveBtn" class="px-4 py-2 text-blue-500 hover:underline">Показать ещё</button>
+                </li>`);
+            document.getElementById('loadMoreArchiveBtn').addEventListener('click', async () => {
+                await fetchArchive(true);
+                await renderTasks();
+            });
+        }
 
         document.querySelectorAll('.delete-task').forEach(btn => {
             btn.addEventListener('click', async () => {
@@ -279,6 +348,7 @@ async function renderTasks() {
                 try {
                     const response = await fetch(endpoint, { method: 'DELETE' });
                     if (!response.ok) throw new Error(`HTTP error: ${response.status}`);
+                    if (showArchive) archiveLoaded = false;
                     await renderTasks();
                 } catch (error) {
                     console.error('Ошибка при удалении задачи:', error);
@@ -438,6 +508,7 @@ async function deleteTask(e) {
         const response = await fetch(endpoint, { method: 'DELETE' });
 
         if (!response.ok) throw new Error('Ошибка при удалении задачи');
+        if (showArchive) archiveLoaded = false;
         await renderTasks();
         await updateTaskStats();
     } catch (error) {
@@ -464,6 +535,7 @@ async function openTaskModal(e) {
 
 async function toggleArchive() {
     showArchive = !showArchive;
+    archiveLoaded = false;
     document.getElementById('toggleArchiveBtn').textContent =
         showArchive ? 'Показать активные' : 'Показать архив';
     await renderTasks();
@@ -475,6 +547,7 @@ async function archiveCompletedTasks() {
     try {
         const response = await fetch('/api/archive', { method: 'POST' });
         if (!response.ok) throw new Error('Ошибка при архивировании задач');
+        archiveLoaded = false;
         await fetchTasks();
         await renderTasks();
         await updateTaskStats();
@@ -485,16 +558,34 @@ async function archiveCompletedTasks() {
 }
 
 async function searchTasks() {
-    const searchTerm = document.getElementById('searchInput').value.trim().toLowerCase();
-    const taskItems = document.querySelectorAll('.task-item');
+    const searchTerm = document.getElementById('searchInput').value.trim();
+    const requestId = ++searchRequest;
 
+    // Ищет сервер по индексу задач (в режиме архива - и по архиву), а не по загруженному списку
+    let foundIds = null;
+    if (searchTerm) {
+        try {
+            const params = new URLSearchParams({ q: searchTerm, limit: 1000 });
+            if (showArchive) params.set('archive', '1');
+            const response = await fetch(`/api/tasks/search?${params}`);
+            if (!response.ok) throw new Error('Ошибка при поиске задач');
+            const data = await response.json();
+            foundIds = new Set([...data.tasks, ...(data.archived || [])].map(task => String(task.id)));
+        } catch (error) {
+            console.error('Ошибка при поиске задач:', error);
+            return;
+        }
+        // Пока шёл запрос, пользователь продолжил ввод - ответ устарел
+        if (requestId !== searchRequest) return;
+    }
+
+    const taskItems = document.querySelectorAll('.task-item');
     taskItems.forEach(item => {
         const taskId = item.dataset.id;
         const task = [...window.tasks, ...window.archivedTasks].find(t => t.id == taskId);
         if (!task) return;
 
-        const text = item.textContent.toLowerCase();
-        const matchesSearch = searchTerm ? text.includes(searchTerm) : true;
+        const matchesSearch = foundIds ? foundIds.has(taskId) : true;
         const matchesCategory = window.currentCategory ? task.category === window.currentCategory : true;
 
         item.style.display = matchesSearch && matchesCategory ? '' : 'none';
@@ -529,18 +620,6 @@ async function updateTaskStats() {
     }
 }
 
-async function checkRepeatingTasks() {
-    try {
-        const response = await fetch('/api/tasks/process_repeating', { method: 'POST' });
-        if (response.ok && (await response.json()).created > 0) {
-            await fetchTasks();
-            await renderTasks();
-        }
-    } catch (error) {
-        console.error('Ошибка при проверке повторяющихся задач:', error);
-    }
-}
-
 function applyDaysFilter() {
     const value = parseInt(document.getElementById('daysFilter').value);
     if (!isNaN(value)) {
@@ -580,17 +659,22 @@ async function addMultipleTasks() {
     const tasks = text.split('\n').filter(line => line.trim());
     let successCount = 0;
 
-    for (const taskText of tasks) {
-        try {
-            const response = await fetch('/api/tasks', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ text: taskText })
-            });
-            if (response.ok) successCount++;
-        } catch (error) {
-            console.error('Ошибка при добавлении задачи:', error);
+    // Все строки уходят одним пакетом и сохраняются одной записью
+    try {
+        const response = await fetch('/api/tasks/batch', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ create: tasks.map(taskText => ({ text: taskText })) })
+        });
+        const data = await response.json();
+        if (response.ok) {
+            successCount = data.results.create.length;
+        } else {
+            const errors = (data.results?.create || []).filter(result => result.error);
+            console.error('Ошибка при добавлении задач:', errors.length ? errors : data.error);
         }
+    } catch (error) {
+        console.error('Ошибка при добавлении задач:', error);
     }
 
     document.getElementById('quickAddTextarea').value = '';
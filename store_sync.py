@@ -0,0 +1,103 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class StoreFollower:
+    """Подтягивает в память процесса изменения, которые другие процессы записали в общую базу SQLite.
+
+    Каждая запись в базу добавляет строки в журнал изменений (таблица
+    changes). sync() читает строки после последней учтённой ревизии,
+    пропуская собственные записи процесса: изменённые задачи
+    перечитываются из базы и применяются к TaskStore без повторной
+    записи, а изменённые категории и контакты запоминаются до ближайшего
+    опроса, который вызывает on_collection_changed(имя таблицы). Если
+    журнал успел обрезаться раньше, чем процесс его прочитал, список
+    задач загружается заново.
+
+    sync() служит часами TaskStore (task_store.clock): он вызывается под
+    блокировкой записи после каждой записи процесса, поэтому ревизия
+    хранилища задач - номер в общем журнале, до которого учтены все
+    изменения, и во всех процессах она означает одно и то же. Поток
+    вызывает sync() раз в interval секунд для изменений, пришедших без
+    собственных записей.
+
+    tick() - необязательная функция, которая вызывается после каждого
+    опроса (ведущий процесс забирает в ней очередь обновлений бота).
+    """
+
+    def __init__(self, db, task_store, on_collection_changed, revision, interval=1.0, tick=None):
+        self.db = db
+        self.task_store = task_store
+        self.on_collection_changed = on_collection_changed
+        self.revision = revision
+        self.interval = interval
+        self.tick = tick
+        self._pending = set()  # таблицы, изменённые другими процессами, ещё не перечитанные
+        self._pending_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        task_store.clock = self.sync
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.poll()
+                if self.tick:
+                    self.tick()
+            except Exception as e:
+                logger.error(f"Ошибка синхронизации с общей базой: {e}")
+
+    def poll(self):
+        self.sync()
+        # Категории и контакты перечитываются вне блокировки записи задач:
+        # их обработчики берут собственную блокировку
+        with self._pending_lock:
+            collections, self._pending = self._pending, set()
+        for table in collections:
+            self.on_collection_changed(table)
+
+    def sync(self):
+        """Применяет все изменения других процессов, записанные в базу к этому моменту; возвращает ревизию."""
+        with self.task_store.write_lock():
+            while True:
+                revision, changes, truncated = self.db.changes_after(self.revision)
+                if truncated:
+                    logger.warning("Журнал изменений обрезан раньше, чем прочитан, - задачи загружаются заново")
+                    self.revision = self.db.last_change()
+                    self.task_store.reload(self.revision)
+                    with self._pending_lock:
+                        self._pending.update(('categories', 'users'))
+                    return self.revision
+                if revision == self.revision:
+                    return revision
+                self._apply(revision, changes)
+                self.revision = revision
+
+    def _apply(self, revision, changes):
+        task_ids = {}
+        reload_tasks = False
+        collections = set()
+        for _, collection, key in changes:
+            if collection != 'tasks':
+                collections.add(collection)
+            elif key is None:
+                reload_tasks = True
+            else:
+                task_ids[key] = None
+
+        if reload_tasks:
+            self.task_store.reload(revision)
+        elif task_ids:
+            self.task_store.apply_external(list(task_ids), self.db.tasks_by_ids, revision)
+        if collections:
+            with self._pending_lock:
+                self._pending.update(collections)
+
+    def stop(self):
+        self._stopped.set()
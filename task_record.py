@@ -0,0 +1,168 @@
+import sys
+from collections.abc import Mapping
+from datetime import datetime
+from operator import attrgetter, itemgetter
+
+# Известные поля задачи в порядке вывода; прочие ключи хранятся в словаре extra
+FIELDS = ('id', 'text', 'description', 'datetime', 'category', 'group', 'chat_id', 'chat_ids',
+          'completed', 'parent_id', 'dependencies', 'files', 'reminder_time', 'repeat_interval',
+          'repeat_count', 'repeat_until', 'original_task_id', 'repeat_index', 'created_at')
+_FIELD_SET = frozenset(FIELDS)
+# Строки из небольшого набора значений хранятся в одном экземпляре на все задачи
+_INTERNED = frozenset(('category', 'group', 'repeat_interval'))
+_LISTS = frozenset(('chat_ids', 'dependencies', 'files'))
+
+# Пустой список хранится общим пустым кортежем и превращается в [] в to_dict()
+_EMPTY = ()
+
+# Раскладки записей: какие поля есть в задаче и какие из них - пустые списки.
+# Раскладок немного (у задач обычно один и тот же набор полей), и каждая
+# запись ссылается на общую
+_layouts = {}
+# Разбор набора ключей словаря задачи: какие поля брать, каких нет, что в extra
+_shapes = {}
+
+
+def _getter(names):
+    if len(names) > 1:
+        return attrgetter(*names)
+    # attrgetter с одним именем возвращает значение, а не кортеж
+    return lambda record: tuple(getattr(record, name) for name in names)
+
+
+def _shape(keys):
+    names = tuple(key for key in keys if key in _FIELD_SET)
+    if len(names) > 1:
+        fetch = itemgetter(*names)
+    else:
+        fetch = lambda task: tuple(task[name] for name in names)
+    shape = _shapes[keys] = (
+        fetch, names,
+        tuple(name for name in FIELDS if name not in names),
+        tuple(name for name in names if name in _LISTS),
+        tuple(name for name in names if name in _INTERNED),
+        tuple(key for key in keys if key not in _FIELD_SET),
+        frozenset(names))
+    return shape
+
+
+def _layout(present, empty):
+    key = (present, empty)
+    layout = _layouts.get(key)
+    if layout is None:
+        names = tuple(name for name in FIELDS if name in present and name not in empty)
+        empty_names = tuple(name for name in FIELDS if name in empty)
+        layout = _layouts[key] = (names, _getter(names), empty_names, present)
+    return layout
+
+
+def parse_due(value):
+    """Срок задачи из строки ISO в epoch-секундах или None."""
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        return None
+
+
+def due_timestamp(task):
+    """Срок задачи в epoch-секундах: у TaskRecord - без повторного разбора строки."""
+    if type(task) is TaskRecord:
+        return task.due_ts
+    return parse_due(task.get('datetime'))
+
+
+class TaskRecord(Mapping):
+    """Неизменяемая запись задачи в памяти TaskStore.
+
+    Поля лежат в слотах, а не в словаре из пятнадцати с лишним ключей:
+    категория, группа и интервал повторения интернируются, пустые списки
+    не создаются для каждой задачи, а срок (datetime) разбирается один раз
+    при создании записи и хранится в due_ts как epoch-секунды.
+
+    Внутренний код читает поля атрибутами (task.completed, task.due_ts):
+    отсутствующее поле - None, пустой список - пустой кортеж. Для остального
+    кода запись ведёт себя как словарь (task['text'], task.get('group'),
+    dict(task)), а в JSON-ответах и в хранилище превращается в обычный
+    словарь того же вида, что хранится на диске (to_dict). Изменять запись
+    нельзя: новая версия задачи - это новый словарь, который TaskStore
+    превращает в новую запись.
+    """
+
+    __slots__ = FIELDS + ('extra', 'due_ts', '_layout')
+
+    def __init__(self, task):
+        keys = tuple(task)
+        shape = _shapes.get(keys) or _shape(keys)
+        fetch, names, missing, lists, interned, extra, present = shape
+        for name, value in zip(names, fetch(task)):
+            setattr(self, name, value)
+        for name in missing:
+            setattr(self, name, None)
+        empty = ()
+        for name in lists:
+            value = getattr(self, name)
+            if not value and type(value) in (list, tuple):
+                setattr(self, name, _EMPTY)
+                empty += (name,)
+        for name in interned:
+            value = getattr(self, name)
+            if type(value) is str:
+                setattr(self, name, sys.intern(value))
+        self._layout = _layout(present, empty)
+        self.extra = {key: task[key] for key in extra} if extra else None
+        self.due_ts = parse_due(self.datetime)
+
+    @classmethod
+    def of(cls, task):
+        """Запись для словаря задачи; запись возвращается как есть."""
+        return task if type(task) is cls else cls(task)
+
+    def __getitem__(self, key):
+        if key in self._layout[3]:
+            return getattr(self, key)
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in self._layout[3]:
+            return getattr(self, key)
+        return self.extra.get(key, default) if self.extra is not None else default
+
+    def __contains__(self, key):
+        return key in self._layout[3] or (self.extra is not None and key in self.extra)
+
+    def __iter__(self):
+        present = self._layout[3]
+        for name in FIELDS:
+            if name in present:
+                yield name
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self):
+        return len(self._layout[3]) + len(self.extra or ())
+
+    def to_dict(self):
+        """Задача обычным словарем - для JSON и хранилища."""
+        names, getter, empty, _ = self._layout
+        result = dict(zip(names, getter(self)))
+        for name in empty:
+            result[name] = []
+        if self.extra is not None:
+            result.update(self.extra)
+        return result
+
+    copy = to_dict
+
+    def __eq__(self, other):
+        if isinstance(other, Mapping):
+            return self.to_dict() == (other.to_dict() if type(other) is TaskRecord else dict(other.items()))
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'TaskRecord({self.to_dict()!r})'
@@ -0,0 +1,110 @@
+import bisect
+import threading
+import time
+
+from reminder_scheduler import task_recipients
+from task_record import due_timestamp
+
+# Разрезы статистики (параметр by в GET /api/tasks/stats)
+BREAKDOWNS = ('category', 'group', 'assignee')
+
+
+class TaskStats:
+    """Счётчики задач (всего, выполнено, просрочено), обновляемые при каждой мутации.
+
+    Для всех задач и для каждого значения разреза (категория, группа,
+    получатель) хранятся число задач, число выполненных и отсортированный
+    список сроков невыполненных задач. Просроченные - это сроки раньше
+    текущего момента, их число находится двоичным поиском, поэтому чтение
+    статистики не просматривает задачи и не разбирает их даты: сроки
+    берутся из записей задач (TaskRecord.due_ts) в epoch-секундах.
+    """
+
+    def __init__(self, task_store):
+        self.task_store = task_store
+        self._lock = threading.Lock()
+        self._entries = {}  # id задачи -> (ключи разрезов, выполнена, срок или None)
+        # разрез -> значение -> [всего, выполнено, [(срок, id) невыполненных]]
+        self._buckets = {name: {} for name in ('all', *BREAKDOWNS)}
+        task_store.add_listener(self.on_task_changed)
+        self.rebuild()
+
+    def rebuild(self):
+        with self._lock:
+            self._entries = {}
+            self._buckets = {name: {} for name in ('all', *BREAKDOWNS)}
+            for task in self.task_store.snapshot():
+                self._add(task['id'], self._entry(task), bulk=True)
+            for buckets in self._buckets.values():
+                for bucket in buckets.values():
+                    bucket[2].sort()
+
+    def on_task_changed(self, task_id, task):
+        if task_id is None:
+            self.rebuild()
+            return
+        with self._lock:
+            old = self._entries.pop(task_id, None)
+            if old is not None:
+                self._remove(task_id, old)
+            if task is not None:
+                self._add(task_id, self._entry(task))
+
+    @staticmethod
+    def _entry(task):
+        keys = [('all', None), ('category', task.get('category') or ''), ('group', task.get('group') or '')]
+        keys.extend(('assignee', str(chat_id)) for chat_id in dict.fromkeys(task_recipients(task)))
+        return tuple(keys), bool(task.get('completed')), due_timestamp(task)
+
+    def _add(self, task_id, entry, bulk=False):
+        keys, completed, due = entry
+        self._entries[task_id] = entry
+        for name, value in keys:
+            bucket = self._buckets[name].get(value)
+            if bucket is None:
+                bucket = self._buckets[name][value] = [0, 0, []]
+            bucket[0] += 1
+            if completed:
+                bucket[1] += 1
+            elif due is not None:
+                if bulk:
+                    bucket[2].append((due, task_id))
+                else:
+                    bisect.insort(bucket[2], (due, task_id))
+
+    def _remove(self, task_id, entry):
+        keys, completed, due = entry
+        for name, value in keys:
+            bucket = self._buckets[name][value]
+            bucket[0] -= 1
+            if completed:
+                bucket[1] -= 1
+            elif due is not None:
+                i = bisect.bisect_left(bucket[2], (due, task_id))
+                if i < len(bucket[2]) and bucket[2][i] == (due, task_id):
+                    del bucket[2][i]
+            if not bucket[0]:
+                del self._buckets[name][value]
+
+    @staticmethod
+    def _counts(bucket, now):
+        total, completed, due = bucket
+        return {'total': total, 'completed': completed, 'overdue': bisect.bisect_left(due, (now,))}
+
+    def overdue(self, now=None):
+        with self._lock:
+            bucket = self._buckets['all'].get(None)
+            return bisect.bisect_left(bucket[2], (now or time.time(),)) if bucket else 0
+
+    def summary(self, by=(), now=None):
+        """{'total', 'completed', 'overdue'} и для каждого разреза из by - словарь by_<разрез>.
+
+        Задачи без категории или группы попадают в разрез под пустым ключом.
+        """
+        now = now or time.time()
+        with self._lock:
+            result = self._counts(self._buckets['all'].get(None, (0, 0, [])), now)
+            for name in by:
+                result[f'by_{name}'] = {value: self._counts(bucket, now)
+                                        for value, bucket in self._buckets[name].items()}
+        return result
@@ -0,0 +1,493 @@
+import bisect
+import logging
+import threading
+import time
+
+from metrics import save_duration
+from task_record import TaskRecord
+
+logger = logging.getLogger(__name__)
+
+# Значение по умолчанию для фильтра, который не задан (None - тоже значение, например parent_id)
+ANY = object()
+
+# Сколько последних изменённых задач помнит журнал ревизий для запросов since=
+CHANGE_LOG_SIZE = 10000
+# Сколько id за раз query() копирует из sorted_ids при обходе без фильтра по датам
+QUERY_CHUNK = 256
+
+
+class TaskStore:
+    """Активные задачи в памяти с индексами по id и по parent_id.
+
+    Индексы обновляются при каждой мутации, поэтому поиск задачи по id,
+    список подзадач и обход поддерева не требуют просмотра всех задач.
+    Каждая мутация сразу сохраняется в хранилище (журнал или SQLite)
+    отдельной записью по задаче.
+
+    Один экземпляр используется и маршрутами Flask, и TelegramService.
+    Подписчики (add_listener) получают уведомление listener(task_id, task)
+    после каждой мутации: task=None для удалённой задачи, а
+    listener(None, None) - после полной перезагрузки списка задач.
+
+    Задачи с датой дополнительно лежат в списке by_datetime, отсортированном
+    по (datetime, id): query() отвечает на запросы по дню или диапазону дат
+    двоичным поиском и просматривает только задачи из этого диапазона.
+    Без фильтра по датам страницы берутся из списка sorted_ids (id по
+    возрастанию) начиная с курсора, тоже без сортировки на каждый запрос.
+
+    Каждое уведомление увеличивает ревизию хранилища, а журнал ревизий
+    запоминает, в какой ревизии последний раз менялась каждая задача, -
+    по нему changes_since() отдаёт только изменения после ревизии клиента.
+    Ревизия начинается с текущего времени в миллисекундах, чтобы после
+    перезапуска она не повторяла ревизии, уже полученные клиентами.
+
+    Если задан clock (общая база SQLite, с которой работают несколько
+    процессов), ревизию даёт он: это номер в журнале изменений базы, до
+    которого процесс учёл все изменения, свои и чужие. Тогда одна и та же
+    ревизия во всех процессах означает один и тот же список задач, и
+    ETag или ?since=, полученные от одного воркера, верны и для другого.
+
+    Потокобезопасность: все мутации идут под одной блокировкой записи
+    (_lock) вместе с сохранением и уведомлением подписчиков, поэтому
+    записи выполняются по очереди и в журнал попадают в том же порядке.
+    Читатели блокировку не берут: сохранённые задачи никогда не меняются
+    на месте (копирование при записи - replace() или modify() кладут новый
+    словарь), индексы читаются атомарными копиями, а all() отдаёт
+    неизменяемый снимок-кортеж, который пересобирается один раз после
+    каждой записи. Блокировку ненадолго берёт только changes_since().
+
+    Задачи хранятся записями TaskRecord: методы принимают обычные словари
+    и превращают их в записи, а в хранилище (журнал или SQLite) уходят
+    снова словари.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.by_id = {}          # id -> задача, в порядке добавления
+        self.children = {}       # parent_id -> {id подзадачи: None}
+        self.completed_ids = set()
+        self.by_datetime = []    # (datetime, id) задач с датой, по возрастанию
+        self.sorted_ids = []     # id всех задач по возрастанию
+        self._datetimes = {}     # id -> datetime, под которым задача лежит в by_datetime
+        self.max_id = 0
+        self._lock = threading.RLock()
+        self._listeners = []
+        self.revision = int(time.time() * 1000)
+        self._changes = {}       # id задачи -> ревизия последнего изменения, по возрастанию ревизий
+        self._changes_from = self.revision  # более ранние изменения журнал не помнит
+        self._snapshot = None    # (ревизия, кортеж задач) для all()
+        # Функция, которая под блокировкой записи догоняет общее хранилище и
+        # возвращает его ревизию; без неё ревизия - счётчик процесса
+        self.clock = None
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _notify(self, task_id, task, revision=None):
+        # Вызывается под блокировкой записи: подписчики получают изменения в порядке ревизий.
+        # revision передаётся для изменений, уже учтённых в общей ревизии (apply_external)
+        with self._lock:
+            if revision is not None:
+                self.revision = revision
+            elif self.clock is not None:
+                self.revision = self.clock()
+            else:
+                self.revision += 1
+            if task_id is None:
+                self._changes.clear()
+                self._changes_from = self.revision
+            else:
+                self._changes.pop(task_id, None)
+                self._changes[task_id] = self.revision
+                if len(self._changes) > CHANGE_LOG_SIZE:
+                    oldest = next(iter(self._changes))
+                    self._changes_from = self._changes.pop(oldest)
+        for listener in self._listeners:
+            try:
+                listener(task_id, task)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика изменений задач: {e}")
+
+    def load(self, tasks, revision=None):
+        with self._lock:
+            # Индексы собираются заново и подменяются целиком: читатели видят
+            # либо старый список задач, либо новый
+            self.by_id = {}
+            self.children = {}
+            self.completed_ids = set()
+            self._datetimes = {}
+            self.max_id = 0
+            for task in tasks:
+                self._index(TaskRecord.of(task), bulk=True)
+            self.by_datetime = sorted((dt, task_id) for task_id, dt in self._datetimes.items())
+            self.sorted_ids = sorted(self.by_id)
+            self._notify(None, None, revision)
+
+    def changes_since(self, revision):
+        """Изменения после ревизии: (текущая ревизия, изменённые задачи, id удалённых).
+
+        Возвращает None, если журнал не помнит изменений с этой ревизии
+        (слишком старая, ревизия прошлого запуска или полная перезагрузка) -
+        тогда клиенту нужен полный список задач.
+        """
+        with self._lock:
+            if revision < self._changes_from or revision > self.revision:
+                return None
+            changed = []
+            for task_id in reversed(self._changes):
+                if self._changes[task_id] <= revision:
+                    break
+                changed.append(task_id)
+            changed.reverse()
+            tasks = [self.by_id[task_id] for task_id in changed if task_id in self.by_id]
+            deleted = [task_id for task_id in changed if task_id not in self.by_id]
+            return self.revision, tasks, deleted
+
+    def snapshot(self):
+        """Неизменяемый кортеж всех задач на момент последней записи."""
+        cached = self._snapshot
+        revision = self.revision
+        if cached is not None and cached[0] == revision:
+            return cached[1]
+        # Копия значений словаря делается одной операцией под GIL и не может
+        # застать словарь в середине изменения; ревизия прочитана до копии,
+        # поэтому снимок не старее неё
+        tasks = tuple(self.by_id.values())
+        self._snapshot = (revision, tasks)
+        return tasks
+
+    def all(self):
+        return list(self.snapshot())
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def get(self, task_id):
+        return self.by_id.get(task_id)
+
+    def next_id(self):
+        return self.max_id + 1
+
+    def _new_id(self):
+        # Общая база SQLite выдаёт id из последовательности, уникальной для всех процессов
+        allocate = getattr(self.backend, 'allocate_id', None)
+        return allocate(self.max_id) if allocate else self.next_id()
+
+    def subtasks(self, task_id):
+        return self._resolve(list(self.children.get(task_id, ())))
+
+    def subtree(self, task_id):
+        """Задача и все её подзадачи на любой глубине (обход в глубину)."""
+        result = []
+        seen = set()
+        stack = [task_id]
+        while stack:
+            current = stack.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            task = self.by_id.get(current)
+            if task is None:
+                continue
+            result.append(task)
+            stack.extend(reversed(list(self.children.get(current, ()))))
+        return result
+
+    def completed(self):
+        return self._resolve(sorted(self.completed_ids))
+
+    def _resolve(self, ids):
+        # Задача могла быть удалена параллельной записью после чтения индекса
+        by_id = self.by_id
+        return [task for task in map(by_id.get, ids) if task is not None]
+
+    def query(self, date_from=None, date_to=None, category=None, group=None, chat_id=None,
+              completed=None, parent_id=ANY, after=None, limit=None):
+        """Задачи по фильтрам и ключ для следующей страницы: (задачи, ключ или None).
+
+        date_from - нижняя граница datetime включительно, date_to - верхняя
+        граница не включительно (строки в формате ISO). С фильтром по датам
+        задачи идут по (datetime, id) и берутся двоичным поиском из by_datetime,
+        без него - по id. after - ключ последней задачи предыдущей страницы.
+        """
+        def matches(task):
+            if category is not None and task.category != category:
+                return False
+            if group is not None and task.group != group:
+                return False
+            if chat_id is not None and chat_id not in (task.chat_ids or (task.chat_id,)):
+                return False
+            if completed is not None and bool(task.completed) != completed:
+                return False
+            if parent_id is not ANY and task.parent_id != parent_id:
+                return False
+            return True
+
+        by_id = self.by_id
+        if date_from is not None or date_to is not None:
+            index = self.by_datetime
+            lo = bisect.bisect_left(index, (date_from,)) if date_from is not None else 0
+            if after is not None:
+                lo = max(lo, bisect.bisect_right(index, tuple(after)))
+            hi = bisect.bisect_left(index, (date_to,)) if date_to is not None else len(index)
+            # Между поиском и срезом список мог сдвинуться из-за параллельной
+            # записи - границы диапазона проверяются ещё раз по ключам
+            keys = [key for key in index[max(0, lo - 1):hi + 1]
+                    if (date_from is None or key[0] >= date_from)
+                    and (date_to is None or key[0] < date_to)
+                    and (after is None or key > tuple(after))]
+            candidates = ((key, by_id.get(key[1])) for key in keys)
+        elif parent_id is not ANY:
+            # Подзадачи одного родителя - небольшой список, его можно отсортировать
+            ids = sorted(self.children.get(parent_id, ()))
+            if after is not None:
+                ids = ids[bisect.bisect_right(ids, after[0]):]
+            candidates = (((task_id,), by_id.get(task_id)) for task_id in ids)
+        else:
+            candidates = self._ids_after(after[0] if after is not None else None)
+
+        result = []
+        last_key = None
+        for key, task in candidates:
+            if task is None or not matches(task):
+                continue
+            if limit is not None and len(result) == limit:
+                return result, list(last_key)
+            result.append(task)
+            last_key = key
+        return result, None
+
+    def _ids_after(self, after_id):
+        # sorted_ids читается без блокировки кусками: следующий кусок ищется
+        # двоичным поиском по последнему выданному id, поэтому параллельная
+        # вставка или удаление не заставят пропустить или повторить задачу
+        index = self.sorted_ids
+        i = bisect.bisect_right(index, after_id) if after_id is not None else 0
+        while True:
+            chunk = index[i:i + QUERY_CHUNK]
+            if not chunk:
+                return
+            for task_id in chunk:
+                yield (task_id,), self.by_id.get(task_id)
+            i = bisect.bisect_right(index, chunk[-1])
+
+    def write_lock(self):
+        """Блокировка записи: проверки и изменения, выполненные под ней, не
+        пересекаются с записями других потоков (блокировка повторно входимая)."""
+        return self._lock
+
+    def create(self, task):
+        """Выдаёт задаче новый id и добавляет её (атомарно для нескольких потоков)."""
+        with self._lock:
+            task['id'] = self._new_id()
+            return self.add(task)
+
+    def add(self, task):
+        with self._lock:
+            task = TaskRecord.of(task)
+            self._index(task)
+            self._persist(task)
+            self._notify(task['id'], task)
+            return task
+
+    def replace(self, task):
+        """Заменяет задачу с тем же id новой версией, сохраняя её позицию.
+
+        Передавать нужно новый словарь (копию), а не изменённую на месте задачу из хранилища.
+        """
+        with self._lock:
+            task = TaskRecord.of(task)
+            old = self.by_id.get(task['id'])
+            if old is None:
+                return self.add(task)
+            self._reindex(old, task)
+            self._persist(task)
+            self._notify(task['id'], task)
+            return task
+
+    def modify(self, task_id, change):
+        """Изменяет задачу под блокировкой записи: change(копия) правит копию задачи,
+        которая затем заменяет задачу. Возвращает новую версию или None, если задачи нет.
+        """
+        with self._lock:
+            task = self.by_id.get(task_id)
+            if task is None:
+                return None
+            task = task.to_dict()
+            change(task)
+            return self.replace(task)
+
+    def apply_batch(self, created=(), updated=(), deleted=()):
+        """Применяет пакет изменений атомарно и сохраняет его одной записью.
+
+        created - новые задачи (получают id по порядку), updated - новые
+        версии существующих задач, deleted - id задач, удаляемых вместе
+        с поддеревьями. Возвращает список удалённых задач. Если задачи для
+        изменения или удаления нет, бросает KeyError и ничего не меняет.
+        """
+        with self._lock:
+            # Цели изменений и удалений проверяются до того, как тронут хоть один индекс
+            missing = [task['id'] for task in updated if task['id'] not in self.by_id]
+            missing.extend(task_id for task_id in deleted if task_id not in self.by_id)
+            if missing:
+                raise KeyError(f"Задачи не найдены: {missing}")
+            records = []
+            for task in created:
+                task['id'] = self._new_id()
+                records.append(TaskRecord.of(task))
+                self._index(records[-1])
+            for task in updated:
+                records.append(TaskRecord.of(task))
+                self._reindex(self.by_id[task['id']], records[-1])
+            removed = []
+            for task_id in deleted:
+                subtree = self.subtree(task_id)
+                for task in subtree:
+                    self._unindex(task['id'])
+                removed.extend(subtree)
+            removed_ids = {task['id'] for task in removed}
+            saved = [task for task in records if task['id'] not in removed_ids]
+            started = time.monotonic()
+            try:
+                self.backend.write_batch([task.to_dict() for task in saved],
+                                         [task['id'] for task in removed])
+                save_duration.observe(self.backend.file_path, value=time.monotonic() - started)
+            except Exception as e:
+                logger.error(f"Ошибка сохранения пакета задач: {e}")
+            # Общая ревизия запрашивается один раз на весь пакет
+            revision = self.clock() if self.clock is not None else None
+            for task in saved:
+                self._notify(task['id'], task, revision)
+            for task in removed:
+                self._notify(task['id'], None, revision)
+            return removed
+
+    def remove_subtree(self, task_id):
+        """Удаляет задачу вместе со всеми подзадачами и возвращает удалённые задачи.
+
+        Уже удалённая задача (повторное удаление, подзадача после каскада
+        родителя) - не ошибка: возвращается пустой список.
+        """
+        with self._lock:
+            if task_id not in self.by_id:
+                return []
+            return self.apply_batch(deleted=[task_id])
+
+    def replace_all(self, tasks):
+        with self._lock:
+            # Сначала сохранение: ревизия после load() должна учитывать и эту запись
+            try:
+                self.backend.replace(tasks)
+            except Exception as e:
+                logger.error(f"Ошибка сохранения задач: {e}")
+            self.load(tasks)
+
+    def _index(self, task, bulk=False):
+        task_id = task['id']
+        self.by_id[task_id] = task
+        self.children.setdefault(task.get('parent_id'), {})[task_id] = None
+        if task.get('completed'):
+            self.completed_ids.add(task_id)
+        if isinstance(task_id, int) and task_id > self.max_id:
+            self.max_id = task_id
+        if bulk:
+            # При загрузке by_datetime и sorted_ids сортируются один раз после всех задач
+            if isinstance(task.get('datetime'), str) and task['datetime']:
+                self._datetimes[task_id] = task['datetime']
+        else:
+            # Новые id больше всех прежних - вставка почти всегда в конец списка
+            bisect.insort(self.sorted_ids, task_id)
+            self._index_datetime(task)
+
+    def _index_datetime(self, task):
+        task_id = task['id']
+        dt = task.get('datetime') if isinstance(task.get('datetime'), str) else None
+        old = self._datetimes.get(task_id)
+        if old == (dt or None):
+            return
+        if old is not None:
+            self._unindex_datetime(task_id)
+        if dt:
+            self._datetimes[task_id] = dt
+            bisect.insort(self.by_datetime, (dt, task_id))
+
+    def _unindex_datetime(self, task_id):
+        dt = self._datetimes.pop(task_id, None)
+        if dt is None:
+            return
+        i = bisect.bisect_left(self.by_datetime, (dt, task_id))
+        if i < len(self.by_datetime) and self.by_datetime[i] == (dt, task_id):
+            del self.by_datetime[i]
+
+    def _unindex(self, task_id):
+        task = self.by_id.pop(task_id, None)
+        if task is None:
+            return
+        self._unlink(task_id, task.get('parent_id'))
+        self.completed_ids.discard(task_id)
+        self._unindex_datetime(task_id)
+        i = bisect.bisect_left(self.sorted_ids, task_id)
+        if i < len(self.sorted_ids) and self.sorted_ids[i] == task_id:
+            del self.sorted_ids[i]
+
+    def apply_external(self, task_ids, fetch, revision=None):
+        """Применяет изменения задач, уже сохранённые в общую базу другим процессом.
+
+        fetch(ids) возвращает текущие версии задач из базы (отсутствующие
+        удалены) и вызывается под блокировкой записи - параллельная запись
+        этого процесса не будет затёрта более старой версией. Индексы
+        обновляются и подписчики уведомляются, в базу ничего не пишется.
+        revision - ревизия общего хранилища, в которой учтены эти изменения.
+        """
+        with self._lock:
+            fetched = fetch(task_ids)
+            tasks = [TaskRecord.of(task) for task in fetched]
+            for task in tasks:
+                old = self.by_id.get(task['id'])
+                if old is None:
+                    self._index(task)
+                else:
+                    self._reindex(old, task)
+                self._notify(task['id'], task, revision)
+            found = {task['id'] for task in tasks}
+            deleted = [task_id for task_id in task_ids if task_id not in found]
+            self.backend.note_external(fetched, deleted)
+            for task_id in deleted:
+                if task_id in self.by_id:
+                    self._unindex(task_id)
+                    self._notify(task_id, None, revision)
+
+    def reload(self, revision=None):
+        """Перечитывает все задачи из хранилища."""
+        with self._lock:
+            self.load(self.backend.reload(), revision)
+
+    def _reindex(self, old, task):
+        self._relink(old, task)
+        self._index_datetime(task)
+        if task.get('completed'):
+            self.completed_ids.add(task['id'])
+        else:
+            self.completed_ids.discard(task['id'])
+
+    def _relink(self, old, task):
+        if old.get('parent_id') != task.get('parent_id'):
+            self._unlink(task['id'], old.get('parent_id'))
+            self.children.setdefault(task.get('parent_id'), {})[task['id']] = None
+        self.by_id[task['id']] = task
+
+    def _unlink(self, task_id, parent_id):
+        siblings = self.children.get(parent_id)
+        if siblings is not None:
+            siblings.pop(task_id, None)
+            if not siblings:
+                del self.children[parent_id]
+
+    def _persist(self, task):
+        started = time.monotonic()
+        try:
+            self.backend.put(task.to_dict())
+            save_duration.observe(self.backend.file_path, value=time.monotonic() - started)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения задачи {task.get('id')}: {e}")
@@ -0,0 +1,208 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# С какого числа чатов в _chat_next вычищать чаты с истёкшей паузой
+CHAT_PRUNE_THRESHOLD = 1024
+
+api_latency = metrics.histogram('telegram_api_request_duration_seconds', 'Длительность запроса к Telegram Bot API', ['method'])
+api_errors = metrics.counter('telegram_api_errors_total', 'Ошибки запросов к Telegram Bot API', ['method', 'reason'])
+api_rate_limited = metrics.counter('telegram_api_rate_limited_total', 'Ответы 429 от Telegram Bot API', ['method'])
+api_retries = metrics.counter('telegram_api_retries_total', 'Повторы запросов к Telegram Bot API', ['method'])
+
+
+class TelegramSender:
+    """Очередь исходящих запросов к Telegram Bot API с пулом рабочих потоков.
+
+    Запросы идут через одну requests.Session с пулом keep-alive соединений.
+    Соблюдаются общий лимит Telegram (около 30 сообщений в секунду) и лимит
+    на один чат (не чаще раза в секунду), ответ 429 откладывает повтор на
+    retry_after, сетевые ошибки и 5xx повторяются с экспоненциальной паузой.
+    submit() не блокирует вызывающего и возвращает Future с результатом.
+    """
+
+    def __init__(self, base_url, workers=4, global_rate=30, per_chat_interval=1.0,
+                 max_attempts=5, on_result=None):
+        self.base_url = base_url
+        self.global_rate = global_rate
+        self.per_chat_interval = per_chat_interval
+        self.max_attempts = max_attempts
+        self.on_result = on_result  # on_result(method, chat_id, result, error)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers + 1)
+        self.session.mount('https://', adapter)
+
+        self._heap = []             # (момент готовности, порядковый номер, запрос)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._global_next = 0.0     # ближайший свободный слот общего лимита
+        self._chat_next = {}        # chat_id -> момент, раньше которого в чат не пишем
+        self._chat_prune_at = CHAT_PRUNE_THRESHOLD
+        self._running = True
+        self.stats = {'sent': 0, 'failed': 0, 'retried': 0, 'rate_limited': 0}
+
+        self._workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, method, chat_id, json=None, data=None, files=None):
+        """Ставит запрос в очередь. files: {поле: (имя файла, путь на диске)}."""
+        request = {
+            'method': method,
+            'chat_id': chat_id,
+            'json': json,
+            'data': data,
+            'files': files,
+            'attempts': 0,
+            'future': Future()
+        }
+        self._push(time.monotonic(), request)
+        return request['future']
+
+    def queue_size(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _push(self, ready_at, request):
+        with self._cond:
+            heapq.heappush(self._heap, (ready_at, next(self._seq), request))
+            self._cond.notify()
+
+    def _take(self):
+        """Извлекает готовый к отправке запрос с учётом лимитов или None при остановке."""
+        with self._cond:
+            while self._running:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                ready_at, seq, request = self._heap[0]
+                now = time.monotonic()
+                if ready_at > now:
+                    self._cond.wait(ready_at - now)
+                    continue
+                heapq.heappop(self._heap)
+
+                # Чат или общий лимит ещё заняты - откладываем запрос, не занимая поток
+                slot = max(self._chat_next.get(request['chat_id'], 0.0), self._global_next)
+                if slot > now:
+                    heapq.heappush(self._heap, (slot, seq, request))
+                    continue
+
+                self._global_next = now + 1.0 / self.global_rate
+                self._chat_next[request['chat_id']] = now + self.per_chat_interval
+                self._prune_chats(now)
+                return request
+            return None
+
+    def _prune_chats(self, now):
+        # Прошедшая пауза ничего не ограничивает; порог растёт вместе со
+        # словарём, чтобы чистка оставалась амортизированно O(1) на запрос
+        if len(self._chat_next) < self._chat_prune_at:
+            return
+        self._chat_next = {chat_id: until for chat_id, until in self._chat_next.items() if until > now}
+        self._chat_prune_at = max(CHAT_PRUNE_THRESHOLD, 2 * len(self._chat_next))
+
+    def _worker(self):
+        while True:
+            request = self._take()
+            if request is None:
+                return
+            self._send(request)
+
+    def _send(self, request):
+        # Любая ошибка разбора ответа или обработки завершает только этот запрос, а не поток
+        try:
+            self._attempt(request)
+        except Exception as e:
+            if not request['future'].done():
+                self._finish(request, None, str(e))
+
+    def _attempt(self, request):
+        request['attempts'] += 1
+        opened = []
+        started = time.monotonic()
+        try:
+            files = None
+            if request['files']:
+                files = {}
+                for field, (name, path) in request['files'].items():
+                    f = open(path, 'rb')
+                    opened.append(f)
+                    files[field] = (name, f)
+            response = self.session.post(
+                f"{self.base_url}/{request['method']}",
+                json=request['json'],
+                data=request['data'],
+                files=files,
+                timeout=30 if files else 10
+            )
+        except (requests.exceptions.RequestException, OSError) as e:
+            api_errors.inc(request['method'], 'network')
+            self._retry_or_fail(request, str(e), None)
+            return
+        finally:
+            for f in opened:
+                f.close()
+        api_latency.observe(request['method'], value=time.monotonic() - started)
+
+        if response.status_code == 429:
+            api_rate_limited.inc(request['method'])
+            with self._cond:
+                self.stats['rate_limited'] += 1
+            try:
+                retry_after = response.json().get('parameters', {}).get('retry_after', 1)
+            except ValueError:
+                retry_after = 1
+            self._retry_or_fail(request, response.text, retry_after)
+        elif response.status_code >= 500:
+            api_errors.inc(request['method'], 'server')
+            self._retry_or_fail(request, response.text, None)
+        elif response.status_code != 200:
+            api_errors.inc(request['method'], 'client')
+            self._finish(request, None, f"{response.status_code} - {response.text}")
+        else:
+            self._finish(request, response.json(), None)
+
+    def _retry_or_fail(self, request, error, retry_after):
+        if request['attempts'] >= self.max_attempts:
+            self._finish(request, None, error)
+            return
+        delay = retry_after if retry_after is not None else min(2 ** request['attempts'], 60)
+        api_retries.inc(request['method'])
+        with self._cond:
+            self.stats['retried'] += 1
+            if retry_after is not None:
+                # Telegram просит подождать: не пишем в этот чат до истечения паузы
+                self._chat_next[request['chat_id']] = time.monotonic() + retry_after
+        self._push(time.monotonic() + delay, request)
+
+    def _finish(self, request, result, error):
+        with self._cond:
+            self.stats['failed' if error else 'sent'] += 1
+        if error:
+            logger.error(f"Ошибка Telegram API ({request['method']}, chat {request['chat_id']}): {error}")
+            request['future'].set_exception(RuntimeError(error))
+        else:
+            request['future'].set_result(result)
+        if self.on_result:
+            try:
+                self.on_result(request['method'], request['chat_id'], result, error)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика результата отправки: {e}")
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self.session.close()
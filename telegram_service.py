@@ -1,34 +1,111 @@
 import requests
-from datetime import datetime, timedelta
+from datetime import datetime
 import time
 import threading
+import hmac
 import json
 import os
+import logging
+import metrics
+from reminder_scheduler import ReminderScheduler, task_recipients
+from task_record import due_timestamp
+from contact_directory import ContactDirectory
+from telegram_sender import TelegramSender, api_errors
+from update_dispatcher import UpdateDispatcher
+
+logger = logging.getLogger(__name__)
+
+# Справочник собеседников бота; его читают и процессы, в которых бот не запущен
+REQUESTS_HISTORY_FILE = 'requests_history.json'
+
+
+def load_config():
+    config_path = os.getenv('CONFIG_PATH', os.path.join(os.path.dirname(__file__), 'config.json'))
+    config_dir = os.path.dirname(config_path)
+    
+    if config_dir and not os.path.exists(config_dir):
+        os.makedirs(config_dir, exist_ok=True)
+    
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Конфигурационный файл не найден: {config_path}")
+    except json.JSONDecodeError:
+        raise ValueError(f"Ошибка формата в файле конфигурации: {config_path}")
+
+
+def verify_webhook_secret(secret, token):
+    """Проверяет заголовок X-Telegram-Bot-Api-Secret-Token запроса webhook."""
+    return bool(secret) and hmac.compare_digest(token or '', secret)
+
 
 class TelegramService:
-    def __init__(self):
-        print("Initializing TelegramService")
+    def __init__(self, task_store, get_users):
+        logger.info("Initializing TelegramService")
         
-        config = self._load_config()
+        config = load_config()
         self.bot_token = config.get('TELEGRAM_BOT_TOKEN')
         
         if not self.bot_token:
             raise ValueError("TELEGRAM_BOT_TOKEN не найден в конфигурационном файле")
         
         self.base_url = f'https://api.telegram.org/bot{self.bot_token}'
-        self.tasks_file = 'tasks.json'
-        self.requests_history_file = 'requests_history.json'
+
+        # Способ получения обновлений: polling (getUpdates) или webhook
+        self.mode = config.get('TELEGRAM_MODE', 'polling')
+        self.webhook_url = config.get('TELEGRAM_WEBHOOK_URL')
+        self.webhook_secret = config.get('TELEGRAM_WEBHOOK_SECRET')
+        if self.mode not in ('polling', 'webhook'):
+            raise ValueError(f"Неизвестный TELEGRAM_MODE: {self.mode}")
+        if self.mode == 'webhook' and not self.webhook_secret:
+            raise ValueError("Для режима webhook нужен TELEGRAM_WEBHOOK_SECRET")
+
+        # Исходящие сообщения отправляются асинхронно через пул соединений
+        self.sender = TelegramSender(self.base_url)
+        # Общее с Flask хранилище задач: чтение из памяти, запись через те же мутации
+        self.task_store = task_store
+        self.get_users = get_users
+        self.scheduler = ReminderScheduler(task_store, self._send_reminder)
+        self.requests_history_file = REQUESTS_HISTORY_FILE
+        # Собеседники бота в памяти, файл истории перезаписывается с задержкой
+        self.contacts = ContactDirectory(self.requests_history_file)
+        # file_id загруженных в Telegram вложений по пути файла в task_files
+        self.file_ids_file = 'telegram_file_ids.json'
+        self.file_ids = self._load_file_ids()
+        self._file_ids_lock = threading.Lock()
         self.is_running = False
-        self.sent_reminders = set()
         self.updates_thread = None
 
-        if not os.path.exists(self.requests_history_file):
-            with open(self.requests_history_file, 'w', encoding='utf-8') as f:
-                json.dump([], f)
-
         # Инициализация клавиатуры
         self.reply_keyboard = None
 
+        # Таблица команд: текст команды или кнопки (в нижнем регистре) -> обработчик
+        self.commands = {
+            '/start': self._cmd_start,
+            '/getid': self._cmd_getid,
+            '🆔 мой id (/getid)': self._cmd_getid,
+            '/setname': self._cmd_setname,
+            '/mytasks': self._cmd_mytasks,
+            '📋 мои задачи (/mytasks)': self._cmd_mytasks,
+            '/new_task': self._cmd_new_task,
+            '➕ новая задача (/new_task)': self._cmd_new_task,
+            '/help': self._cmd_help
+        }
+        # Кнопки, после текста которых идёт аргумент команды
+        self.prefix_commands = {
+            '👤 установить имя (/setname)': self._cmd_setname
+        }
+        # Входящие обновления: разные чаты обрабатываются параллельно, один чат - по порядку
+        self.dispatcher = UpdateDispatcher(self.process_update)
+
+        metrics.gauge('bot_update_queue_depth', 'Обновления бота, ожидающие обработки',
+                      fn=lambda: self.dispatcher.stats()['queue_depth'])
+        metrics.gauge('telegram_send_queue_depth', 'Запросы к Telegram, ожидающие отправки',
+                      fn=self.sender.queue_size)
+        metrics.gauge('reminders_scheduled', 'Напоминания в очереди планировщика',
+                      fn=self.scheduler.scheduled_count)
+
     def _show_main_menu(self, chat_id):
         """Показывает главное меню без кнопок"""
         self.send_message(
@@ -36,93 +113,6 @@ class TelegramService:
             "Выберите действие:",
         )
 
-    def handle_updates(self):
-        if self.is_running:
-            print("handle_updates уже запущен, пропускаем")
-            return
-        self.is_running = True
-        print("Starting update handling")
-        last_update_id = None
-        while self.is_running:
-            try:
-                url = f'{self.base_url}/getUpdates'
-                params = {'offset': last_update_id, 'timeout': 30}
-                response = requests.get(url, params=params, timeout=40)
-                if response.status_code != 200:
-                    print(f"Ошибка Telegram API: {response.status_code} - {response.text}")
-                    if response.status_code == 409:
-                        print("Конфликт getUpdates, пытаемся очистить очередь")
-                        last_update_id = None
-                        time.sleep(5)
-                        continue
-                    continue
-                updates = response.json().get('result', [])
-                
-                for update in updates:
-                    last_update_id = update['update_id'] + 1
-                    if 'message' in update and 'text' in update['message']:
-                        chat_id = update['message']['chat']['id']
-                        text = update['message']['text']
-                        username = update['message']['chat'].get('username', '')
-                        name = update['message']['chat'].get('first_name', '') + ' ' + update['message']['chat'].get('last_name', '')
-                        name = name.strip() or username or str(chat_id)
-                        
-                        self._log_request(chat_id, text, username, name)
-                        
-                        # Обработка команд и кнопок
-                        if text == '/start':
-                            welcome_msg = "👋 Добро пожаловать в Task Manager Bot!\n\n" \
-                                        "Я помогу вам управлять вашими задачами и напоминаниями.\n" \
-                                        "Используйте кнопки ниже или команды для работы."
-                            self.send_message(chat_id, welcome_msg)
-                        elif text == '/getid' or text.lower() == '🆔 мой id (/getid)':
-                            self.send_message(chat_id, f"Ваш Telegram ID: `{chat_id}`")
-                        elif text.startswith('/setname') or text.lower().startswith('👤 установить имя (/setname)'):
-                            name = text[9:].strip() if text.startswith('/setname') else text[25:].strip()
-                            if not name:
-                                self.send_message(chat_id, "Пожалуйста, укажите имя после команды, например:\n/setname Иван\nили нажмите кнопку 'Установить имя' и введите имя")
-                            else:
-                                self._log_request(chat_id, text, username, name)
-                                self.send_message(chat_id, f"Имя '{name}' успешно установлено!")
-                        elif text.lower() == '/mytasks' or text.lower() == '📋 мои задачи (/mytasks)':
-                            tasks = self.get_user_tasks_for_week(chat_id)
-                            if not tasks:
-                                self.send_message(chat_id, "У вас нет задач на ближайшую неделю.")
-                            else:
-                                message = "*Ваши задачи на ближайшую неделю:*\n\n"
-                                for i, task in enumerate(tasks, 1):
-                                    message += f"{i}. {self._format_task_message(task)}\n"
-                                self.send_message(chat_id, message)
-                        elif text.lower() == '/new_task' or text.lower() == '➕ новая задача (/new_task)':
-                            example_date = datetime.now().strftime('%d.%m.%Y %H:%M')
-                            help_text = f"""📝 *Создание новой задачи*
-
-Отправьте сообщение в формате:
-"Название задачи" "Дата и время"
-
-🔹 *Обязательно используйте кавычки*
-🔹 *Формат даты*: ДД.ММ.ГГГГ ЧЧ:ММ
-
-Пример для текущего момента:
-"Моя задача" "{example_date}"
-"""
-                            self.send_message(chat_id, help_text)
-                        else:
-                            # Обработка создания новой задачи
-                            if self._is_task_creation_message(text):
-                                task_data = self._parse_task_creation(text)
-                                if task_data:
-                                    self._create_task(chat_id, task_data)
-                                    self.send_message(chat_id, f"✅ Задача создана:\n\n*{task_data['text']}*\nНа *{task_data['datetime']}*")
-                                else:
-                                    self.send_message(chat_id, "❌ Неверный формат задачи. Пожалуйста, используйте формат:\n\"Название задачи\" \"ДД.ММ.ГГГГ ЧЧ:ММ\"")
-                            else:
-                                self._show_main_menu(chat_id)
-            
-            except requests.exceptions.RequestException as e:
-                print(f"Ошибка при обработке обновлений: {e}")
-            time.sleep(5)
-
     def _is_task_creation_message(self, text):
         """Проверяет, является ли сообщение попыткой создания задачи"""
         return text.count('"') >= 2
@@ -149,20 +139,10 @@ class TelegramService:
         return None
 
     def _create_task(self, chat_id, task_data):
-        """Создает новую задачу и сохраняет в файл"""
+        """Создает новую задачу в общем хранилище задач"""
         try:
-            # Загружаем существующие задачи
-            tasks = []
-            if os.path.exists(self.tasks_file):
-                with open(self.tasks_file, 'r', encoding='utf-8') as f:
-                    tasks = json.load(f)
-            
-            # Генерируем ID для новой задачи
-            new_id = max([t.get('id', 0) for t in tasks] or [0]) + 1
-            
-            # Создаем новую задачу
+            # Создаем новую задачу, ID выдаёт хранилище
             new_task = {
-                'id': new_id,
                 'text': task_data['text'],
                 'datetime': task_data['datetime'],
                 'chat_id': chat_id,
@@ -170,48 +150,34 @@ class TelegramService:
                 'completed': False
             }
             
-            tasks.append(new_task)
-            
-            # Сохраняем обратно в файл
-            with open(self.tasks_file, 'w', encoding='utf-8') as f:
-                json.dump(tasks, f, indent=2, ensure_ascii=False)
+            self.task_store.create(new_task)
             
             return True
         except Exception as e:
-            print(f"Ошибка при создании задачи: {e}")
+            logger.error(f"Ошибка при создании задачи: {e}")
             return False
 
     def get_user_tasks_for_week(self, chat_id):
         """Получает задачи пользователя на ближайшие 7 дней."""
         try:
-            with open(self.tasks_file, 'r', encoding='utf-8') as f:
-                tasks = json.load(f)
-            
-            now = datetime.now()
-            week_later = now + timedelta(days=7)
+            now = time.time()
+            week_later = now + 7 * 24 * 3600
+            user_groups = {u.get('group') for u in self.get_users() if u['chat_id'] == chat_id}
+            user_groups.discard(None)
             
             user_tasks = []
-            for task in tasks:
-                if not task.get('datetime') or task.get('completed'):
+            for task in self.task_store.snapshot():
+                # Срок уже разобран в записи задачи (due_ts)
+                task_time = task.due_ts
+                if task_time is None or task.completed or not now <= task_time <= week_later:
                     continue
                     
-                task_time = datetime.fromisoformat(task['datetime'])
-                if (task.get('chat_id') == chat_id or 
-                    (task.get('group') and any(u['chat_id'] == chat_id and u.get('group') == task['group'] for u in self._get_users()))):
-                    if now <= task_time <= week_later:
-                        user_tasks.append(task)
+                if task.chat_id == chat_id or (task.group and task.group in user_groups):
+                    user_tasks.append(task)
             
             return user_tasks
         except Exception as e:
-            print(f"Ошибка при получении задач пользователя: {e}")
-            return []
-
-    def _get_users(self):
-        """Получает список пользователей из файла users.json."""
-        try:
-            with open('users.json', 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
+            logger.error(f"Ошибка при получении задач пользователя: {e}")
             return []
 
     def _format_task_message(self, task):
@@ -221,9 +187,9 @@ class TelegramService:
             message += f"\n*📝 Описание:*\n{task['description']}\n"
         if task.get('category'):
             message += f"\n*🏷️ Категория:* {task['category']}\n"
-        if task.get('datetime'):
-            task_time = datetime.fromisoformat(task['datetime'])
-            message += f"\n*⏰ Время выполнения:* {task_time.strftime('%d.%m.%Y %H:%M')}\n"
+        task_time = due_timestamp(task)
+        if task_time is not None:
+            message += f"\n*⏰ Время выполнения:* {datetime.fromtimestamp(task_time).strftime('%d.%m.%Y %H:%M')}\n"
         if task.get('reminder_time'):
             message += f"\n*🔔 Напоминание за:* {task['reminder_time']} мин.\n"
         if task.get('group'):
@@ -251,214 +217,222 @@ class TelegramService:
         return message
 
     def check_reminders(self):
-        print("Starting reminder checks")
-        while True:
-            try:
-                with open(self.tasks_file, 'r', encoding='utf-8') as f:
-                    tasks = json.load(f)
-        
-                current_time = datetime.now()
-        
-                for task in tasks:
-                    task_id = task.get('id')
-                    # Получаем всех получателей - либо из chat_ids, либо из chat_id
-                    recipients = []
-                    if task.get('chat_ids'):
-                        recipients.extend(task['chat_ids'])
-                    elif task.get('chat_id'):
-                        recipients.append(task['chat_id'])
-                
-                    if (task.get('datetime') and recipients and not task.get('completed') 
-                        and task.get('reminder_time') is not None and task_id not in self.sent_reminders):
-                
-                        task_time = datetime.fromisoformat(task['datetime'])
-                        reminder_minutes = int(task['reminder_time'])
-                        reminder_time = task_time - timedelta(minutes=reminder_minutes)
-                
-                        if current_time >= reminder_time and current_time <= reminder_time + timedelta(minutes=1):
-                            # Формируем сообщение с описанием
-                            message = "*🔔 Напоминание о задаче:*\n\n"
-                            message += self._format_task_message(task)
-                    
-                            # Отправляем каждому получателю
-                            for chat_id in recipients:
-                                self.send_message(chat_id, message)
-                        
-                                # Если есть файлы, отправляем их
-                                if task.get('files'):
-                                    for file_info in task['files']:
-                                        try:
-                                            file_path = os.path.join('task_files', file_info['path'])
-                                            if os.path.exists(file_path):
-                                                with open(file_path, 'rb') as file:
-                                                    url = f'{self.base_url}/sendDocument'
-                                                    files = {'document': (file_info['name'], file)}
-                                                    data = {'chat_id': chat_id}
-                                                    response = requests.post(url, files=files, data=data)
-                                                    if response.status_code != 200:
-                                                        print(f"Ошибка отправки файла: {response.text}")
-                                        except Exception as e:
-                                            print(f"Ошибка при отправке файла {file_info['name']}: {e}")
-                    
-                            self.sent_reminders.add(task_id)
-                            print(f"Sent reminders for task {task_id} to {len(recipients)} recipients")
-    
-            except Exception as e:
-                print(f"Ошибка при проверке напоминаний: {e}")
-    
-            time.sleep(60)
+        """Поток напоминаний: спит до ближайшего напоминания в очереди планировщика."""
+        logger.info("Starting reminder checks")
+        self.scheduler.run()
 
-    def _load_config(self):
-        config_path = os.getenv('CONFIG_PATH', os.path.join(os.path.dirname(__file__), 'config.json'))
-        config_dir = os.path.dirname(config_path)
-        
-        if config_dir and not os.path.exists(config_dir):
-            os.makedirs(config_dir, exist_ok=True)
-        
-        try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            raise FileNotFoundError(f"Конфигурационный файл не найден: {config_path}")
-        except json.JSONDecodeError:
-            raise ValueError(f"Ошибка формата в файле конфигурации: {config_path}")
+    def _send_reminder(self, task):
+        task_id = task.get('id')
+        recipients = task_recipients(task)
 
-    def _log_request(self, chat_id, text, username=None, name=None):
+        # Формируем сообщение с описанием
+        message = "*🔔 Напоминание о задаче:*\n\n"
+        message += self._format_task_message(task)
+
+        # Отправляем каждому получателю
+        for chat_id in recipients:
+            self.send_message(chat_id, message)
+
+        # Если есть файлы, отправляем их
+        for file_info in task.get('files') or []:
+            self._send_file(file_info, recipients)
+
+        logger.info(f"Queued reminders for task {task_id} to {len(recipients)} recipients")
+
+    def _send_file(self, file_info, recipients):
+        """Отправляет вложение получателям, загружая сам файл в Telegram один раз.
+
+        file_id из ответа на первую загрузку запоминается по пути файла, и
+        остальные получатели, копии повторяющейся задачи и следующие
+        напоминания ссылаются на него параллельно, без повторной загрузки.
+        """
+        if not recipients:
+            return
+        file_id = self.file_ids.get(file_info['path'])
+        if file_id:
+            for chat_id in recipients:
+                self.sender.submit('sendDocument', chat_id, data={'chat_id': chat_id, 'document': file_id})
+            return
+
+        file_path = os.path.join('task_files', file_info['path'])
+        if not os.path.exists(file_path):
+            return
+        chat_id, rest = recipients[0], recipients[1:]
+        future = self.sender.submit('sendDocument', chat_id, data={'chat_id': chat_id},
+                                    files={'document': (file_info['name'], file_path)})
+
+        def on_uploaded(done):
+            if done.exception():
+                # Загрузка не удалась - пробуем загрузить файл следующему получателю
+                logger.error(f"Ошибка при отправке файла {file_info['name']}: {done.exception()}")
+                self._send_file(file_info, rest)
+                return
+            file_id = self._extract_file_id(done.result())
+            if file_id:
+                self._remember_file_id(file_info['path'], file_id)
+                self._send_file(file_info, rest)
+            else:
+                for other in rest:
+                    self.sender.submit('sendDocument', other, data={'chat_id': other},
+                                       files={'document': (file_info['name'], file_path)})
+
+        future.add_done_callback(on_uploaded)
+
+    def _extract_file_id(self, response):
+        result = (response or {}).get('result', {})
+        # Telegram может распознать документ как анимацию, видео, аудио и т.п.
+        for field in ('document', 'animation', 'video', 'audio', 'voice', 'sticker'):
+            if result.get(field, {}).get('file_id'):
+                return result[field]['file_id']
+        return None
+
+    def _load_file_ids(self):
         try:
-            with open(self.requests_history_file, 'r', encoding='utf-8') as f:
-                history = json.load(f)
+            with open(self.file_ids_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
         except (FileNotFoundError, json.JSONDecodeError):
-            history = []
-
-        # Проверяем, есть ли запись с таким chat_id
-        for entry in history:
-            if entry.get('chat_id') == chat_id:
-                # Обновляем существующую запись
-                entry.update({
-                    'text': text,
-                    'username': username or entry.get('username', ''),
-                    'name': name or entry.get('name', str(chat_id)),
-                    'timestamp': datetime.now().isoformat()
-                })
-                break
-        else:
-            # Если записи нет, добавляем новую
-            history.append({
-                'chat_id': chat_id,
-                'text': text,
-                'username': username,
-                'name': name or str(chat_id),
-                'timestamp': datetime.now().isoformat()
-            })
+            return {}
+
+    def _remember_file_id(self, path, file_id):
+        with self._file_ids_lock:
+            self.file_ids[path] = file_id
+            try:
+                with open(self.file_ids_file, 'w', encoding='utf-8') as f:
+                    json.dump(self.file_ids, f, indent=2)
+            except OSError as e:
+                logger.error(f"Ошибка сохранения {self.file_ids_file}: {e}")
 
-        with open(self.requests_history_file, 'w', encoding='utf-8') as f:
-            json.dump(history, f, indent=2)
+    def _log_request(self, chat_id, text, username=None, name=None):
+        self.contacts.record(chat_id, text, username, name)
 
     def send_message(self, chat_id, text):
-        try:
-            url = f'{self.base_url}/sendMessage'
-            payload = {
-                'chat_id': chat_id,
-                'text': text,
-                'parse_mode': 'Markdown'
-            }
-            response = requests.post(url, json=payload, timeout=10)
-            if response.status_code != 200:
-                print(f"Ошибка Telegram API: {response.status_code} - {response.text}")
-                return None
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Ошибка отправки сообщения в Telegram: {e}")
-            return None
+        """Ставит сообщение в очередь отправки и возвращает Future с ответом API."""
+        payload = {
+            'chat_id': chat_id,
+            'text': text,
+            'parse_mode': 'Markdown'
+        }
+        return self.sender.submit('sendMessage', chat_id, json=payload)
 
     def get_chat_id_by_username(self, username):
         """Получает chat_id и имя по username из истории, учитывая возможное отсутствие @."""
-        try:
-            with open(self.requests_history_file, 'r', encoding='utf-8') as f:
-                history = json.load(f)
-            # Удаляем @ из переданного username для поиска
-            normalized_username = username.lstrip('@')
-            for entry in history:
-                if entry.get('username') and normalized_username == entry.get('username').lstrip('@'):
-                    return {
-                        'chat_id': entry['chat_id'],
-                        'name': entry.get('name', username)
-                    }
-            
-            print(f"Пользователь {username} не найден в истории взаимодействий")
-            return None
-        except Exception as e:
-            print(f"Ошибка при получении chat_id: {e}")
+        entry = self.contacts.find_by_username(username)
+        if not entry:
+            logger.warning(f"Пользователь {username} не найден в истории взаимодействий")
             return None
+        return {
+            'chat_id': entry['chat_id'],
+            'name': entry.get('name', username)
+        }
 
     def handle_updates(self):
+        """Режим polling: длинный опрос getUpdates и обработка каждого обновления."""
         if self.is_running:
-            print("handle_updates уже запущен, пропускаем")
+            logger.warning("handle_updates уже запущен, пропускаем")
             return
         self.is_running = True
-        print("Starting update handling")
+        logger.info("Starting update handling")
+        # getUpdates не работает, пока у бота установлен webhook
+        try:
+            self.sender.submit('deleteWebhook', None).result(timeout=60)
+        except Exception as e:
+            logger.error(f"Не удалось снять webhook: {e}")
         last_update_id = None
         while self.is_running:
             try:
                 url = f'{self.base_url}/getUpdates'
                 params = {'offset': last_update_id, 'timeout': 30}
-                response = requests.get(url, params=params, timeout=40)
+                response = self.sender.session.get(url, params=params, timeout=40)
                 if response.status_code != 200:
-                    print(f"Ошибка Telegram API: {response.status_code} - {response.text}")
+                    logger.error(f"Ошибка Telegram API: {response.status_code} - {response.text}")
+                    api_errors.inc('getUpdates', 'server' if response.status_code >= 500 else 'client')
                     if response.status_code == 409:
-                        print("Конфликт getUpdates, пытаемся очистить очередь")
+                        logger.warning("Конфликт getUpdates, пытаемся очистить очередь")
                         last_update_id = None
-                        time.sleep(5)
-                        continue
+                    time.sleep(5)
                     continue
                 updates = response.json().get('result', [])
             
                 for update in updates:
                     last_update_id = update['update_id'] + 1
-                    if 'message' in update and 'text' in update['message']:
-                        chat_id = update['message']['chat']['id']
-                        text = update['message']['text']
-                        username = update['message']['chat'].get('username', '')
-                        name = update['message']['chat'].get('first_name', '') + ' ' + update['message']['chat'].get('last_name', '')
-                        name = name.strip() or username or str(chat_id)
-                    
-                        self._log_request(chat_id, text, username, name)
-                    
-                        # Обработка команды /start
-                        if text == '/start':
-                            welcome_msg = "👋 Добро пожаловать в Task Manager Bot!\n\n" \
-                                        "Я помогу вам управлять вашими задачами и напоминаниями.\n" \
-                                        "Используйте кнопки ниже или команды для работы."
-                            self.send_message(chat_id, welcome_msg)
-                    
-                        # Обработка команды /getid
-                        elif text == '/getid' or text.lower() == '🆔 мой id (/getid)':
-                            self.send_message(chat_id, f"Ваш Telegram ID: `{chat_id}`")
-                    
-                        # Обработка команды /setname
-                        elif text.startswith('/setname') or text.lower().startswith('👤 установить имя (/setname)'):
-                            name = text[9:].strip() if text.startswith('/setname') else text[25:].strip()
-                            if not name:
-                                self.send_message(chat_id, "Пожалуйста, укажите имя после команды, например:\n/setname Иван\nили нажмите кнопку 'Установить имя' и введите имя")
-                            else:
-                                self._log_request(chat_id, text, username, name)
-                                self.send_message(chat_id, f"Имя '{name}' успешно установлено!")
-                    
-                        # Обработка команды /mytasks
-                        elif text.lower() == '/mytasks' or text.lower() == '📋 мои задачи (/mytasks)':
-                            tasks = self.get_user_tasks_for_week(chat_id)
-                            if not tasks:
-                                self.send_message(chat_id, "У вас нет задач на ближайшую неделю.")
-                            else:
-                                message = "*Ваши задачи на ближайшую неделю:*\n\n"
-                                for i, task in enumerate(tasks, 1):
-                                    message += f"{i}. {self._format_task_message(task)}\n"
-                                self.send_message(chat_id, message)
-                    
-                        # Обработка команды /new_task
-                        elif text.lower() == '/new_task' or text.lower() == '➕ новая задача (/new_task)':
-                            example_date = datetime.now().strftime('%d.%m.%Y %H:%M')
-                            help_text = f"""📝 *Создание новой задачи*
+                    self.dispatch_update(update)
+        
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Ошибка при обработке обновлений: {e}")
+                api_errors.inc('getUpdates', 'network')
+                time.sleep(5)
+
+    def dispatch_update(self, update):
+        """Ставит обновление в очередь обработки; порядок сохраняется в пределах чата."""
+        chat_id = update.get('message', {}).get('chat', {}).get('id')
+        self.dispatcher.submit(chat_id, update)
+
+    def process_update(self, update):
+        """Обрабатывает одно обновление Telegram (из getUpdates или webhook)."""
+        if 'message' in update and 'text' in update['message']:
+            chat_id = update['message']['chat']['id']
+            text = update['message']['text']
+            username = update['message']['chat'].get('username', '')
+            name = update['message']['chat'].get('first_name', '') + ' ' + update['message']['chat'].get('last_name', '')
+            name = name.strip() or username or str(chat_id)
+        
+            self._log_request(chat_id, text, username, name)
+
+            handler, args = self._route(text)
+            if handler:
+                handler(chat_id, args, text, username)
+            # Обработка создания задачи
+            elif self._is_task_creation_message(text):
+                self._handle_task_creation(chat_id, text)
+            # Обработка неизвестных команд
+            else:
+                self._show_main_menu(chat_id)
+
+    def _route(self, text):
+        """Находит обработчик команды: (обработчик, аргументы) или (None, None)."""
+        lowered = text.lower()
+        handler = self.commands.get(lowered)
+        if handler:
+            return handler, ''
+        # Команды с аргументом, в том числе с именем бота: /setname@bot Иван
+        command, _, args = text.partition(' ')
+        handler = self.commands.get(command.split('@', 1)[0].lower())
+        if handler:
+            return handler, args.strip()
+        for prefix, handler in self.prefix_commands.items():
+            if lowered.startswith(prefix):
+                return handler, text[len(prefix):].strip()
+        return None, None
+
+    def _cmd_start(self, chat_id, args, text, username):
+        welcome_msg = "👋 Добро пожаловать в Task Manager Bot!\n\n" \
+                    "Я помогу вам управлять вашими задачами и напоминаниями.\n" \
+                    "Используйте кнопки ниже или команды для работы."
+        self.send_message(chat_id, welcome_msg)
+
+    def _cmd_getid(self, chat_id, args, text, username):
+        self.send_message(chat_id, f"Ваш Telegram ID: `{chat_id}`")
+
+    def _cmd_setname(self, chat_id, args, text, username):
+        if not args:
+            self.send_message(chat_id, "Пожалуйста, укажите имя после команды, например:\n/setname Иван\nили нажмите кнопку 'Установить имя' и введите имя")
+        else:
+            self._log_request(chat_id, text, username, args)
+            self.send_message(chat_id, f"Имя '{args}' успешно установлено!")
+
+    def _cmd_mytasks(self, chat_id, args, text, username):
+        tasks = self.get_user_tasks_for_week(chat_id)
+        if not tasks:
+            self.send_message(chat_id, "У вас нет задач на ближайшую неделю.")
+        else:
+            message = "*Ваши задачи на ближайшую неделю:*\n\n"
+            for i, task in enumerate(tasks, 1):
+                message += f"{i}. {self._format_task_message(task)}\n"
+            self.send_message(chat_id, message)
+
+    def _cmd_new_task(self, chat_id, args, text, username):
+        example_date = datetime.now().strftime('%d.%m.%Y %H:%M')
+        help_text = f"""📝 *Создание новой задачи*
 
 Отправьте сообщение в формате:
 "Название задачи" "Дата и время"
@@ -469,11 +443,10 @@ class TelegramService:
 Пример для текущего момента:
 "Моя задача" "{example_date}"
 """
-                            self.send_message(chat_id, help_text)
-                    
-                        # Обработка команды /help
-                        elif text.lower() == '/help':
-                            help_text = """🤖 *Меню бота*:
+        self.send_message(chat_id, help_text)
+
+    def _cmd_help(self, chat_id, args, text, username):
+        help_text = """🤖 *Меню бота*:
 
 📝 /new_task - Создать новую задачу
 📋 /mytasks - Показать задачи на неделю
@@ -485,39 +458,60 @@ class TelegramService:
 "Название" "Дата время"
 Пример: "Встреча" "25.07.2023 15:30"
 """
-                            self.send_message(chat_id, help_text)
-                    
-                        # Обработка создания задачи
-                        elif self._is_task_creation_message(text):
-                            task_data = self._parse_task_creation(text)
-                            if task_data:
-                                if self._create_task(chat_id, task_data):
-                                    self.send_message(chat_id, f"✅ Задача создана:\n\n*{task_data['text']}*\nНа *{datetime.fromisoformat(task_data['datetime']).strftime('%d.%m.%Y %H:%M')}*")                
-                                else:
-                                    self.send_message(chat_id, "❌ Ошибка при создании задачи")
-                            else:
-                                self.send_message(chat_id, "❌ Неверный формат задачи. Пожалуйста, используйте формат:\n\"Название задачи\" \"ДД.ММ.ГГГГ ЧЧ:ММ\"")
-                    
-                        # Обработка неизвестных команд
-                        else:
-                            self._show_main_menu(chat_id)
-        
-            except requests.exceptions.RequestException as e:
-                print(f"Ошибка при обработке обновлений: {e}")
-            time.sleep(5)
+        self.send_message(chat_id, help_text)
+
+    def _handle_task_creation(self, chat_id, text):
+        task_data = self._parse_task_creation(text)
+        if task_data:
+            if self._create_task(chat_id, task_data):
+                self.send_message(chat_id, f"✅ Задача создана:\n\n*{task_data['text']}*\nНа *{datetime.fromisoformat(task_data['datetime']).strftime('%d.%m.%Y %H:%M')}*")                
+            else:
+                self.send_message(chat_id, "❌ Ошибка при создании задачи")
+        else:
+            self.send_message(chat_id, "❌ Неверный формат задачи. Пожалуйста, используйте формат:\n\"Название задачи\" \"ДД.ММ.ГГГГ ЧЧ:ММ\"")
+
+    def get_stats(self):
+        """Состояние очередей бота: входящие обновления и исходящие запросы."""
+        return {
+            'updates': self.dispatcher.stats(),
+            'outgoing': dict(self.sender.stats, queue_depth=self.sender.queue_size())
+        }
+
+    def verify_webhook_secret(self, token):
+        """Проверяет заголовок X-Telegram-Bot-Api-Secret-Token запроса webhook."""
+        return verify_webhook_secret(self.webhook_secret, token)
+
+    def _set_webhook(self):
+        if not self.webhook_url:
+            # Без адреса webhook можно проверять локально, отправляя обновления POST-запросом
+            logger.warning("TELEGRAM_WEBHOOK_URL не задан, webhook в Telegram не регистрируется")
+            return
+        self.sender.submit('setWebhook', None, json={
+            'url': self.webhook_url,
+            'secret_token': self.webhook_secret,
+            'allowed_updates': ['message']
+        })
 
     def start_reminder_thread(self):
-        print("Starting reminder and update threads")
+        logger.info("Starting reminder and update threads")
         if self.updates_thread and self.updates_thread.is_alive():
-            print("Updates thread already running, skipping")
+            logger.warning("Updates thread already running, skipping")
             return
         reminder_thread = threading.Thread(target=self.check_reminders, daemon=True)
-        self.updates_thread = threading.Thread(target=self.handle_updates, daemon=True)
         reminder_thread.start()
+        if self.mode == 'webhook':
+            # Обновления приходят в Flask на /telegram/webhook
+            self._set_webhook()
+            return
+        self.updates_thread = threading.Thread(target=self.handle_updates, daemon=True)
         self.updates_thread.start()
 
     def stop(self):
-        print("Stopping TelegramService")
+        logger.info("Stopping TelegramService")
         self.is_running = False
+        self.scheduler.stop()
+        self.dispatcher.stop()
+        self.sender.stop()
+        self.contacts.close()
         if self.updates_thread:
             self.updates_thread = None
\ No newline at end of file
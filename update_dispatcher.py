@@ -0,0 +1,94 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+handler_latency = metrics.histogram('bot_update_handler_duration_seconds', 'Длительность обработки обновления бота')
+update_wait = metrics.histogram('bot_update_wait_seconds', 'Время обновления бота в очереди до обработки')
+
+
+class UpdateDispatcher:
+    """Параллельная обработка обновлений бота с сохранением порядка внутри чата.
+
+    У каждого чата своя очередь. Рабочий поток берёт чат из общей очереди
+    готовых чатов и обрабатывает одно его обновление; пока обновление
+    обрабатывается, чат не попадает к другим потокам, поэтому сообщения
+    одного чата идут строго по порядку, а разные чаты - параллельно.
+    """
+
+    def __init__(self, handler, workers=4):
+        self.handler = handler  # handler(update)
+        self._lock = threading.Lock()
+        self._pending = {}           # chat_id -> deque[(обновление, момент постановки)]
+        self._active = set()         # чаты в очереди готовых или в обработке
+        self._ready = queue.Queue()
+        self._handled = 0
+        self._errors = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._wait_total = 0.0
+        self._workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, chat_id, update):
+        with self._lock:
+            self._pending.setdefault(chat_id, deque()).append((update, time.monotonic()))
+            if chat_id in self._active:
+                return
+            self._active.add(chat_id)
+        self._ready.put(chat_id)
+
+    def _worker(self):
+        while True:
+            chat_id = self._ready.get()
+            if chat_id is _STOP:
+                return
+            with self._lock:
+                update, queued_at = self._pending[chat_id].popleft()
+            started = time.monotonic()
+            try:
+                self.handler(update)
+            except Exception as e:
+                with self._lock:
+                    self._errors += 1
+                logger.error(f"Ошибка при обработке обновления из чата {chat_id}: {e}")
+            finished = time.monotonic()
+            handler_latency.observe(value=finished - started)
+            update_wait.observe(value=started - queued_at)
+            with self._lock:
+                self._handled += 1
+                self._wait_total += started - queued_at
+                self._latency_total += finished - started
+                self._latency_max = max(self._latency_max, finished - started)
+                if self._pending[chat_id]:
+                    # В чате есть следующие сообщения - возвращаем его в очередь готовых
+                    self._ready.put(chat_id)
+                else:
+                    del self._pending[chat_id]
+                    self._active.discard(chat_id)
+
+    def stats(self):
+        with self._lock:
+            handled = self._handled or 1
+            return {
+                'queue_depth': sum(len(updates) for updates in self._pending.values()),
+                'busy_chats': len(self._active),
+                'handled': self._handled,
+                'errors': self._errors,
+                'avg_wait_seconds': self._wait_total / handled,
+                'avg_handler_seconds': self._latency_total / handled,
+                'max_handler_seconds': self._latency_max
+            }
+
+    def stop(self):
+        for _ in self._workers:
+            self._ready.put(_STOP)
+
+
+_STOP = object()